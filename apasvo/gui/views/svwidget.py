@@ -41,7 +41,6 @@ import datetime
 
 from apasvo.gui.views import takanamidialog
 from apasvo.gui.views import settingsdialog
-from apasvo.picking import envelope as env
 from apasvo.picking import apasvotrace as rc
 from apasvo.utils import plotting
 from apasvo.utils import clt
@@ -900,7 +899,7 @@ class SignalViewerWidget(QtGui.QWidget):
         self.document = document
         self.fs = self.document.record.fs
         self.signal = self.document.record.signal
-        self.envelope = env.envelope(self.signal)
+        self.envelope = self.document.record.envelope
         self.cf = self.document.record.cf
         self.time = np.linspace(0, len(self.signal) / self.fs, num=len(self.signal), endpoint=False)
         self.xmax = self.time[-1]
@@ -27,8 +27,21 @@
 import numpy as np
 from scipy import signal
 import collections
+import itertools
+import threading
+from multiprocessing.pool import ThreadPool
 
 from apasvo.picking import findpeaks
+from apasvo.utils import fftutils
+from apasvo.utils import resample
+
+
+# Length of the kernels of the multi-band filter bank
+BAND_FILTER_LENGTH = 512
+# Length of the blocks of data processed at once in low memory mode
+LOW_MEMORY_BLOCK_LENGTH = 2 ** 16
+# Samples kept before the start of the kernels of a decimated filter bank
+DECIMATED_KERNEL_LEAD = 32
 
 
 def prctile(x, p):
@@ -59,20 +72,520 @@ def prctile(x, p):
         if iterable:
             return np.empty(len(p)) * np.nan
         return np.nan
-    sorted_x = np.sort(x)
     # If p == 50 make the median fast
-    if p == 50:
-        return np.median(sorted_x)
+    if not iterable and p == 50:
+        return np.median(x)
+    n = len(x)
     q = np.hstack([0,
-                   100 * np.linspace(0.5, len(x) - 0.5, len(x)) / len(x),
+                   100 * np.linspace(0.5, n - 0.5, n) / n,
                    100])
-    xx = np.hstack([sorted_x[0], sorted_x, sorted_x[-1]])
+    # The interpolation only reads the two order statistics around each
+    # percentile, so a partial sort (linear time selection) is enough
+    j = np.clip(np.searchsorted(q, p, side='right') - 1, 0, n)
+    kth = np.unique(np.clip(np.hstack([j - 1, j]), 0, n - 1))
+    partial_x = np.partition(x, kth)
+    xx = np.hstack([partial_x[0], partial_x, partial_x[-1]])
     return np.interp(p, q, xx)
 
 
+class PercentileSketch(object):
+    """Approximate percentile estimator for data streams.
+
+    Counts the values it is fed on logarithmically spaced buckets, so any
+    percentile can be estimated with a relative error bounded by
+    'relative_accuracy' while using an amount of memory that depends on
+    the dynamic range of the data instead of on its length. See:
+
+    Masson, C., Rim, J. E., & Lee, H. K. (2019).
+    DDSketch: A Fast and Fully-Mergeable Quantile Sketch with
+    Relative-Error Guarantees.
+    Proceedings of the VLDB Endowment, Volume: 12, Issue: 12, pp. 2195 - 2205
+
+    It is an opt-in alternative to 'prctile' for data that does not fit in
+    memory or arrives in chunks, e.g. the percentiles of a characteristic
+    function over a whole day of 'AmpaStream' output. AMPA itself always
+    computes its noise thresholds exactly, window by window.
+
+    Attributes:
+        relative_accuracy: Relative error bound of the value returned for
+            any percentile with respect to the closest order statistic
+            of the data. Default: 0.01.
+        count: Number of values seen so far.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        super(PercentileSketch, self).__init__()
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy should be in range (0, 1)")
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1. + relative_accuracy) / (1. - relative_accuracy)
+        self._log_gamma = np.log(self._gamma)
+        self.clear()
+
+    def clear(self):
+        """Forgets every value seen so far."""
+        self.count = 0
+        self._zeros = 0
+        self._positive = np.zeros(0, dtype=int)
+        self._positive_offset = 0
+        self._negative = np.zeros(0, dtype=int)
+        self._negative_offset = 0
+
+    def update(self, x):
+        """Adds a chunk of data to the sketch.
+
+        Args:
+            x: Data, numpy array type.
+        """
+        x = np.ravel(x)
+        self.count += len(x)
+        self._zeros += np.count_nonzero(x == 0)
+        self._positive, self._positive_offset = self._add(
+            self._positive, self._positive_offset, x[x > 0])
+        self._negative, self._negative_offset = self._add(
+            self._negative, self._negative_offset, -x[x < 0])
+
+    def _add(self, counts, offset, x):
+        """Adds positive values to a set of bucket counts.
+
+        Bucket k holds the values in range (gamma ** (k - 1), gamma ** k],
+        counts[i] is the count of bucket offset + i.
+        """
+        if len(x) == 0:
+            return counts, offset
+        keys = np.ceil(np.log(x) / self._log_gamma).astype(int)
+        lo, hi = keys.min(), keys.max() + 1
+        if len(counts) > 0:
+            lo, hi = min(lo, offset), max(hi, offset + len(counts))
+        new_counts = np.bincount(keys - lo, minlength=hi - lo)
+        new_counts[offset - lo:offset - lo + len(counts)] += counts
+        return new_counts, lo
+
+    def percentile(self, p):
+        """Estimates a percentile of the data seen so far.
+
+        Args:
+            p: A percentage in the range [0,100], or a list of them.
+
+        Returns:
+            The estimated 'p' percentile of the data, or nan if no data
+            has been seen yet.
+        """
+        p_array = np.asarray(p, dtype=float)
+        if np.any(p_array < 0) or np.any(p_array > 100):
+            raise ValueError("p should be in range [0, 100]")
+        if self.count == 0:
+            return p_array * np.nan
+        # Representative value of each bucket, in ascending order
+        positive_keys = self._positive_offset + np.arange(len(self._positive))
+        negative_keys = self._negative_offset + np.arange(len(self._negative))
+        values = np.hstack([-self._value(negative_keys[::-1]),
+                            0.,
+                            self._value(positive_keys)])
+        counts = np.hstack([self._negative[::-1],
+                            self._zeros,
+                            self._positive])
+        # Same ranks as 'prctile', rounded to the closest order statistic
+        rank = np.clip(np.round(p_array * self.count / 100. - 0.5),
+                       0, self.count - 1)
+        return values[np.searchsorted(np.cumsum(counts), rank, side='right')]
+
+    def _value(self, keys):
+        return 2. * self._gamma ** keys / (self._gamma + 1.)
+
+
+class FilterBank(object):
+    """Bank of band-pass filters of the AMPA multi-band analysis.
+
+    Holds the kernels of each band, 'h0', their Hilbert transformed
+    counterparts, 'h0o', and the spectra of both sets of kernels, computed
+    for a given signal length so that filtering a window of data reduces to
+    a product in the frequency domain.
+
+    The kernels span a fixed number of samples of the rate they are
+    designed for. A bank for signals decimated by a factor 'decimation'
+    is designed at the original rate, fs * decimation, and its kernels
+    are then low-pass filtered and decimated, so the responses of the
+    bands below the Nyquist frequency of 'fs' are the same at both rates.
+    Low-pass filtering spreads the kernels before their start, so their
+    first 'lead' samples come before it and the output of the filters
+    must be advanced by 'lead' samples.
+
+    Attributes:
+        flo: Lower frequencies of the bands, in Hz.
+        fhi: Upper frequencies of the bands, in Hz.
+        decimation: Decimation factor of the signals with respect to the
+            rate the kernels are designed for. Default: 1.
+        lead: Number of samples of the kernels before their start, zero if
+            'decimation' is 1 and DECIMATED_KERNEL_LEAD otherwise.
+        h0: Kernels of the bands, numpy array of shape
+            (n_bands, BAND_FILTER_LENGTH) if 'decimation' is 1.
+        h0o: Imaginary part of the analytic signal of each kernel, same shape
+            as 'h0'.
+        n: Length of the signals this filter bank is planned for.
+        nfft: FFT length used to filter a signal of length 'n' without
+            circular aliasing.
+        H: Real FFT of 'h0' and 'h0o' rows, stacked in a numpy array of shape
+            (2 * n_bands, nfft / 2 + 1) and computed on 'nfft' points.
+        H0: Real FFT of 'h0' rows, i.e. the first half of 'H'.
+        H0o: Real FFT of 'h0o' rows, i.e. the second half of 'H'.
+    """
+
+    def __init__(self, fs, bandwidth=3., overlap=1., f_start=2.,
+                 max_f_end=12., n=BAND_FILTER_LENGTH, decimation=1):
+        super(FilterBank, self).__init__()
+        fs = float(fs)
+        self.decimation = int(decimation)
+        if self.decimation < 1:
+            raise ValueError("decimation must be a positive integer")
+        f_end = min(fs / 2. - bandwidth, max_f_end)
+        if f_end <= f_start:
+            raise ValueError("The end frequency of the filter bank must be greater"
+                             " than its start frequency")
+        step = bandwidth - overlap
+        self.flo = np.arange(f_start, f_end + step, step)
+        self.fhi = self.flo + bandwidth
+        h_aux = 8 - (np.arange(32) / 4.)
+        self.h0 = np.zeros((len(self.flo), BAND_FILTER_LENGTH))
+        self.h0[:, 0:32] = h_aux * np.cos(2. * np.pi *
+                                          ((self.flo + self.fhi) / 2.)[:, np.newaxis] *
+                                          np.arange(32) / (fs * self.decimation))
+        self.h0o = np.imag(signal.hilbert(self.h0, axis=1))
+        self.lead = 0
+        if self.decimation > 1:
+            self.lead = DECIMATED_KERNEL_LEAD
+            self.h0 = _decimate_kernels(self.h0, self.decimation, self.lead)
+            self.h0o = _decimate_kernels(self.h0o, self.decimation, self.lead)
+        self.n = int(n)
+        self.nfft = fftutils.next_fast_len(self.n + self.h0.shape[1] - 1)
+        self.H = np.fft.rfft(np.vstack((self.h0, self.h0o)), self.nfft, axis=1)
+        self.H0 = self.H[:self.n_bands]
+        self.H0o = self.H[self.n_bands:]
+
+    @property
+    def n_bands(self):
+        return len(self.flo)
+
+
+def _decimate_kernels(h, q, lead):
+    """Decimates the rows of 'h' by 'q' after an ideal low-pass filter.
+
+    Kernels are zero padded on both sides, so that the tails of the ideal
+    filter do not wrap around onto the samples kept, which run from
+    'lead' samples before the start of each kernel to 'lead' samples
+    after its end. Samples are scaled by 'q' to keep the gain of the
+    kernels.
+    """
+    pad = 1024 * q
+    n = h.shape[1] + 2 * pad
+    n += -n % q
+    padded = np.zeros((h.shape[0], n))
+    padded[:, pad:pad + h.shape[1]] = h
+    m = n // q
+    out = np.fft.irfft(np.fft.rfft(padded, axis=1)[:, :m // 2 + 1], m, axis=1)
+    start = pad // q - lead
+    return out[:, start:start + -(-h.shape[1] // q) + 2 * lead]
+
+
+class FilterBankCache(object):
+    """A bounded cache of FilterBank objects.
+
+    Filter banks are keyed by their settings and by the length of the signal
+    they were planned for, and the least recently used one is discarded
+    when the cache is full. Lookups are thread-safe.
+
+    Attributes:
+        maxsize: Maximum number of filter banks kept.
+            Default: 16.
+    """
+
+    def __init__(self, maxsize=16):
+        super(FilterBankCache, self).__init__()
+        if maxsize <= 0:
+            raise ValueError("maxsize must be a positive value")
+        self.maxsize = maxsize
+        self._banks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fs, bandwidth, overlap, f_start, max_f_end, n, decimation=1):
+        """Gets the filter bank for a given configuration and signal length.
+
+        The filter bank is built if it is not already in the cache.
+
+        Returns:
+            out: A FilterBank object.
+        """
+        key = (float(fs), float(bandwidth), float(overlap), float(f_start),
+               float(max_f_end), int(n), int(decimation))
+        with self._lock:
+            bank = self._banks.pop(key, None)
+            if bank is None:
+                bank = FilterBank(fs, bandwidth=bandwidth, overlap=overlap,
+                                  f_start=f_start, max_f_end=max_f_end, n=n,
+                                  decimation=decimation)
+            self._banks[key] = bank
+            while len(self._banks) > self.maxsize:
+                self._banks.popitem(last=False)
+        return bank
+
+    def __getstate__(self):
+        # Locks can't be pickled. Besides, an unpickled cache (e.g. on a
+        # worker process) starts empty, as its banks are cheap to rebuild.
+        return {'maxsize': self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def clear(self):
+        """Removes all the stored filter banks."""
+        with self._lock:
+            self._banks.clear()
+
+    def __len__(self):
+        return len(self._banks)
+
+
+# Cache shared by every AMPA run of the current process
+default_filter_bank_cache = FilterBankCache()
+
+
+def _band_envelopes(x, bank, batched=False):
+    """Envelopes of 'x' on each band of a filter bank.
+
+    Args:
+        x: Seismic data, numpy array type, with zero mean.
+        bank: A FilterBank object planned for the length of 'x'.
+        batched: Whether to filter all the bands at once or not.
+            Default: False.
+
+    Returns:
+        y: Envelopes, numpy array of shape (n_bands, len(x)).
+    """
+    # We obtain the analytic signal using Hilbert transform
+    X = np.fft.rfft(x, bank.nfft)
+    out = slice(bank.lead, bank.lead + len(x))
+    if batched:
+        # Filter both quadratures of every band at once
+        Y = np.fft.irfft(X * bank.H, bank.nfft, axis=1)
+        y = Y[:bank.n_bands, out] ** 2
+        y += Y[bank.n_bands:, out] ** 2
+        del Y
+        np.sqrt(y, y)
+    else:
+        y = np.zeros((bank.n_bands, len(x)))
+        for i in xrange(bank.n_bands):
+            # Filtering the signal
+            xa = np.fft.irfft(X * bank.H0[i], bank.nfft)[out]  # Same as signal.lfilter(h0, 1, x)
+            xao = np.fft.irfft(X * bank.H0o[i], bank.nfft)[out]  # Same as signal.lfilter(h0o, 1, x)
+            # Analytic signal
+            y[i, :] = np.sqrt((xa ** 2) + (xao ** 2))
+    return y
+
+
+def _noise_reduction(y, noise_thr, out=None):
+    """Noise reduction stage of AMPA.
+
+    Args:
+        y: Envelopes of the bands, numpy array of shape (n_bands, n).
+        noise_thr: A percentile of the amplitude of the envelope that measures
+            the noise reduction level for each band.
+        out: Array where the result is stored, it can be 'y' itself.
+            Default: None, a new array is returned.
+
+    Returns:
+        z: Noise reduced envelopes, numpy array of shape (n_bands, n).
+    """
+    # Fix a threshold to modify the energies in the channels
+    thr = np.array([prctile(y0, noise_thr) for y0 in y])[:, np.newaxis]
+    # Here we modify the amplitudes of the analytic signal. The amplitudes
+    # below the threshold are set to 1. the amplitudes above the threshold
+    # are set to the number of times they are higher than the threshold.
+    # Same as (y0 / thr) * (y0 > thr) + (y0 <= thr)
+    z = np.divide(y, thr, out)
+    return np.maximum(z, 1., z)
+
+
+def _multiband_analysis(x, bank, noise_thr, batched=False):
+    """Adaptive multi-band analysis stage of AMPA.
+
+    Computes the envelope of 'x' on each band of a filter bank and applies
+    the noise reduction stage to it.
+
+    Args:
+        x: Seismic data, numpy array type, with zero mean.
+        bank: A FilterBank object planned for the length of 'x'.
+        noise_thr: A percentile of the amplitude of the envelope that measures
+            the noise reduction level for each band.
+        batched: Whether to filter all the bands at once or not.
+            Default: False.
+
+    Returns:
+        z: Noise reduced envelopes, numpy array of shape (n_bands, len(x)).
+    """
+    y = _band_envelopes(x, bank, batched=batched)
+    return _noise_reduction(y, noise_thr, out=y)
+
+
+def _multiband_sum(x, bank, noise_thr):
+    """Low memory version of the adaptive multi-band analysis stage.
+
+    Filters 'x' in blocks by overlap-save and sums the noise reduced
+    envelopes of the bands as they are computed, so only the envelope
+    of a band and the sum are held in memory, both in single precision.
+
+    Args:
+        x: Seismic data, numpy array type, with zero mean.
+        bank: A FilterBank object planned for blocks of 'bank.n' samples,
+            which includes the BAND_FILTER_LENGTH - 1 samples of history
+            and the 'bank.lead' samples ahead of each block.
+        noise_thr: A percentile of the amplitude of the envelope that measures
+            the noise reduction level for each band.
+
+    Returns:
+        ztot: Sum of the noise reduced envelopes of all the bands,
+            numpy array of type float32 and length len(x).
+    """
+    history = BAND_FILTER_LENGTH - 1
+    block_len = bank.n - history - bank.lead
+    ztot = np.zeros(len(x), dtype=np.float32)
+    y0 = np.empty(len(x), dtype=np.float32)
+    for i in xrange(bank.n_bands):
+        for start in xrange(0, len(x), block_len):
+            stop = min(start + block_len, len(x))
+            X = np.fft.rfft(x[max(start - history, 0):stop + bank.lead],
+                            bank.nfft)
+            # Output of the block, skipping the history samples, if any
+            block = slice(min(start, history) + bank.lead,
+                          min(start, history) + bank.lead + stop - start)
+            xa = np.fft.irfft(X * bank.H0[i], bank.nfft)[block]
+            xao = np.fft.irfft(X * bank.H0o[i], bank.nfft)[block]
+            y0[start:stop] = np.sqrt((xa ** 2) + (xao ** 2))
+        thr = prctile(y0, noise_thr)
+        # Same as (y0 / thr) * (y0 > thr) + (y0 <= thr)
+        y0 /= thr
+        np.maximum(y0, 1., y0)
+        ztot += y0
+    return ztot
+
+
+def _log_envelope(ztot):
+    """Logarithm of the sum of the envelopes of the bands, shifted so that
+    its minimum is 0.01. Computed in place."""
+    lztot = np.log10(ztot, ztot)
+    lztot -= np.min(lztot)
+    lztot += 1e-2
+    return lztot
+
+
+def _characteristic_function(ZTOT, U, out=None):
+    """Computes U + log10(|ZTOT| + 10 ** -U), see 'ampa' function."""
+    cf = np.abs(ZTOT, out)
+    cf += 10 ** -U
+    np.log10(cf, cf)
+    cf += U
+    return cf
+
+
+def _enhancement_filters(lztot, fs, L, L_coef, block_len=None):
+    """Enhancement filter stage of AMPA.
+
+    Each enhancement filter of length l is a kernel of 2 * l taps made of an
+    increasing ramp (1, 2, ..., l) followed by a negative one
+    (-L_coef * l, ..., -L_coef), normalized to unit absolute sum. The
+    output of each filter is advanced l samples, rectified and multiplied
+    with the outputs of the other filters.
+
+    Since the kernels are piecewise linear, their outputs are computed from
+    the running sums of 'lztot' and of 'n * lztot', so the cost does not
+    depend on the length of the filters.
+
+    Args:
+        lztot: Logarithm of the sum of the envelopes of all the bands,
+            numpy array type.
+        fs: Sampling rate in Hz.
+        L: A list of filter lengths (in seconds).
+        L_coef: Portion of negative response of the filters.
+        block_len: If given, the output is computed in blocks of this
+            length, so the temporary arrays are bounded by the size of a
+            block and the longest filter instead of by the size of
+            'lztot'. Default: None, the output is computed at once.
+
+    Returns:
+        Product of the outputs of the filters, numpy array of length
+        len(lztot) - int(max(L) * fs) and the same data type as 'lztot'.
+    """
+    tail = int(np.max(L) * fs)
+    m = len(lztot) - tail
+    if block_len is None:
+        block_len = max(m, 1)
+    out = np.empty(max(m, 0), dtype=lztot.dtype)
+    for start in xrange(0, m, block_len):
+        stop = min(start + block_len, m)
+        out[start:stop] = _enhancement_filters_block(lztot, start, stop,
+                                                     tail, fs, L, L_coef)
+    return out
+
+
+def _enhancement_filters_block(lztot, start, stop, tail, fs, L, L_coef):
+    """Output of the enhancement filters for samples 'start' to 'stop'."""
+    # The filters read samples from start - tail to stop + tail,
+    # padded with zeros before the start of the signal
+    k = stop - start
+    x = np.hstack([np.zeros(max(tail - start, 0)),
+                   lztot[max(start - tail, 0):stop + tail]])
+    n = np.arange(k, dtype=float) + tail
+    c1 = np.hstack([0., np.cumsum(x)])
+    c2 = np.hstack([0., np.cumsum(np.arange(len(x)) * x)])
+    out = np.ones(k)
+    for v in L:
+        l = int(v * fs)
+        lo = slice(tail - l + 1, tail - l + 1 + k)
+        mid = slice(tail + 1, tail + 1 + k)
+        hi = slice(tail + l + 1, tail + l + 1 + k)
+        # Increasing ramp, weights l, ..., 1 over samples n + 1, ..., n + l
+        zt = (n + (l + 1)) * (c1[hi] - c1[mid])
+        zt -= c2[hi] - c2[mid]
+        # Negative ramp, weights -l, ..., -1 over samples n - l + 1, ..., n
+        zt_neg = (n - l) * (c1[mid] - c1[lo])
+        zt_neg -= c2[mid] - c2[lo]
+        zt_neg *= L_coef
+        zt += zt_neg
+        zt /= (1. + L_coef) * l * (l + 1) / 2.
+        np.maximum(zt, 0., zt)
+        out *= zt
+    return out
+
+
+def _check_arguments(x, fs, L, bandwidth, overlap, f_start, max_f_end, U):
+    """Checks the arguments of the 'ampa' function."""
+    if fs <= 0:
+        raise ValueError("fs must be a positive value")
+    if bandwidth <= 0:
+        raise ValueError("bandwidth must be a positive value")
+    if overlap < 0:
+        raise ValueError("overlap must be a non-negative value")
+    if overlap >= bandwidth:
+        raise ValueError("bandwidth must be greater than overlap")
+    if f_start <= 0:
+        raise ValueError("f_start must be a positive value")
+    if max_f_end <= 0:
+        raise ValueError("max_f_end must be a positive value")
+    if f_start >= max_f_end:
+        raise ValueError("max_f_end must be greater than f_start")
+    if U <= 0:
+        raise ValueError("U must be a positive value")
+    for v in L:
+        if v <= 0:
+            raise ValueError("L should be a positive value")
+        if v >= len(x) / fs:
+            raise ValueError("Length of x must be greater than the longest "
+                             "of the values of L")
+
+
 def ampa(x, fs, threshold=None, L=None, L_coef=3.,
          noise_thr=90, bandwidth=3., overlap=1., f_start=2., max_f_end=12.,
-         U=12., peak_window=1.):
+         U=12., peak_window=1., cache=None, batched=False,
+         low_memory=False, bank_decimation=1):
     """Event picking/detection using AMPA algorithm.
 
     An implementation of the Adaptive Multi-Band Picking Algorithm (AMPA),
@@ -137,6 +650,26 @@ def ampa(x, fs, threshold=None, L=None, L_coef=3.,
             point to be a local maximum.
             If 'threshold' is None, this parameter has no effect.
             Default value is 1 s.
+        cache: A FilterBankCache object used to look up the filter bank of
+            the adaptive multi-band analysis.
+            Default value is None, which means the module-wide
+            'default_filter_bank_cache' is used.
+        batched: Whether to filter all the bands of the multi-band analysis
+            at once or not. Batched filtering runs a single inverse FFT over
+            the stacked responses of every band, which is faster but needs
+            memory for all the filtered bands at the same time.
+            Default: False, bands are filtered one after another.
+        low_memory: Whether to compute the characteristic function in
+            single precision and in blocks of LOW_MEMORY_BLOCK_LENGTH
+            samples or not. The envelopes of the bands are summed as they
+            are computed instead of being stored, which takes the peak
+            memory from about 250 bytes per sample of 'x' down to about
+            50 bytes per sample. 'batched' has no effect in this mode.
+            Default: False.
+        bank_decimation: Factor by which 'x' has been decimated from the
+            rate the filter bank is designed for, so that the responses of
+            the bands match the ones at that rate. See FilterBank.
+            Default: 1.
 
     Returns:
         event_t: A list of possible event locations, given in samples from the
@@ -146,87 +679,155 @@ def ampa(x, fs, threshold=None, L=None, L_coef=3.,
         ztot: Characteristic function, numpy array type.
     """
     # Check arguments
-    if fs <= 0:
-        raise ValueError("fs must be a positive value")
-    if bandwidth <= 0:
-        raise ValueError("bandwidth must be a positive value")
-    if overlap < 0:
-        raise ValueError("overlap must be a non-negative value")
-    if overlap >= bandwidth:
-        raise ValueError("bandwidth must be greater than overlap")
-    if f_start <= 0:
-        raise ValueError("f_start must be a positive value")
-    if max_f_end <= 0:
-        raise ValueError("max_f_end must be a positive value")
-    if f_start >= max_f_end:
-        raise ValueError("max_f_end must be greater than f_start")
-    if U <= 0:
-        raise ValueError("U must be a positive value")
     if L is None:
         L = [30., 20., 10., 5., 2.5]
-    for v in L:
-        if v <= 0:
-            raise ValueError("L should be a positive value")
-        if v >= len(x) / fs:
-            raise ValueError("Length of x must be greater than the longest "
-                             "of the values of L")
+    _check_arguments(x, fs, L, bandwidth, overlap, f_start, max_f_end, U)
     fs = float(fs)
     peak_window = round(peak_window * fs / 2.)
-    x = x - np.mean(x)  # We remove the mean
+    dtype = np.float32 if low_memory else np.float64
+    x = np.subtract(x, np.mean(x), dtype=dtype)  # We remove the mean
     # The first configurable parameter is the bank of bandpass filters
     # Several options can be chosen
-    f_end = min(fs / 2. - bandwidth, max_f_end)
-    if f_end <= f_start:
-        raise ValueError("The end frequency of the filter bank must be greater"
-                         " than its start frequency")
-    step = bandwidth - overlap
-    flo = np.arange(f_start, f_end + step, step)
-    fhi = flo + bandwidth
-    # We obtain the analytic signal using Hilbert transform
-    z = np.zeros((len(flo), len(x)))
-    for i in xrange(len(flo)):
-        h_aux = 8 - (np.arange(32) / 4.)
-        h0 = np.zeros(512)
-        h0[0:32] = h_aux * np.cos(2. * np.pi * ((flo[i] + fhi[i]) / 2.) *
-                                  np.arange(32) / fs)
-        h0o = np.imag(signal.hilbert(h0))
-        # Filtering the signal
-        xa = signal.fftconvolve(x, h0)[:len(x)]  # Same as signal.lfilter(h0, 1, x)
-        xao = signal.fftconvolve(x, h0o)[:len(x)]  # Same as signal.lfilter(h0o, 1, x)
-        # Analytic signal
-        y0 = np.sqrt((xa ** 2) + (xao ** 2))
-        # Fix a threshold to modify the energies in the channels
-        thr = prctile(y0, noise_thr)
-        # Here we modify the amplitudes of the analytic signal. The amplitudes
-        # below the threshold are set to 1. the amplitudes above the threshold
-        # are set to the number of times they are higher than the threshold
-        z0 = (y0 / thr) * (y0 > thr) + (y0 <= thr)
-        # In the variable z we save the analytic signals (modified by the
-        # threshold processing) in a matrix structure. Each column corresponds
-        # to one frequency channel
-        z[i, :] = z0
-    # We sum the contribution of all the frequency channels in a single signal
+    if cache is None:
+        cache = default_filter_bank_cache
+    if low_memory:
+        block_len = min(LOW_MEMORY_BLOCK_LENGTH, len(x))
+        bank = cache.get(fs, bandwidth, overlap, f_start, max_f_end,
+                         block_len + BAND_FILTER_LENGTH - 1 +
+                         (DECIMATED_KERNEL_LEAD if bank_decimation > 1 else 0),
+                         bank_decimation)
+        ztot = _multiband_sum(x, bank, noise_thr)
+        del x
+    else:
+        block_len = None
+        bank = cache.get(fs, bandwidth, overlap, f_start, max_f_end, len(x),
+                         bank_decimation)
+        z = _multiband_analysis(x, bank, noise_thr, batched=batched)
+        # We sum the contribution of all the frequency channels in a
+        # single signal
+        ztot = np.sum(z, 0)
+        del z
     # Then we apply logarithm
-    ztot = np.sum(z, 0)
-    lztot = np.log10(ztot) - np.min(np.log10(ztot)) + 1e-2
+    lztot = _log_envelope(ztot)
     # This total signal is passed through a non-linear filtering based
     # on a set of filters of different length. This is completely configurable
-    Ztot = np.zeros((len(L), len(x)))
-    for i in xrange(len(L)):
-        l = int(L[i] * fs)
-        B = np.zeros(2 * l)
-        B[0:l] = range(1, l + 1)
-        B[l:2 * l] = L_coef * (np.arange(1, l + 1) - (l + 1))
-        B = B / np.sum(np.abs(B))
-        Zt = signal.fftconvolve(lztot, B)[:len(x)]  # Same as signal.lfilter(B, 1, lztot)
-        Zt = Zt * (Zt > 0)
-        Ztot[i, :-l] = np.roll(Zt, -l)[:-l]
-    ZTOT = np.prod(Ztot, 0)[:-(np.max(L) * fs)]
-    ZTOT = U + np.log10(np.abs(ZTOT) + (10 ** -U))
+    ZTOT = _enhancement_filters(lztot, fs, L, L_coef, block_len=block_len)
+    del lztot, ztot
+    ZTOT = _characteristic_function(ZTOT, U, out=ZTOT)
     event_t = findpeaks.find_peaks(ZTOT, threshold, order=peak_window * fs)
     return event_t, ZTOT
 
 
+# Default values of the parameters that can be swept by 'ampa_sweep'
+SWEEP_DEFAULTS = collections.OrderedDict([
+    ('bandwidth', 3.),
+    ('overlap', 1.),
+    ('f_start', 2.),
+    ('max_f_end', 12.),
+    ('noise_thr', 90.),
+    ('L', (30., 20., 10., 5., 2.5)),
+    ('L_coef', 3.),
+    ('U', 12.),
+])
+
+
+def parameter_grid(**kwargs):
+    """Builds every combination of a set of values of AMPA parameters.
+
+    E.g. parameter_grid(noise_thr=[80., 90.], L=[[30., 10.], [20., 5.]])
+    returns the 4 configurations of 'noise_thr' and 'L'.
+
+    Args:
+        kwargs: For each parameter of 'ampa' function, a list of its values.
+
+    Returns:
+        A list of dictionaries of parameter values, one per combination.
+    """
+    keys = kwargs.keys()
+    return [dict(zip(keys, values))
+            for values in itertools.product(*[kwargs[k] for k in keys])]
+
+
+def ampa_sweep(x, fs, configurations, threshold=None, peak_window=1.,
+               cache=None, batched=False):
+    """Applies AMPA algorithm over the same data with several sets of
+    parameters.
+
+    Every stage of the algorithm is computed once for all the
+    configurations that share the parameters it depends on:
+    the band envelopes depend on 'bandwidth', 'overlap', 'f_start' and
+    'max_f_end', their noise reduced sum also depends on 'noise_thr',
+    the enhancement filters also on 'L' and 'L_coef' and the
+    characteristic function also on 'U'. The results are the same as
+    calling 'ampa' function for each configuration.
+
+    Args:
+        x: Seismic data, numpy array type.
+        fs: Sampling rate in Hz.
+        configurations: A list of dictionaries of parameters of 'ampa'
+            function, as returned by 'parameter_grid'. Parameters not in
+            SWEEP_DEFAULTS are not allowed, those missing take their
+            default values.
+        threshold: Local maxima of the characteristic functions over
+            this value are returned as possible events. See 'ampa' function.
+            Default value is None.
+        peak_window: See 'ampa' function. Default value is 1 s.
+        cache: See 'ampa' function. Default value is None.
+        batched: See 'ampa' function. Default: False.
+
+    Returns:
+        A list of tuples (parameters, event_t, cf), in the same order as
+        'configurations', where 'parameters' is a dictionary of every value
+        in SWEEP_DEFAULTS used by the configuration and 'event_t' and 'cf'
+        are the events and the characteristic function 'ampa' function
+        returns for it.
+    """
+    parameters = []
+    for configuration in configurations:
+        unknown = set(configuration) - set(SWEEP_DEFAULTS)
+        if unknown:
+            raise ValueError("Unknown parameters: %s" % ", ".join(unknown))
+        p = SWEEP_DEFAULTS.copy()
+        p.update(configuration)
+        p['L'] = tuple(p['L'])
+        _check_arguments(x, fs, p['L'], p['bandwidth'], p['overlap'],
+                         p['f_start'], p['max_f_end'], p['U'])
+        parameters.append(p)
+    fs = float(fs)
+    order = round(peak_window * fs / 2.) * fs
+    x = np.subtract(x, np.mean(x), dtype=np.float64)  # We remove the mean
+    if cache is None:
+        cache = default_filter_bank_cache
+    results = [None] * len(parameters)
+    # Group the configurations by the parameters of each stage
+    bank_keys = ['bandwidth', 'overlap', 'f_start', 'max_f_end']
+    for bank_key, bank_group in _group_by(range(len(parameters)), parameters,
+                                          bank_keys).items():
+        bank = cache.get(fs, *(bank_key + (len(x),)))
+        y = _band_envelopes(x, bank, batched=batched)
+        for (noise_thr,), noise_group in _group_by(bank_group, parameters,
+                                                   ['noise_thr']).items():
+            ztot = np.sum(_noise_reduction(y, noise_thr), 0)
+            lztot = _log_envelope(ztot)
+            for (L, L_coef), filter_group in _group_by(noise_group, parameters,
+                                                       ['L', 'L_coef']).items():
+                ZTOT = _enhancement_filters(lztot, fs, L, L_coef)
+                for i in filter_group:
+                    cf = _characteristic_function(ZTOT, parameters[i]['U'])
+                    event_t = findpeaks.find_peaks(cf, threshold, order=order)
+                    results[i] = (dict(parameters[i]), event_t, cf)
+        del y
+    return results
+
+
+def _group_by(indexes, parameters, keys):
+    """Groups the indexes of a list of parameters by the values of 'keys'."""
+    groups = collections.OrderedDict()
+    for i in indexes:
+        groups.setdefault(tuple(parameters[i][k] for k in keys), []).append(i)
+    return groups
+
+
 class Ampa(object):
     """A class to configure an instance of the AMPA algorithm and
     apply it over a given array containing seismic data.
@@ -258,12 +859,49 @@ class Ampa(object):
         U: A parameter used at the end of the enhancement filter stage to avoid
             logarithm of zero and to shift the characteristic function to zero.
             Default value is 12.
+        cache: A FilterBankCache object where the filter banks used by the
+            sliding windows are stored, so that they are computed only once.
+            Default value is None, which means the module-wide
+            'default_filter_bank_cache' is used, so every instance of the
+            class running on the same process shares it.
+        batched: Whether to filter all the bands of the multi-band analysis
+            at once or not. See 'ampa' function.
+            Default: False.
+        low_memory: Whether to compute the characteristic function of each
+            window in single precision and in blocks or not.
+            See 'ampa' function.
+            Default: False.
+        decimate: Whether to decimate the signal before applying the
+            algorithm or not. The signal is decimated by the largest
+            factor that keeps the highest analysed frequency,
+            max_f_end + bandwidth, free of aliasing. Picks are given at
+            the original rate and the characteristic function is
+            interpolated to it.
+            The filter bank is designed at the original rate and then
+            decimated, so the responses of the bands are the same at both
+            rates and the characteristic function stays close to the one
+            computed at the original rate.
+            Default: False.
+        overlap_save: Whether to compute the characteristic function in
+            overlap-save mode or not. In this mode each step only filters
+            the new samples of the signal, keeping the history needed by
+            the filters, and each sample of the characteristic function
+            is computed once, so there is no averaging between windows.
+            The noise thresholds and the normalization of each step are
+            computed over the last 'window' seconds of data, extended if
+            needed to cover the enhancement filters of the step.
+            The mean of the whole signal is removed instead of the mean of
+            each window. 'low_memory', 'workers' and 'pool' have no effect
+            in this mode.
+            Default: False.
     """
 
     def __init__(self, window=100., step=50.,
                  L=None, L_coef=3., noise_thr=90.,
                  bandwidth=3., overlap=1., f_start=2.,
-                 f_end=12., U=12., **kwargs):
+                 f_end=12., U=12., cache=None, batched=False,
+                 low_memory=False, decimate=False,
+                 overlap_save=False, **kwargs):
         super(Ampa, self).__init__()
         self.window = window
         self.step = step
@@ -277,8 +915,14 @@ class Ampa(object):
         self.f_start = f_start
         self.max_f_end = f_end
         self.U = U
+        self.cache = cache
+        self.batched = batched
+        self.low_memory = low_memory
+        self.decimate = decimate
+        self.overlap_save = overlap_save
 
-    def run(self, x, fs, threshold=None, peak_window=1.0):
+    def run(self, x, fs, threshold=None, peak_window=1.0, workers=1,
+            pool=None):
         """Executes AMPA algorithm over a given array of data.
 
         Args:
@@ -295,6 +939,17 @@ class Ampa(object):
                 the point to be a local maximum.
                 If 'threshold' is None, this parameter has no effect.
                 Default value is 1 s.
+            workers: Number of threads used to compute the characteristic
+                functions of the sliding windows concurrently. Most of the
+                work is done by FFTs that release the GIL.
+                If 'pool' is given, this parameter has no effect.
+                Default value is 1, windows are processed one after another.
+            pool: An object whose 'imap' method is used to compute the
+                characteristic functions of the sliding windows, e.g. a
+                multiprocessing.Pool to run them in other processes.
+                Default value is None.
+            Windows are always blended in order as their results arrive,
+            so the output does not depend on 'workers' nor on 'pool'.
 
         Returns:
             et: A list of possible event locations, given in samples from the
@@ -303,26 +958,238 @@ class Ampa(object):
                 only the global maximum of the function.
             out: Characteristic function, numpy array type.
         """
+        q = 1
+        if self.decimate:
+            q = resample.decimation_factor(fs, self.max_f_end + self.bandwidth)
+        if q > 1:
+            et, cf = self._run(resample.decimate(x, q), fs / float(q),
+                               threshold, peak_window, workers, pool, q)
+            tail = int(np.max(self.L) * fs)
+            return et * q, resample.interpolate(cf, q, len(x) - tail)
+        return self._run(x, fs, threshold, peak_window, workers, pool, q)
+
+    def _run(self, x, fs, threshold, peak_window, workers, pool,
+             bank_decimation):
+        if self.overlap_save:
+            out = self._overlap_save_cf(x, fs, bank_decimation)
+            et = findpeaks.find_peaks(out, threshold, order=peak_window * fs)
+            return et, out
         tail = int(np.max(self.L) * fs)
         out = np.zeros(len(x) - tail)
         step = int(self.step * fs)
         overlapped = max(0, int((self.window - self.step) * fs) - tail)
-        for i in xrange(0, len(out), step):
-            size = min(self.window * fs, len(x) - i)
-            _, cf = ampa(x[i:i + size], fs, L=self.L,
-                         L_coef=self.L_coef, noise_thr=self.noise_thr,
-                         bandwidth=self.bandwidth, overlap=self.overlap,
-                         f_start=self.f_start, max_f_end=self.max_f_end,
-                         U=self.U)
-            out[i: i + overlapped] = ((out[i: i + overlapped] +
-                                       cf[:overlapped]) / 2.)
-            out[i + overlapped: i + size - tail] = cf[overlapped:]
+        starts = range(0, len(out), step)
+        windows = [x[i:i + min(int(self.window * fs), len(x) - i)]
+                   for i in starts]
+        own_pool = pool is None and workers > 1 and len(starts) > 1
+        if own_pool:
+            pool = ThreadPool(processes=min(workers, len(starts)))
+        try:
+            if pool is None:
+                cfs = itertools.imap(self._window_cf, windows,
+                                     itertools.repeat(fs),
+                                     itertools.repeat(bank_decimation))
+            else:
+                cfs = pool.imap(_window_cf,
+                                itertools.izip(itertools.repeat(self), windows,
+                                               itertools.repeat(fs),
+                                               itertools.repeat(bank_decimation)))
+            for i, cf in itertools.izip(starts, cfs):
+                size = min(int(self.window * fs), len(x) - i)
+                out[i: i + overlapped] = ((out[i: i + overlapped] +
+                                           cf[:overlapped]) / 2.)
+                out[i + overlapped: i + size - tail] = cf[overlapped:]
+        finally:
+            if own_pool:
+                pool.close()
+                pool.join()
         et = findpeaks.find_peaks(out, threshold, order=peak_window * fs)
         return et, out
 
+    def _overlap_save_cf(self, x, fs, bank_decimation=1):
+        """Computes the characteristic function in overlap-save mode."""
+        _check_arguments(x, fs, self.L, self.bandwidth, self.overlap,
+                         self.f_start, self.max_f_end, self.U)
+        fs = float(fs)
+        tail = int(np.max(self.L) * fs)
+        window = int(self.window * fs)
+        step = int(self.step * fs)
+        if step <= 0:
+            raise ValueError("step must be a positive value")
+        history = BAND_FILTER_LENGTH - 1
+        cache = default_filter_bank_cache if self.cache is None else self.cache
+        x = x - np.mean(x)  # We remove the mean
+        out = np.zeros(len(x) - tail)
+        # Envelopes of the bands for samples y_start to y_start + y.shape[1]
+        y, y_start = None, 0
+        for i in xrange(0, len(out), step):
+            stop = min(i + step, len(out))
+            # Segment of data used to compute the output from i to stop
+            seg_stop = stop + tail
+            seg_start = max(0, min(i - tail, seg_stop - window))
+            # Filter only the new samples, plus the history of the filters
+            new_start = seg_start if y is None else y_start + y.shape[1]
+            lead = DECIMATED_KERNEL_LEAD if bank_decimation > 1 else 0
+            x_new = x[max(new_start - history, 0):min(seg_stop + lead, len(x))]
+            bank = cache.get(fs, self.bandwidth, self.overlap, self.f_start,
+                             self.max_f_end, len(x_new), bank_decimation)
+            y_new = _band_envelopes(x_new, bank, batched=self.batched)
+            y_new_start = new_start - max(new_start - history, 0)
+            y_new = y_new[:, y_new_start:y_new_start + seg_stop - new_start]
+            if y is None:
+                y = y_new
+            else:
+                y = np.hstack([y[:, seg_start - y_start:], y_new])
+            y_start = seg_start
+            z = _noise_reduction(y, self.noise_thr)
+            lztot = _log_envelope(np.sum(z, 0))
+            del z
+            cf = _enhancement_filters_block(lztot, i - seg_start,
+                                            stop - seg_start, tail, fs,
+                                            self.L, self.L_coef)
+            out[i:stop] = _characteristic_function(cf, self.U, out=cf)
+        return out
+
+    def _window_cf(self, x, fs, bank_decimation=1):
+        """Computes the characteristic function of a single window."""
+        _, cf = ampa(x, fs, L=self.L,
+                     L_coef=self.L_coef, noise_thr=self.noise_thr,
+                     bandwidth=self.bandwidth, overlap=self.overlap,
+                     f_start=self.f_start, max_f_end=self.max_f_end,
+                     U=self.U, cache=self.cache, batched=self.batched,
+                     low_memory=self.low_memory,
+                     bank_decimation=bank_decimation)
+        return cf
+
     @property
     def name(self):
         return self.__class__.__name__.upper()
 
 
+def _window_cf(parameters):
+    alg, x, fs, bank_decimation = parameters
+    return alg._window_cf(x, fs, bank_decimation)
+
+
+class AmpaStream(Ampa):
+    """A streaming version of the AMPA algorithm.
 
+    Applies the same sliding window approach as 'Ampa.run' over a signal of
+    unbounded length that is fed in chunks, e.g. read from a file by using
+    'BinFile.read_in_blocks' or received from a live feed:
+
+        stream = AmpaStream(fs=100., threshold=1.5)
+        for block in fin_handler.read_in_blocks(block_size=10000):
+            cf, et = stream.push(block)
+            ...
+        cf, et = stream.flush()
+
+    Characteristic function values are given out as soon as no later window
+    can modify them, and events as soon as the characteristic function on
+    both sides of them is known, so both outputs are equal to those of
+    'Ampa.run' over the whole signal. Memory usage is bounded by the size of
+    the window, regardless of the length of the signal.
+
+    Attributes:
+        fs: Sample rate in Hz.
+        threshold: Local maxima found in the characteristic function over
+            this value will be given out as possible events (detection mode).
+            If threshold is None, only the global maximum of the function will
+            be given out, when the stream is flushed (picking mode).
+            Default value is None.
+        peak_window: How many seconds on each side of a point of the
+            characteristic function to use for the comparison to consider
+            the point to be a local maximum.
+            If 'threshold' is None, this parameter has no effect.
+            Default value is 1 s.
+        n_in: Number of samples received so far.
+        n_out: Number of characteristic function values given out so far.
+
+        The rest of attributes are the same as those of Ampa class.
+    """
+
+    def __init__(self, fs, threshold=None, peak_window=1.0, **kwargs):
+        super(AmpaStream, self).__init__(**kwargs)
+        self.fs = float(fs)
+        self.threshold = threshold
+        self.peak_window = peak_window
+        self._window_len = int(self.window * self.fs)
+        self._step_len = int(self.step * self.fs)
+        self._tail = int(np.max(self.L) * self.fs)
+        self._overlapped = max(0, int((self.window - self.step) * self.fs) -
+                               self._tail)
+        if self._step_len <= 0:
+            raise ValueError("step must be a positive value")
+        # Input needed to complete a step of output
+        self._required_len = max(self._window_len, self._step_len + self._tail)
+        self.reset()
+
+    def reset(self):
+        """Discards any data received so far and restarts the stream."""
+        self.n_in = 0
+        self.n_out = 0
+        self._x = np.zeros(0)  # Input data from the start of the next window
+        self._pending = np.zeros(0)  # Partial output from previous windows
+        self._trigger = findpeaks.Trigger(self.threshold, self.threshold,
+                                          int(self.peak_window * self.fs))
+
+    def push(self, x):
+        """Feeds a chunk of data to the stream.
+
+        Args:
+            x: Seismic data, numpy array type.
+
+        Returns:
+            cf: Characteristic function values completed by this chunk,
+                numpy array type. They follow those given out by previous
+                calls, the first of them is at position 'n_out - len(cf)'
+                from the start of the signal.
+            et: Possible event locations completed by this chunk, given in
+                samples from the start of the signal.
+        """
+        self._x = np.concatenate((self._x, np.asarray(x, dtype=np.float64)))
+        self.n_in += len(x)
+        cf = [np.zeros(0)]
+        while len(self._x) >= self._required_len:
+            cf.append(self._next_window(self._window_len, self._step_len))
+        cf = np.concatenate(cf)
+        return cf, self._trigger.push(cf)[0]
+
+    def flush(self):
+        """Processes the remaining data as the end of the signal.
+
+        The stream is reset afterwards, so it can be used for a new signal.
+
+        Returns:
+            cf: Remaining values of the characteristic function.
+            et: Remaining possible event locations. In picking mode, the
+                position of the global maximum of the function.
+        """
+        cf = [np.zeros(0)]
+        out_len = self.n_in - self._tail
+        while self.n_out < out_len:
+            cf.append(self._next_window(min(self._window_len, len(self._x)),
+                                        min(self._step_len,
+                                            out_len - self.n_out)))
+        cf = np.concatenate(cf)
+        et = np.concatenate((self._trigger.push(cf)[0], self._trigger.flush()[0]))
+        self.reset()
+        return cf, et
+
+    def _next_window(self, size, n_out):
+        """Processes the window at the start of the input buffer.
+
+        Returns the first 'n_out' output values, which are final, and moves
+        the window forward one step.
+        """
+        cf = self._window_cf(self._x[:size], self.fs)
+        # Values not covered by any window are left to zero
+        out = np.zeros(max(len(cf), n_out))
+        out[:len(self._pending)] = self._pending[:len(cf)]
+        out[:self._overlapped] = ((out[:self._overlapped] +
+                                   cf[:self._overlapped]) / 2.)
+        out[self._overlapped:len(cf)] = cf[self._overlapped:]
+        self._x = self._x[self._step_len:]
+        self._pending = out[self._step_len:]
+        self.n_out += n_out
+        return out[:n_out]
@@ -45,6 +45,8 @@ import gc
 from copy import deepcopy
 
 from apasvo.picking import takanami
+from apasvo.picking import maeda
+from apasvo.picking import stalta
 from apasvo.picking import envelope as env
 from apasvo.utils.formats import rawfile
 from apasvo.utils import collections
@@ -56,6 +58,9 @@ method_stalta = 'STALTA'
 method_stalta_takanami = 'STALTA+Takanami'
 method_ampa = 'AMPA'
 method_ampa_takanami = 'AMPA+Takanami'
+method_maeda = 'Maeda'
+method_stalta_maeda = 'STALTA+Maeda'
+method_ampa_maeda = 'AMPA+Maeda'
 
 ALLOWED_METHODS = (
     method_other,
@@ -63,7 +68,10 @@ ALLOWED_METHODS = (
     method_stalta,
     method_stalta_takanami,
     method_ampa,
-    method_ampa_takanami
+    method_ampa_takanami,
+    method_maeda,
+    method_stalta_maeda,
+    method_ampa_maeda
 )
 
 PHASE_VALUES = (
@@ -149,7 +157,8 @@ class ApasvoEvent(Pick):
             Default: ''.
         method: A string indicating the algorithm used to find the event.
             Possible values are: 'STALTA', 'STALTA+Takanami', 'AMPA',
-            'AMPA+Takanami' and 'other'.
+            'AMPA+Takanami', 'Maeda', 'STALTA+Maeda', 'AMPA+Maeda' and
+            'other'.
             Default: 'other'.
             Default: 'preliminary'.
         n0_aic: Start time point of computed AIC values. The value is given in
@@ -158,7 +167,8 @@ class ApasvoEvent(Pick):
     """
 
     methods = (method_other, method_takanami, method_stalta,
-               method_stalta_takanami, method_ampa, method_ampa_takanami)
+               method_stalta_takanami, method_ampa, method_ampa_takanami,
+               method_maeda, method_stalta_maeda, method_ampa_maeda)
 
     def __init__(self,
                  trace,
@@ -284,7 +294,7 @@ class ApasvoEvent(Pick):
                          label='Signal')
         # Draw envelope
         if show_envelope:
-            fig.axes[0].plot(t, env.envelope(self.trace.signal[i_from:i_to]),
+            fig.axes[0].plot(t, self.trace.envelope[i_from:i_to],
                          color='r', label='Envelope')
             fig.axes[0].legend(loc=0, fontsize='small')
         # Draw AIC
@@ -309,6 +319,10 @@ class ApasvoTrace(op.Trace):
     Attributes:
         signal: Seismic data, numpy array type.
         fs: Sample rate in Hz.
+        envelope: Envelope of signal, numpy array type. It is computed the
+            first time it is needed and kept until 'data' or
+            'filtered_signal' is assigned again, so changes made in place
+            to any of them require a new assignment to be noticed.
         cf: Characteristic function, numpy array type, from the beginning
             of signal.
         events: A list of events.
@@ -362,6 +376,20 @@ class ApasvoTrace(op.Trace):
     def signal(self):
         return self.data if not self.use_filtered else self.filtered_signal
 
+    @property
+    def envelope(self):
+        key = 'filtered_signal' if self.use_filtered else 'data'
+        envelopes = self.__dict__.setdefault('_envelopes', {})
+        if key not in envelopes:
+            envelopes[key] = env.envelope(self.signal)
+        return envelopes[key]
+
+    def __setattr__(self, key, value):
+        # Cached envelopes are discarded when their signal changes
+        if key in ('data', 'filtered_signal'):
+            self.__dict__.get('_envelopes', {}).pop(key, None)
+        super(ApasvoTrace, self).__setattr__(key, value)
+
     @property
     def starttime(self):
         return self.stats.starttime
@@ -379,7 +407,8 @@ class ApasvoTrace(op.Trace):
         return "{0} | {1}".format(os.path.basename(self.filename), str(self))
 
     def detect(self, alg, threshold=None, peak_window=1.0,
-               takanami=False, takanami_margin=5.0, action='append', debug=False, **kwargs):
+               takanami=False, takanami_margin=5.0, refine_method='takanami',
+               action='append', debug=False, **kwargs):
         """Computes a picking algorithm over self.signal.
 
         Args:
@@ -403,6 +432,9 @@ class ApasvoTrace(op.Trace):
                 use for the application of Takanami method.
                 If 'takanami' is False, this parameter has no effect.
                 Default: 5.0 seconds.
+            refine_method: Method applied to refine results when 'takanami'
+                is True, see 'refine_events'.
+                Default: 'takanami'.
             action: Two valid choices: 'append' and 'clear'. 'append' adds the
                 events found to the end of the list of events, while 'clear'
                 removes the existing events of the list.
@@ -411,8 +443,29 @@ class ApasvoTrace(op.Trace):
         Returns:
             events: A resulting list of Event objects.
         """
-        et, self.cf = alg.run(self.signal, self.fs, threshold=threshold,
-                                peak_window=peak_window)
+        et, cf = alg.run(self.signal, self.fs, threshold=threshold,
+                         peak_window=peak_window)
+        return self._set_detection(alg, et, cf, takanami=takanami,
+                                   takanami_margin=takanami_margin,
+                                   refine_method=refine_method,
+                                   action=action, debug=debug)
+
+    def _set_detection(self, alg, et, cf, takanami=False, takanami_margin=5.0,
+                       refine_method='takanami', action='append', debug=False,
+                       **kwargs):
+        """Stores the results of a picking algorithm over self.signal.
+
+        Args:
+            alg: The algorithm object that computed the results.
+            et: Event locations given by the algorithm, in samples.
+            cf: Characteristic function given by the algorithm.
+
+            The rest of arguments are the same as those of 'detect' method.
+
+        Returns:
+            events: A resulting list of Event objects.
+        """
+        self.cf = cf
         # Build event list
         events = []
         for t in et:
@@ -425,7 +478,8 @@ class ApasvoTrace(op.Trace):
                                       evaluation_status=status_preliminary))
         # Refine arrival times
         if takanami:
-            events = self.refine_events(events, takanami_margin=takanami_margin)
+            events = self.refine_events(events, takanami_margin=takanami_margin,
+                                        refine_method=refine_method)
         # Update event list
         if action == 'append':
             self.events.extend(events)
@@ -434,7 +488,7 @@ class ApasvoTrace(op.Trace):
         else:
             raise ValueError("%s is not a valid value for 'action'" % action)
         if debug:
-            print "{} event(s) found so far for trace {}:".format(len(self.events), self.getId())
+            print "{} event(s) found so far for trace {}:".format(len(self.events), self.get_id())
             for event in self.events:
                 print event.time
         return self.events
@@ -458,7 +512,8 @@ class ApasvoTrace(op.Trace):
                              reverse=reverse)
         return self.events
 
-    def refine_events(self, events, t_start=None, t_end=None, takanami_margin=5.0):
+    def refine_events(self, events, t_start=None, t_end=None, takanami_margin=5.0,
+                      refine_method='takanami'):
         """Computes Takanami AR method over self.events.
 
         Args:
@@ -466,24 +521,40 @@ class ApasvoTrace(op.Trace):
                 use for the application of Takanami method.
                 If 'takanami' is False, this parameter has no effect.
                 Default: 5.0 seconds.
+            refine_method: Two valid choices: 'takanami' and 'maeda'.
+                'takanami' applies Takanami AR method, while 'maeda' applies
+                a variance-based AIC picker, which is much faster but less
+                accurate. Default: 'takanami'.
 
         Returns:
             events: A resulting list of Event objects.
         """
-        taka = takanami.Takanami()
-        for event in events:
-            t_start = (event.stime / self.fs) - takanami_margin
-            t_end = (event.stime / self.fs) + takanami_margin
-            et, event.aic, event.n0_aic = taka.run(self.signal, self.fs,
-                                                   t_start, t_end)
-            event.stime = et
+        if refine_method == 'takanami':
+            alg = takanami.Takanami()
+            methods = (method_ampa_takanami, method_stalta_takanami,
+                       method_takanami)
+        elif refine_method == 'maeda':
+            alg = maeda.Maeda()
+            methods = (method_ampa_maeda, method_stalta_maeda, method_maeda)
+        else:
+            raise ValueError("%s is not a valid value for 'refine_method'"
+                             % refine_method)
+        # Events are refined all at once
+        t = np.array([event.stime for event in events]) / self.fs
+        et, aic, n0_aic = alg.run_batch(self.signal, self.fs,
+                                        t - takanami_margin,
+                                        t + takanami_margin)
+        for event, event_et, event_aic, event_n0_aic in zip(events, et, aic,
+                                                             n0_aic):
+            event.aic, event.n0_aic = event_aic, event_n0_aic
+            event.stime = event_et
             # set event method
             if event.method == method_ampa:
-                event.method = method_ampa_takanami
+                event.method = methods[0]
             elif event.method == method_stalta:
-                event.method = method_stalta_takanami
+                event.method = methods[1]
             else:
-                event.method = method_takanami
+                event.method = methods[2]
         return events
 
     def bandpass_filter(self, freqmin, freqmax, *args, **kwargs):
@@ -598,7 +669,7 @@ class ApasvoTrace(op.Trace):
                                   #label='Signal')
             # Draw signal envelope
             if show_envelope:
-                fig.axes[ax_idx].plot(t, env.envelope(self.signal[i_from:i_to]),
+                fig.axes[ax_idx].plot(t, self.envelope[i_from:i_to],
                                   color='r', label='Envelope')
                 fig.axes[ax_idx].legend(loc=0, fontsize='small')
             ax_idx += 1
@@ -659,10 +730,33 @@ class ApasvoStream(op.Stream):
         self.description = description
         self.filename = filename
 
-    def detect(self, alg, trace_list=None, allow_multiprocessing=True, **kwargs):
-        """
+    def detect(self, alg, trace_list=None, allow_multiprocessing=True,
+               stack=False, **kwargs):
+        """Computes a picking algorithm over a list of traces.
+
+        Args:
+            alg: A detection/picking algorithm object, e. g. a
+                picking.ampa.Ampa or picking.stalta.StaLta instance.
+            trace_list: Traces to process. Default: All the traces of
+                the stream.
+            allow_multiprocessing: Whether to process the traces in parallel
+                or not. Default: True.
+            stack: If True and 'alg' is a picking.stalta.StaLta instance,
+                traces with the same sample rate and length are stacked
+                into a 2-D array and processed at once in this process,
+                instead of in parallel. Stacking copies the signals of the
+                stacked traces and holds their characteristic functions at
+                the same time, so it needs about twice the memory of those
+                traces. Traces are not stacked when 'takanami' is True,
+                since refinement would then run one trace after another.
+                Default: False.
+
+            The rest of arguments are passed to 'ApasvoTrace.detect' method.
         """
         trace_list = self.traces if trace_list is None else trace_list[:]
+        if (stack and isinstance(alg, stalta.StaLta) and
+                not kwargs.get('takanami', False)):
+            trace_list = self._detect_stacked(alg, trace_list, **kwargs)
         n_traces = len(trace_list)
         if allow_multiprocessing and n_traces > 1:
             processes = min(mp.cpu_count(), n_traces)
@@ -686,6 +780,35 @@ class ApasvoStream(op.Stream):
         else:
             _detect((alg, trace_list, kwargs))
 
+    def _detect_stacked(self, alg, trace_list, threshold=None,
+                        peak_window=1.0, **kwargs):
+        """Processes together the traces that share sample rate and length.
+
+        The characteristic function of each trace is taken out of the
+        resulting 2-D array and stored in the trace.
+
+        Returns:
+            The list of traces that could not be stacked with any other trace.
+        """
+        keys, groups = [], {}
+        for trace in trace_list:
+            key = (trace.fs, len(trace.signal))
+            if key not in groups:
+                keys.append(key)
+            groups.setdefault(key, []).append(trace)
+        remaining = []
+        for key in keys:
+            fs, traces = key[0], groups[key]
+            if len(traces) == 1:
+                remaining.extend(traces)
+                continue
+            x = np.vstack([trace.signal for trace in traces])
+            et, cf = alg.run(x, fs, threshold=threshold,
+                             peak_window=peak_window)
+            for trace, trace_et, trace_cf in zip(traces, et, cf):
+                trace._set_detection(alg, trace_et, trace_cf, **kwargs)
+        return remaining
+
     def export_picks(self, filename, trace_list=None, format="NLLOC_OBS", debug=False, **kwargs):
         """
         """
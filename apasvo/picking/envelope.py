@@ -25,10 +25,15 @@
 '''
 
 import numpy as np
-from scipy import fftpack
 
+from apasvo.utils import fftutils
 
-def envelope(x):
+
+BLOCK_SIZE = 2 ** 20
+BLOCK_MARGIN = 2 ** 14
+
+
+def envelope(x, block_size=BLOCK_SIZE):
     """Computes the envelope of a seismic signal.
 
     The envelope, e(n), of a signal x(n), is calculated as:
@@ -37,12 +42,49 @@ def envelope(x):
 
     where h(n) is the Hilbert Transform of x(n)
 
+    The signal is zero-padded to a length suitable for FFT before computing
+    its Hilbert Transform, which avoids the slow cases of lengths with large
+    prime factors. Signals longer than 'block_size' are processed in blocks,
+    each one extended 'BLOCK_MARGIN' samples on both sides, so that the
+    memory used by the transforms does not depend on the length of the
+    signal. Results differ from those of the whole signal only by the
+    slowly decaying tail of the Hilbert Transform beyond the margins.
+
     Args:
         x: array of data.
+        block_size: Maximum number of samples transformed at once. If None,
+            the whole signal is transformed at once.
+            Default: 2 ** 20 samples.
 
     Returns:
         out: Envelope of x, numpy array type.
     """
+    x = np.asarray(x)
     x_mean = x.mean()
     x_norm = x - x_mean
-    return ((x_norm ** 2 + fftpack.hilbert(x_norm) ** 2) ** 0.5) + x_mean
+    n = len(x_norm)
+    if block_size is None or n <= block_size:
+        h = _hilbert(x_norm)
+    else:
+        h = np.empty(n)
+        for start in xrange(0, n, block_size):
+            end = min(n, start + block_size)
+            first = max(0, start - BLOCK_MARGIN)
+            last = min(n, end + BLOCK_MARGIN)
+            h[start:end] = _hilbert(x_norm[first:last])[start - first:end - first]
+    return ((x_norm ** 2 + h ** 2) ** 0.5) + x_mean
+
+
+def _hilbert(x):
+    """Computes the Hilbert Transform of a signal zero-padded to a fast
+    FFT length."""
+    n = len(x)
+    nfft = fftutils.next_fast_len(n)
+    spectrum = np.fft.rfft(x, nfft)
+    # The transform shifts positive frequencies by -90 degrees and cancels
+    # both the mean and the Nyquist frequency
+    spectrum *= -1j
+    spectrum[0] = 0.
+    if nfft % 2 == 0:
+        spectrum[-1] = 0.
+    return np.fft.irfft(spectrum, nfft)[:n]
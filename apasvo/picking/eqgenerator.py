@@ -27,10 +27,18 @@
 import numpy as np
 from scipy import signal
 
+from apasvo.utils import fftutils
 from apasvo.utils.formats import rawfile
 
 
-def gutenberg_richter(b=1.0, size=1, m_min=2.0, m_max=None):
+# Default number of samples of each chunk of a generated stream
+CHUNK_SIZE = 2 ** 16
+# Seconds of band-filtered noise generated before the start of an
+# earthquake of a stream, so the filters are settled at its start
+EVENT_WARMUP = 2.0
+
+
+def gutenberg_richter(b=1.0, size=1, m_min=2.0, m_max=None, random_state=None):
     """Generates a random sequence of earthquake magnitudes
     according to Gutenberg-Richter law.
 
@@ -45,6 +53,9 @@ def gutenberg_richter(b=1.0, size=1, m_min=2.0, m_max=None):
         m_min: Minimum magnitude considered. Default: 2.0.
         m_max: Upper bound of earthquake magnitudes.
             Default value is None, which means no upper limit is considered.
+        random_state: Seed of the random numbers, an integer or a
+            numpy.random.RandomState instance. Default value is None,
+            which means the global random state of numpy is used.
 
     Returns:
         out: A list of random earthquake magnitudes.
@@ -53,13 +64,15 @@ def gutenberg_richter(b=1.0, size=1, m_min=2.0, m_max=None):
         bound_term = 1.0 - 10 ** (-b * (m_max - m_min))
     else:
         bound_term = 1.0
-    return m_min - np.log10(-np.random.rand(size) * bound_term + 1.0) / b
+    random_state = _random_state(random_state)
+    return m_min - np.log10(-random_state.rand(size) * bound_term + 1.0) / b
 
 
 def generate_artificial_earthquake(tmax, t0, fs, P_signal_db, P_noise_db,
                                    bfirls=None, low_period=50., high_period=10.,
                                    bandwidth=4., overlap=1., f_low=2.,
-                                   f_high=18., low_amp=.2, high_amp=.1):
+                                   f_high=18., low_amp=.2, high_amp=.1,
+                                   random_state=None):
     """Generates a synthetic earthquake signal with background noise.
 
     An artificial earthquake is generated at the desired start point from
@@ -104,10 +117,14 @@ def generate_artificial_earthquake(tmax, t0, fs, P_signal_db, P_noise_db,
         high_amp: End value of the range of noise envelope amplitudes
             for the different bands at the multi-band synthesis.
             Default: 0.1.
+        random_state: Seed of the random numbers, an integer or a
+            numpy.random.RandomState instance. Default value is None,
+            which means the global random state of numpy is used.
 
     Returns:
         out: A numpy array containing the generated signal.
     """
+    random_state = _random_state(random_state)
     # Earthquake generation
     artificial_earthquake = generate_seismic_earthquake(tmax, t0, fs,
                                                         P_signal_db,
@@ -116,15 +133,18 @@ def generate_artificial_earthquake(tmax, t0, fs, P_signal_db, P_noise_db,
                                                         bandwidth,
                                                         overlap,
                                                         f_low, f_high,
-                                                        low_amp, high_amp)
+                                                        low_amp, high_amp,
+                                                        random_state)
     # Noise generation
-    background_noise = generate_seismic_noise(tmax, fs, P_noise_db, bfirls)
+    background_noise = generate_seismic_noise(tmax, fs, P_noise_db, bfirls,
+                                              random_state)
     return artificial_earthquake + background_noise
 
 
 def generate_seismic_earthquake(tmax, t0, fs, P_signal_db, low_period,
                                    high_period, bandwidth, overlap,
-                                   f_low, f_high, low_amp, high_amp):
+                                   f_low, f_high, low_amp, high_amp,
+                                   random_state=None):
     """Generates a synthetic earthquake signal.
 
     An artificial earthquake is generated at the desired start point from
@@ -149,34 +169,64 @@ def generate_seismic_earthquake(tmax, t0, fs, P_signal_db, low_period,
             for the different bands at the multi-band synthesis.
         high_amp: End value of the range of noise envelope amplitudes
             for the different bands at the multi-band synthesis.
+        random_state: Seed of the random numbers, an integer or a
+            numpy.random.RandomState instance. Default value is None,
+            which means the global random state of numpy is used.
 
     Returns:
         out: A numpy array containing the generated signal.
     """
+    return generate_seismic_earthquakes(tmax, [t0], fs, [P_signal_db],
+                                        low_period, high_period, bandwidth,
+                                        overlap, f_low, f_high, low_amp,
+                                        high_amp, random_state)[0]
+
+
+def generate_seismic_earthquakes(tmax, t0, fs, P_signal_db, low_period,
+                                 high_period, bandwidth, overlap,
+                                 f_low, f_high, low_amp, high_amp,
+                                 random_state=None):
+    """Generates a batch of synthetic earthquake signals.
+
+    Same as 'generate_seismic_earthquake', but several signals of the same
+    length are generated at once, each one a row of the output, so that
+    the band filters are applied to all of them in a single call.
+
+    Each earthquake is only generated from 'EVENT_WARMUP' seconds before its
+    start to the end of its longest envelope, as the signal is zero
+    elsewhere, so the cost does not depend on the length of the signals.
+
+    Args:
+        t0: A list with the start time of the earthquake of each signal, in
+            seconds from the beginning of the signal.
+        P_signal_db: A list with the earthquake power in dB of each signal.
+            It must have the same length as 't0'.
+
+        The rest of arguments are the same as those of
+        'generate_seismic_earthquake'.
+
+    Returns:
+        out: A numpy array containing a generated signal on each row.
+    """
     if fs <= 0:
         raise ValueError("fs must be a positive value")
+    random_state = _random_state(random_state)
+    t0 = np.asarray(t0, dtype=float)
+    P_signal_db = np.asarray(P_signal_db, dtype=float)
+    if t0.shape != P_signal_db.shape or t0.ndim != 1:
+        raise ValueError("t0 and P_signal_db must be lists of the same length")
     # Signal length in the range 0:1/fs:tmax
     L = int(tmax * fs) + 1
-    # First earthquake sample
-    n0 = int(t0 * fs)
-    if n0 >= L:
+    # First earthquake sample of each signal
+    n0 = (t0 * fs).astype(int)[:, np.newaxis]
+    if np.any(n0 >= L):
         raise ValueError("Generated earthquake must start before the end of the signal.")
     # Value from which the exponential function truncates its fall
     betta = high_amp / 100.
 
-    # We generate the artificial earthquake from white noise band-filtered
-    # and modulated by using different envelope functions
-    w_noise = np.random.randn(L)
     f_filt_low = np.arange(f_low, f_high - bandwidth, bandwidth - overlap)
     f_filt_high = f_filt_low + bandwidth
     N_filt = len(f_filt_low)  # N. of applied filters
-    # Matrix where each column has a band noise
-    noise_band = np.zeros((N_filt, L))
-    for i in xrange(N_filt):
-        b, a = signal.butter(2,
-                             [f_filt_low[i] / (fs / 2.),
-                              f_filt_high[i] / (fs / 2.)], btype='bandpass')
-        noise_band[i, :] = signal.lfilter(b, a, w_noise)
     # Length of noise envelope for the different bands
     filt_len = np.linspace(low_period, high_period, N_filt)
     n1 = np.round(n0 + filt_len * fs)
@@ -186,25 +236,75 @@ def generate_seismic_earthquake(tmax, t0, fs, P_signal_db, low_period,
     # the alpha decay constant
     # The exponential form is A0*exp(-alpha(n-n0)). In n=n0 its value is A0
     # If we want
-    alpha = -np.log(betta / filt_amp) / (n1 - n0)
-    # Generate the signal envelope
-    noise_env = np.zeros((N_filt, L))
+    env_len = np.ascontiguousarray(n1 - n0)
+    # Envelopes are zero out of the first 'env_len' samples of the
+    # earthquake, so it is only generated over them, plus the samples
+    # before its start needed to settle the filters and those used to
+    # measure its power, if they are longer.
+    warmup = int(EVENT_WARMUP * fs)
+    n_power = int(5 * fs)
+    M = warmup + max(int(np.max(env_len)), n_power)
+    # Samples from the start of the earthquake, and from the beginning of
+    # the signal, of each generated sample
+    k = np.arange(M) - warmup
+    n = n0 + k
+    # Envelopes only depend on the number of samples from the start of the
+    # earthquake, so they are tabulated once for each set of lengths.
+    # The last value of each table is zero, for samples before the start.
+    env_len, env_idx = np.unique(env_len.view([('', env_len.dtype)] * N_filt),
+                                 return_inverse=True)
+    env_len = env_len.view(n1.dtype).reshape(-1, N_filt)
+    alpha = -np.log(betta / filt_amp) / env_len
+    k_env = np.arange(M + 1)
+    noise_env = np.where(k_env < env_len[:, :, np.newaxis],
+                         filt_amp[:, np.newaxis] *
+                         np.exp(-alpha[:, :, np.newaxis] * k_env), 0.)
+    k_env = np.where(k >= 0, k, M)
+
+    # We generate the artificial earthquakes from white noise band-filtered
+    # and modulated by using different envelope functions.
+    # There is no noise before the beginning of the signal, so the filters
+    # start from rest there, as they do when the whole signal is filtered.
+    w_noise = random_state.randn(len(t0), M)
+    w_noise[n < 0] = 0.
+    artificial_earthquake = np.zeros((len(t0), M))
     for i in xrange(N_filt):
-        end = np.minimum(L, n1[i])
-        noise_env[i, n0:end] = (filt_amp[i] *
-                                  np.exp(-alpha[i] *
-                                         (np.arange(n0, end) - n0)))
-    # We multiply the envelope for each noise band
-    noise_band_envelope = noise_band * noise_env
-    artificial_earthquake = np.sum(noise_band_envelope, 0)
-    eq_pw_db = 10 * np.log10(np.var(artificial_earthquake[n0:n0 + 5 * fs]))
-    # We want the earthquake has a power in dB given by P_signal_db
+        noise_band = _bandpass(w_noise, f_filt_low[i], f_filt_high[i], fs)
+        # We multiply the envelope for each noise band
+        noise_band *= noise_env[env_idx[:, np.newaxis], i, k_env]
+        artificial_earthquake += noise_band
+    # Power of the first five seconds of each earthquake
+    eq_pw_db = 10 * np.log10(_masked_var(
+        artificial_earthquake[:, warmup:warmup + n_power],
+        n[:, warmup:warmup + n_power] < L))
+    # We want the earthquakes have a power in dB given by P_signal_db
     gamma_signal = 10 ** ((P_signal_db - eq_pw_db) / 20)
-    artificial_earthquake = gamma_signal * artificial_earthquake
-    return artificial_earthquake
+    artificial_earthquake *= gamma_signal[:, np.newaxis]
+    # Place the earthquakes into the signals
+    out = np.zeros((len(t0), L))
+    in_signal = (n >= 0) & (n < L)
+    rows = np.repeat(np.arange(len(t0)), M).reshape(len(t0), M)
+    out[rows[in_signal], n[in_signal]] = artificial_earthquake[in_signal]
+    return out
+
+
+def _bandpass(x, f_low, f_high, fs):
+    """Filters the rows of 'x' with a Butterworth band-pass filter of order 2.
+
+    The filter is applied as second-order sections where they are supported
+    by scipy, which is more accurate than using a transfer function for
+    narrow bands.
+    """
+    wn = [f_low / (fs / 2.), f_high / (fs / 2.)]
+    if hasattr(signal, 'sosfilt'):
+        sos = signal.butter(2, wn, btype='bandpass', output='sos')
+        return signal.sosfilt(sos, x, axis=-1)
+    b, a = signal.butter(2, wn, btype='bandpass')
+    return signal.lfilter(b, a, x, axis=-1)
 
 
-def generate_seismic_noise(tmax, fs, P_noise_db, bfirls=None):
+def generate_seismic_noise(tmax, fs, P_noise_db, bfirls=None,
+                           random_state=None):
     """Generates a seismic background noise signal.
 
     Args:
@@ -219,27 +319,70 @@ def generate_seismic_noise(tmax, fs, P_noise_db, bfirls=None):
 
             Default value is None, which means unfiltered white noise is used
                 to model the background noise.
+        random_state: Seed of the random numbers, an integer or a
+            numpy.random.RandomState instance. Default value is None,
+            which means the global random state of numpy is used.
 
     Returns:
         out: A numpy array containing the generated signal.
     """
+    return generate_seismic_noises(1, tmax, fs, P_noise_db, bfirls,
+                                   random_state)[0]
+
+
+def generate_seismic_noises(size, tmax, fs, P_noise_db, bfirls=None,
+                            random_state=None):
+    """Generates a batch of seismic background noise signals.
+
+    Same as 'generate_seismic_noise', but 'size' signals are generated at
+    once, each one a row of the output.
+
+    Returns:
+        out: A numpy array containing a generated signal on each row.
+    """
     if fs <= 0:
         raise ValueError("fs must be a positive value")
+    random_state = _random_state(random_state)
     if bfirls is None:
         bfirls = np.array([1])
     # Signal length in the range 0:1/fs:tmax
     L = int(tmax * fs) + 1
     # White noise generation for polluting the earthquake
     # We add noise according to Peterson's Model
-    x = np.random.randn(L)
-    background_noise = signal.lfilter(bfirls, 1, x)
+    x = random_state.randn(size, L)
+    background_noise = fftutils.fir_filter(bfirls, x)
     # We want the white noise has a power in dB given by P_noise_db
-    bg_noise_pow_db = 10 * np.log10(np.var(background_noise))
+    bg_noise_pow_db = 10 * np.log10(np.var(background_noise, axis=-1))
     gamma_noise = 10 ** ((P_noise_db - bg_noise_pow_db) / 20)
-    background_noise = gamma_noise * background_noise
+    background_noise *= gamma_noise[:, np.newaxis]
     return background_noise
 
 
+def _random_state(seed):
+    """Gets a random state from a seed.
+
+    Args:
+        seed: None, an integer or a numpy.random.RandomState instance.
+
+    Returns:
+        out: The global random state of numpy if 'seed' is None, 'seed' if it
+            is already a random state, or else a new random state
+            initialized with 'seed'.
+    """
+    if seed is None:
+        return np.random.mtrand._rand
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    return np.random.RandomState(seed)
+
+
+def _masked_var(x, mask):
+    """Variance of each row of 'x' over the values where 'mask' is True."""
+    count = np.sum(mask, axis=-1)
+    mean = np.sum(x * mask, axis=-1) / count
+    return np.sum(((x - mean[:, np.newaxis]) * mask) ** 2, axis=-1) / count
+
+
 class EarthquakeGenerator(object):
     """A class that generates synthetic earthquake signals.
 
@@ -310,7 +453,7 @@ class EarthquakeGenerator(object):
         self.bfirls = fhandler.read()
 
     def generate_events(self, t_average, t_max, b=1.0,
-                               m_min=2.0, m_max=7.0):
+                               m_min=2.0, m_max=7.0, random_state=None):
         """Generates a random sequence of seismic events from initial
         time zero to a given maximum time.
 
@@ -330,21 +473,26 @@ class EarthquakeGenerator(object):
             m_max: Upper bound of earthquake magnitudes.
                 If value is None then no upper limit is considered.
                 Default: 7.0.
+            random_state: Seed of the random numbers, an integer or a
+                numpy.random.RandomState instance. Default value is None,
+                which means the global random state of numpy is used.
 
         Returns:
             event_t: Times list of the generated events.
             event_m: Magnitudes list of the generated events.
         """
+        random_state = _random_state(random_state)
         event_t = []
-        t = np.random.poisson(t_average)
+        t = random_state.poisson(t_average)
         while t < t_max:
             event_t.append(t)
-            t += np.random.poisson(t_average)
-        event_m = gutenberg_richter(b, len(event_t), m_min, m_max)
+            t += random_state.poisson(t_average)
+        event_m = gutenberg_richter(b, len(event_t), m_min, m_max,
+                                    random_state)
         return np.array(event_t), event_m
 
     def generate_nevents(self, t_average, event_n, b=1.0,
-                               m_min=2.0, m_max=7.0):
+                               m_min=2.0, m_max=7.0, random_state=None):
         """Generates a random list of seismic events of a given size.
 
         Events are described by their time of occurrence and magnitude.
@@ -362,16 +510,20 @@ class EarthquakeGenerator(object):
             m_max: Upper bound of earthquake magnitudes.
                 If value is None then no upper limit is considered.
                 Default: 7.0.
+            random_state: Seed of the random numbers, an integer or a
+                numpy.random.RandomState instance. Default value is None,
+                which means the global random state of numpy is used.
 
         Returns:
             event_t: Times list of the generated events.
             event_m: Magnitudes list of the generated events.
         """
-        event_t = np.cumsum(np.random.poisson(t_average, event_n))
-        event_m = gutenberg_richter(b, event_n, m_min, m_max)
+        random_state = _random_state(random_state)
+        event_t = np.cumsum(random_state.poisson(t_average, event_n))
+        event_m = gutenberg_richter(b, event_n, m_min, m_max, random_state)
         return event_t, event_m
 
-    def generate_earthquake(self, t_max, t0, p_eq):
+    def generate_earthquake(self, t_max, t0, p_eq, random_state=None):
         """Generates a synthetic earthquake with background noise.
 
         Args:
@@ -379,6 +531,9 @@ class EarthquakeGenerator(object):
             t0: Start time of the earthquake in seconds from the beginning
                 of the signal in seconds.
             p_eq: Earthquake power in dB.
+            random_state: Seed of the random numbers, an integer or a
+                numpy.random.RandomState instance. Default value is None,
+                which means the global random state of numpy is used.
 
         Returns:
             out: A numpy array containing the generated signal.
@@ -389,17 +544,163 @@ class EarthquakeGenerator(object):
                                               self.high_period,
                                               self.bandwidth, self.overlap,
                                               self.f_low, self.f_high,
-                                              self.low_amp, self.high_amp)
+                                              self.low_amp, self.high_amp,
+                                              random_state)
+
+    def generate_earthquakes(self, size, t_max, t0, p_eq, random_state=None):
+        """Generates a batch of synthetic earthquakes with background noise.
 
-    def generate_noise(self, eq):
+        All the signals are generated at once, which is much faster than
+        calling 'generate_earthquake' for each one of them.
+
+        Args:
+            size: Number of generated signals.
+            t_max: Length of the generated signals in seconds.
+            t0: Start time of the earthquakes in seconds from the beginning
+                of the signals. Either a single value for all the signals
+                or a list of 'size' values.
+            p_eq: Earthquake power in dB. Either a single value for all the
+                signals or a list of 'size' values.
+            random_state: Seed of the random numbers, an integer or a
+                numpy.random.RandomState instance, so that the same signals
+                can be generated again. Default value is None, which means
+                the global random state of numpy is used.
+
+        Returns:
+            out: A numpy array containing a generated signal on each row.
+        """
+        random_state = _random_state(random_state)
+        t0 = np.zeros(size) + t0
+        p_eq = np.zeros(size) + p_eq
+        earthquakes = generate_seismic_earthquakes(t_max, t0, self.fs, p_eq,
+                                                   self.low_period,
+                                                   self.high_period,
+                                                   self.bandwidth,
+                                                   self.overlap,
+                                                   self.f_low, self.f_high,
+                                                   self.low_amp,
+                                                   self.high_amp,
+                                                   random_state)
+        earthquakes += generate_seismic_noises(size, t_max, self.fs,
+                                               self.P_noise_db, self.bfirls,
+                                               random_state)
+        return earthquakes
+
+    def generate_stream(self, t_max, event_t, event_p, chunk_size=CHUNK_SIZE,
+                        random_state=None):
+        """Generates a continuous record with several synthetic earthquakes
+        and background noise, chunk by chunk.
+
+        This is a lazy function (generator), so records of any length can
+        be written to a file without holding them in memory:
+
+            event_t, event_m = generator.generate_events(600., 86400.)
+            # Power in dB of each event, 5 dB at magnitude 2
+            event_p = 5. + 20. * (event_m - 2.)
+            chunks = generator.generate_stream(86400., event_t, event_p)
+            rawfile.BinFile('day.bin').write_in_blocks(chunks)
+
+        Background noise is generated on each chunk by filtering white noise
+        with 'bfirls', whose state is kept from one chunk to the next.
+        Long filters are applied by FFT convolution (see
+        'fftutils.fir_filter').
+        As the record is not known in advance, noise power is set from the
+        gain of the filter instead of the variance of the whole signal.
+        Each earthquake is generated as a short signal, starting
+        'EVENT_WARMUP' seconds before its arrival time and ending when
+        its envelopes fall to zero, and it is added to every chunk it
+        overlaps.
+
+        Noise and earthquakes are taken from separate random sequences, so
+        the generated record does not depend on 'chunk_size', up to
+        rounding errors.
+
+        Args:
+            t_max: Length of the generated record in seconds.
+            event_t: A list of arrival times of the earthquakes, in seconds
+                from the beginning of the record.
+            event_p: A list of earthquake powers in dB, one for each
+                arrival time.
+            chunk_size: Number of samples of each generated chunk.
+                Default: 2 ** 16 samples.
+            random_state: Seed of the random numbers, an integer or a
+                numpy.random.RandomState instance. Default value is None,
+                which means the global random state of numpy is used.
+
+        Returns:
+            out: A generator of numpy arrays, the consecutive chunks of the
+                record. The first sample is at time zero.
+        """
+        if self.fs <= 0:
+            raise ValueError("fs must be a positive value")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be a positive value")
+        if len(event_t) != len(event_p):
+            raise ValueError("event_t and event_p must have the same length")
+        # Signal length in the range 0:1/fs:tmax
+        L = int(t_max * self.fs) + 1
+        order = np.argsort(event_t, kind='mergesort')
+        event_t = np.asarray(event_t, dtype=float)[order]
+        event_p = np.asarray(event_p, dtype=float)[order]
+        if len(event_t) > 0 and (event_t[0] < 0 or
+                                 int(event_t[-1] * self.fs) >= L):
+            raise ValueError("Generated earthquakes must be within the signal.")
+        random_state = _random_state(random_state)
+        noise_state = np.random.RandomState(random_state.randint(2 ** 31))
+        event_state = np.random.RandomState(random_state.randint(2 ** 31))
+        return self._generate_stream(L, event_t, event_p, chunk_size,
+                                     noise_state, event_state)
+
+    def _generate_stream(self, L, event_t, event_p, chunk_size, noise_state,
+                         event_state):
+        """Generator of the chunks of 'generate_stream'."""
+        bfirls = np.array([1.]) if self.bfirls is None else np.asarray(self.bfirls)
+        zi = np.zeros(len(bfirls) - 1)
+        # Gain that gives filtered unit white noise a power of P_noise_db
+        gamma_noise = 10 ** (self.P_noise_db / 20.) / np.sqrt(np.sum(bfirls ** 2))
+        warmup = EVENT_WARMUP
+        # Events end when the longest of their envelopes falls to zero
+        event_len = warmup + max(self.low_period, self.high_period)
+        next_event = 0
+        codas = []  # Start sample and data of the events being added
+        for start in xrange(0, L, chunk_size):
+            end = min(L, start + chunk_size)
+            x = noise_state.randn(end - start)
+            x, zi = fftutils.fir_filter(bfirls, x, zi)
+            chunk = gamma_noise * x
+            # Generate the earthquakes that start within the chunk
+            while (next_event < len(event_t) and
+                   int(event_t[next_event] * self.fs) < end):
+                eq = generate_seismic_earthquake(event_len, warmup, self.fs,
+                                                 event_p[next_event],
+                                                 self.low_period,
+                                                 self.high_period,
+                                                 self.bandwidth, self.overlap,
+                                                 self.f_low, self.f_high,
+                                                 self.low_amp, self.high_amp,
+                                                 event_state)
+                codas.append((int(event_t[next_event] * self.fs),
+                              eq[int(warmup * self.fs):]))
+                next_event += 1
+            # Add the part of each earthquake that overlaps the chunk
+            for n0, eq in codas:
+                first, last = max(start, n0), min(end, n0 + len(eq))
+                chunk[first - start:last - start] += eq[first - n0:last - n0]
+            codas = [(n0, eq) for n0, eq in codas if n0 + len(eq) > end]
+            yield chunk
+
+    def generate_noise(self, eq, random_state=None):
         """Adds background noise to a given seismic signal.
 
         Args:
             eq: A seismic signal, numpy array type.
+            random_state: Seed of the random numbers, an integer or a
+                numpy.random.RandomState instance. Default value is None,
+                which means the global random state of numpy is used.
 
         Returns:
             out: Generated signal, numpy array type.
         """
         noise = generate_seismic_noise(len(eq) / self.fs, self.fs, self.P_noise_db,
-                                       self.bfirls)
+                                       self.bfirls, random_state)
         return noise + eq
@@ -25,12 +25,16 @@
 '''
 
 import numpy as np
-from scipy import signal
 
 
 def find_peaks(x, threshold=None, order=1):
     """Finds local maxima of a function.
 
+    Local maxima are the same as those given by 'scipy.signal.argrelmax',
+    but they are found by comparing each point with the maximum of the
+    'order' samples on each side, so it takes linear time regardless of
+    'order'.
+
     Args:
         x: A data vector.
         threshold: Local maxima under this value will be discarded.
@@ -45,7 +49,7 @@ def find_peaks(x, threshold=None, order=1):
         out: A list of local maxima, numpy array type.
     """
     if threshold is not None:
-        event_peaks = signal.argrelmax(x, order=int(order))[0]
+        event_peaks = _relmax(np.asarray(x), int(order))
         if event_peaks.size > 0:
             return event_peaks[x[event_peaks] > threshold]
         return event_peaks
@@ -53,3 +57,196 @@ def find_peaks(x, threshold=None, order=1):
         if x.size > 0:
             return np.array([np.argmax(x)])
         return np.array([])
+
+
+def _relmax(x, order):
+    """Finds the points of 'x' greater than 'order' samples on each side.
+
+    Samples beyond the ends of 'x' are taken as the closest end, like
+    'scipy.signal.argrelmax' does, so neither end is ever a local maximum.
+    """
+    if order < 1:
+        raise ValueError("order should be a positive value")
+    n = len(x)
+    if n < 3:
+        return np.zeros(0, dtype=np.int64)
+    order = min(order, n)
+    x = x.astype(np.float64)
+    padding = np.full(order, -np.inf)
+    # Maximum of the 'order' samples at each side of every point
+    window_max = _sliding_max(np.concatenate((padding, x, padding)), order)
+    is_peak = (x > window_max[:n]) & (x > window_max[order + 1:])
+    is_peak[0] = is_peak[-1] = False
+    return np.flatnonzero(is_peak)
+
+
+def _sliding_max(x, w):
+    """Computes the maximum of every window of 'w' samples of 'x'.
+
+    Uses van Herk/Gil-Werman algorithm: the maximum of a window is the
+    greatest of the suffix maximum of the block of 'w' samples where it
+    begins and the prefix maximum of the block where it ends.
+
+    Returns:
+        out: An array of length len(x) - w + 1, where out[i] is the
+            maximum of x[i:i + w].
+    """
+    n = len(x)
+    n_blocks = -(-n // w)
+    blocks = np.full(n_blocks * w, -np.inf)
+    blocks[:n] = x
+    blocks = blocks.reshape(n_blocks, w)
+    prefix = np.maximum.accumulate(blocks, axis=1).ravel()
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.maximum(suffix[:n - w + 1], prefix[w - 1:n])
+
+
+class Trigger(object):
+    """Finds events in a characteristic function that is fed in chunks.
+
+    A trigger is switched on when the function goes over 'threshold_on' and
+    switched off when it goes below 'threshold_off'. Local maxima found
+    while the trigger is on are given out as events as soon as the function
+    is known 'order' samples after them, so the events are the same no
+    matter how the function is split into chunks:
+
+        trigger = Trigger(threshold_on=3., threshold_off=1.5, order=100)
+        for cf in chunks:
+            et, on, off = trigger.push(cf)
+            ...
+        et, on, off = trigger.flush()
+
+    When both thresholds are equal, events are the same as those of
+    'find_peaks' function over the whole characteristic function.
+
+    Attributes:
+        threshold_on: The trigger is switched on when the characteristic
+            function goes over this value. If None, the trigger is never
+            switched on, and only the global maximum of the function is
+            given out when the trigger is flushed (picking mode).
+            Default value is None.
+        threshold_off: The trigger is switched off when the characteristic
+            function goes below this value. Default value is None, that is,
+            the same value as 'threshold_on'.
+        order: Number of samples before and after a data point that have
+            to be smaller than the data point to be considered a local
+            maximum. If None, no local maxima are searched and only the
+            positions where the trigger is switched on and off are given out.
+            Default: 1.
+        triggered: Whether the trigger is currently on or not.
+        n_in: Number of characteristic function values received so far.
+    """
+
+    def __init__(self, threshold_on=None, threshold_off=None, order=1):
+        super(Trigger, self).__init__()
+        if order is not None and order < 1:
+            raise ValueError("order should be a positive value")
+        self.threshold_on = threshold_on
+        self.threshold_off = threshold_on if threshold_off is None else threshold_off
+        self.order = None if order is None else int(order)
+        self.reset()
+
+    def reset(self):
+        """Discards any data received so far and restarts the trigger."""
+        self.n_in = 0
+        self.triggered = False
+        self._cf = np.zeros(0)  # Values kept to check for local maxima
+        self._active = np.zeros(0, dtype=bool)  # Trigger state of each value
+        self._cf_start = 0
+        self._next_peak = 0
+        self._max_idx = None
+        self._max_value = -np.inf
+
+    def push(self, cf):
+        """Feeds a chunk of the characteristic function to the trigger.
+
+        Args:
+            cf: Characteristic function values, numpy array type. They follow
+                those received by previous calls.
+
+        Returns:
+            et: Events completed by this chunk, given in samples from the
+                start of the characteristic function.
+            on: Positions where the trigger was switched on.
+            off: Positions where the trigger was switched off.
+        """
+        cf = np.asarray(cf, dtype=np.float64)
+        on, off, active = self._switch(cf)
+        self.n_in += len(cf)
+        return self._find_peaks(cf, active), on, off
+
+    def flush(self):
+        """Gives out the remaining events as the end of the function.
+
+        A trigger that is still on is switched off at the last sample. The
+        trigger is reset afterwards, so it can be used for a new function.
+
+        Returns:
+            et: Remaining events. In picking mode, the position of the global
+                maximum of the function.
+            on: Remaining positions where the trigger was switched on.
+            off: Remaining positions where the trigger was switched off.
+        """
+        et = self._find_peaks(np.zeros(0), np.zeros(0, dtype=bool), final=True)
+        off = np.array([self.n_in - 1] if self.triggered else [], dtype=int)
+        self.reset()
+        return et, np.zeros(0, dtype=int), off
+
+    def _switch(self, cf):
+        """Finds where the trigger is switched on and off within a chunk.
+
+        Returns both lists of positions and the state of the trigger at
+        each value of the chunk.
+        """
+        on, off = [], []
+        active = np.zeros(len(cf), dtype=bool)
+        if self.threshold_on is not None:
+            above = np.flatnonzero(cf > self.threshold_on)
+            below = np.flatnonzero(cf < self.threshold_off)
+            pos = 0
+            while True:
+                crossings = below if self.triggered else above
+                k = np.searchsorted(crossings, pos)
+                if k == len(crossings):
+                    break
+                if self.triggered:
+                    active[pos:crossings[k]] = True
+                    off.append(self.n_in + crossings[k])
+                else:
+                    on.append(self.n_in + crossings[k])
+                pos = crossings[k]
+                self.triggered = not self.triggered
+            if self.triggered:
+                active[pos:] = True
+        return np.array(on, dtype=int), np.array(off, dtype=int), active
+
+    def _find_peaks(self, cf, active, final=False):
+        """Finds the events among the given values.
+
+        A local maximum is given out when the function is known 'order'
+        samples after it, so previous values are kept as long as they are
+        needed for the comparison.
+        """
+        if self.threshold_on is None:
+            if len(cf) > 0 and np.max(cf) > self._max_value:
+                self._max_value = np.max(cf)
+                self._max_idx = self.n_in - len(cf) + np.argmax(cf)
+            if final and self._max_idx is not None:
+                return np.array([self._max_idx])
+            return np.zeros(0, dtype=int)
+        if self.order is None:
+            return np.zeros(0, dtype=int)
+        self._cf = np.concatenate((self._cf, cf))
+        self._active = np.concatenate((self._active, active))
+        limit = self.n_in if final else self.n_in - self.order
+        if limit <= self._next_peak:
+            return np.zeros(0, dtype=int)
+        et = _relmax(self._cf, self.order)
+        et = et[self._active[et]] + self._cf_start
+        et = et[(et >= self._next_peak) & (et < limit)]
+        self._next_peak = limit
+        first = max(self._cf_start, limit - self.order)
+        self._cf = self._cf[first - self._cf_start:]
+        self._active = self._active[first - self._cf_start:]
+        self._cf_start = first
+        return et
@@ -28,10 +28,16 @@
 import numpy as np
 
 from apasvo.picking import findpeaks
+from apasvo.utils import fftutils
+from apasvo.utils import resample
 from numpy.lib import stride_tricks
 from scipy import signal
 
 
+# Maximum number of samples of a 2-D array processed at once by 'sta_lta'
+STACK_BLOCK_SIZE = 2 ** 18
+
+
 def sta_lta(x, fs, threshold=None, sta_length=5., lta_length=100.,
             peak_window=1., method='convolution'):
     """Event picking/detection using STA-LTA algorithm.
@@ -47,7 +53,9 @@ def sta_lta(x, fs, threshold=None, sta_length=5., lta_length=100.,
     algorithm. IASPEI New Manual of Seismological Observatory Practice, 2, 1-19.
 
     Args:
-        x: Seismic data, numpy array type.
+        x: Seismic data, numpy array type. A 2-D array is taken as a set of
+            signals of the same length, one per row, e.g. the channels of
+            an array of stations, which are processed all at once.
         fs: Sampling rate in Hz.
         threshold: Local maxima found in the characteristic function over
             this value will be returned by the function as possible events
@@ -64,9 +72,16 @@ def sta_lta(x, fs, threshold=None, sta_length=5., lta_length=100.,
             point to be a local maximum.
             If 'threshold' is None, this parameter has no effect.
             Default value is 1 s.
-        method: 'strides', 'convolution' or 'iterative'.
+        method: 'strides', 'convolution', 'iterative', 'cumsum' or
+            'recursive'.
             Warning: 'strides' method may throw an 'array too big' ValueError
             exception on 32 bit builds if x is large enough.
+            'cumsum' method computes the averages from running sums, so
+            its cost does not depend on the length of the windows.
+            'recursive' method computes the classic recursive STA-LTA, whose
+            averages are exponentially weighted over the past samples
+            instead of computed over windows ahead of each sample. The
+            characteristic function is zero over the first LTA window.
             Default: 'convolution'
 
     Returns:
@@ -74,7 +89,9 @@ def sta_lta(x, fs, threshold=None, sta_length=5., lta_length=100.,
             start of the signal, that correspond to the local maxima of the
             characteristic function. If threshold is None, the list contains
             only the global maximum of the function.
-        cf: Characteristic function, numpy array type.
+            If x is a 2-D array, a list with the events of each row.
+        cf: Characteristic function, numpy array type, with the same shape
+            as x.
     """
     # Check arguments
     if fs <= 0:
@@ -85,17 +102,39 @@ def sta_lta(x, fs, threshold=None, sta_length=5., lta_length=100.,
         raise ValueError("lta_length must be a positive value")
     if sta_length >= lta_length:
         raise ValueError("lta_length must be greater than sta_length")
-    if method not in ('convolution', 'strides', 'iterative'):
+    if method not in ('convolution', 'strides', 'iterative', 'cumsum',
+                      'recursive'):
         raise ValueError("method not supported")
+    x = np.asarray(x)
+    if x.ndim not in (1, 2):
+        raise ValueError("x must be a 1-D or 2-D array")
+    if x.ndim == 2:
+        # Rows are processed in blocks, so that intermediate arrays fit in
+        # cache memory
+        step = 1 if method in ('strides', 'iterative') else \
+            max(1, STACK_BLOCK_SIZE // max(1, x.shape[1]))
+        if len(x) > step:
+            results = [sta_lta(x[i:i + step], fs, threshold=threshold,
+                               sta_length=sta_length, lta_length=lta_length,
+                               peak_window=peak_window, method=method)
+                       for i in xrange(0, len(x), step)]
+            return ([row_et for event_t, _ in results for row_et in event_t],
+                    np.vstack([cf for _, cf in results]))
+        if method in ('strides', 'iterative'):
+            event_t, cf = sta_lta(x[0], fs, threshold=threshold,
+                                  sta_length=sta_length, lta_length=lta_length,
+                                  peak_window=peak_window, method=method)
+            return [event_t], cf[np.newaxis]
 
     fs = float(fs)
-    sta = min(len(x), sta_length * fs + 1)
-    lta = min(len(x), lta_length * fs + 1)
+    n = x.shape[-1]
+    sta = min(n, sta_length * fs + 1)
+    lta = min(n, lta_length * fs + 1)
     peak_window = int(peak_window * fs / 2.)
-    x_norm = np.abs(x - np.mean(x))
-    cf = np.zeros(len(x))
+    x_norm = np.abs(x - np.mean(x, axis=-1, keepdims=True))
+    cf = np.zeros(x.shape)
 
-    if len(cf) > 0:
+    if cf.size > 0:
         if method == 'strides':
             sta_win = stride_tricks.as_strided(np.concatenate((x_norm, np.zeros(sta))),
                                                shape=(len(x), sta),
@@ -109,21 +148,154 @@ def sta_lta(x, fs, threshold=None, sta_length=5., lta_length=100.,
                                           np.arange(lta, 0, -1)))
             cf = (sta_win.sum(axis=1) / sta_win_len) / (lta_win.sum(axis=1) / lta_win_len)
         elif method == 'convolution':
-            sta_win = signal.fftconvolve(np.ones(sta), x_norm)[sta - 1:]
-            lta_win = signal.fftconvolve(np.ones(lta), x_norm)[lta - 1:]
-            sta_win_len = np.concatenate((np.ones(len(x) - sta) * sta,
-                                          np.arange(sta, 0, -1)))
-            lta_win_len = np.concatenate((np.ones(len(x) - lta) * lta,
-                                          np.arange(lta, 0, -1)))
-            cf = (sta_win / sta_win_len) / (lta_win / lta_win_len)
+            # The spectrum of the signal is shared by both windows and by
+            # all the rows of x
+            nfft = fftutils.next_fast_len(n + int(lta) - 1)
+            X = np.fft.rfft(x_norm, nfft)
+            averages = []
+            for w in (int(sta), int(lta)):
+                win = np.fft.irfft(X * np.fft.rfft(np.ones(w), nfft), nfft)
+                averages.append(win[..., w - 1:w - 1 + n] /
+                                np.minimum(w, n - np.arange(n)))
+            cf = averages[0] / averages[1]
         elif method == 'iterative':
             for i in xrange(len(x)):
                 cf[i] = np.mean(x_norm[i:i + sta]) / np.mean(x_norm[i:i + lta])
+        elif method == 'cumsum':
+            sums = _PrefixSums(x_norm, lta)
+            cf = sums.mean(int(sta)) / sums.mean(int(lta))
+        elif method == 'recursive':
+            zi = np.zeros(x.shape[:-1] + (1,))
+            sta_avg, _ = _recursive_mean(x_norm, int(sta), zi)
+            lta_avg, _ = _recursive_mean(x_norm, int(lta), zi)
+            cf[..., int(lta):] = (sta_avg[..., int(lta):] /
+                                  lta_avg[..., int(lta):])
 
-    event_t = findpeaks.find_peaks(cf, threshold, order=peak_window * fs)
+    if cf.ndim == 2:
+        event_t = [findpeaks.find_peaks(row, threshold, order=peak_window * fs)
+                   for row in cf]
+    else:
+        event_t = findpeaks.find_peaks(cf, threshold, order=peak_window * fs)
     return event_t, cf
 
 
+def _recursive_mean(x, w, zi):
+    """Exponential moving average of x over an effective window of w samples.
+
+    Returns the average and the final state of the filter, which can be
+    given as 'zi' to continue the average over the next samples of x.
+    The average is computed along the last axis of x.
+    """
+    c = 1. / w
+    return signal.lfilter([c], [1., c - 1.], x, axis=-1, zi=zi)
+
+
+class _PrefixSums(object):
+    """Moving averages of a signal from its prefix sums.
+
+    The signal is split into blocks at least as long as the longest window,
+    and the prefix sums restart at each block, so their rounding errors are
+    bounded by the length of a block instead of the length of the signal.
+    As a window crosses at most one block boundary, the sum of any window
+    is computed from two prefix sums and, at most, the total of a block.
+    If x has several dimensions, the sums run along its last axis.
+
+    Attributes:
+        n: Length of the signal.
+        block: Length of each block.
+    """
+
+    # Minimum length of a block
+    MIN_BLOCK = 4096
+
+    def __init__(self, x, max_window):
+        super(_PrefixSums, self).__init__()
+        shape = np.shape(x)[:-1]
+        self.n = np.shape(x)[-1]
+        self.block = int(max(max_window, self.MIN_BLOCK))
+        # One more block, so that windows can end at the end of the signal
+        n_blocks = self.n // self.block + 1
+        blocks = np.zeros(shape + (n_blocks, self.block))
+        blocks.reshape(shape + (-1,))[..., :self.n] = x
+        # prefix[i] is the sum of the samples of the block of i before i
+        cumsum = np.cumsum(blocks, axis=-1)
+        self.totals = cumsum[..., -1].copy()
+        cumsum -= blocks
+        self.prefix = cumsum.reshape(shape + (-1,))
+
+    def mean(self, w):
+        """Mean of x[i:i + w] for every i, windows being truncated at
+        the end of the signal."""
+        w = min(w, self.n)
+        # Sum of x[i:end], end being min(i + w, n)
+        total = np.concatenate([self.prefix[..., w:self.n],
+                                np.repeat(self.prefix[..., self.n:self.n + 1],
+                                          w, axis=-1)], axis=-1)
+        total -= self.prefix[..., :self.n]
+        # Windows crossing a block boundary also add up the rest of the
+        # block they start in
+        start = np.arange(self.n)
+        end = np.minimum(start + w, self.n)
+        crossing = np.flatnonzero(end // self.block > start // self.block)
+        total[..., crossing] += self.totals[..., crossing // self.block]
+        return total / (end - start)
+
+
+def sta_lta_bank(x, fs, lengths, threshold=None, peak_window=1.):
+    """Applies STA-LTA algorithm with several pairs of window lengths.
+
+    The prefix sums of the signal are computed once for all the pairs and
+    the average of each distinct window length is computed once too, so
+    the cost is linear in the length of the signal and in the number of
+    distinct window lengths. Results are those of 'sta_lta' function with
+    method 'cumsum', up to rounding errors.
+
+    Args:
+        x: Seismic data, numpy array type.
+        fs: Sampling rate in Hz.
+        lengths: A list of pairs (sta_length, lta_length) of window lengths,
+            in seconds.
+        threshold: Local maxima found in the characteristic functions over
+            this value will be returned as possible events. See 'sta_lta'
+            function. Default value is None.
+        peak_window: See 'sta_lta' function. Default value is 1 s.
+
+    Returns:
+        A list of tuples (event_t, cf), one for each pair of 'lengths',
+        with the possible events and the characteristic function that
+        'sta_lta' function returns for it.
+    """
+    if fs <= 0:
+        raise ValueError("fs must be a positive value")
+    for sta_length, lta_length in lengths:
+        if sta_length <= 0:
+            raise ValueError("sta_length must be a positive value")
+        if lta_length <= 0:
+            raise ValueError("lta_length must be a positive value")
+        if sta_length >= lta_length:
+            raise ValueError("lta_length must be greater than sta_length")
+    fs = float(fs)
+    peak_window = int(peak_window * fs / 2.)
+    windows = [(int(min(len(x), sta_length * fs + 1)),
+                int(min(len(x), lta_length * fs + 1)))
+               for sta_length, lta_length in lengths]
+    if len(x) == 0:
+        return [(findpeaks.find_peaks(np.zeros(0), threshold), np.zeros(0))
+                for _ in windows]
+    sums = _PrefixSums(np.abs(x - np.mean(x)),
+                       max(lta for _, lta in windows))
+    means = {}
+    results = []
+    for sta, lta in windows:
+        for w in (sta, lta):
+            if w not in means:
+                means[w] = sums.mean(w)
+        cf = means[sta] / means[lta]
+        event_t = findpeaks.find_peaks(cf, threshold, order=peak_window * fs)
+        results.append((event_t, cf))
+    return results
+
+
 class StaLta(object):
     """A class to configure an instance of the STA-LTA algorithm and
     apply it over a given seismic signal.
@@ -133,18 +305,36 @@ class StaLta(object):
             Default: 5.0 seconds.
         lta_length: length of LTA window, in seconds.
             Default 100.0 seconds.
+        decimate: Whether to decimate the signal before applying the
+            algorithm or not. The signal is decimated by the largest
+            factor that keeps 'f_max' free of aliasing. Picks are given
+            at the original rate and the characteristic function is
+            interpolated to it.
+            Default: False.
+        f_max: Highest frequency of interest of the signal, in Hz.
+            Required if 'decimate' is True. Default: None.
+        cf_method: Method used to compute the averages, see 'method'
+            argument of 'sta_lta' function. Default: 'convolution'.
     """
 
-    def __init__(self, sta_length=5.0, lta_length=100.0, **kwargs):
+    def __init__(self, sta_length=5.0, lta_length=100.0, decimate=False,
+                 f_max=None, cf_method='convolution', **kwargs):
         super(StaLta, self).__init__()
         self.sta_length = sta_length
         self.lta_length = lta_length
+        self.cf_method = cf_method
+        if decimate and f_max is None:
+            raise ValueError("f_max is required to decimate the signal")
+        self.decimate = decimate
+        self.f_max = f_max
 
     def run(self, x, fs, threshold=None, peak_window=1.0):
         """Executes STA-LTA algorithm over a given array of data
 
         Args:
-            x: Seismic data, numpy array type.
+            x: Seismic data, numpy array type. A 2-D array is taken as a set
+                of signals of the same length, one per row, which are
+                processed all at once.
             fs: Sample rate in Hz.
             threshold: Local maxima found in the characteristic function over
                 this value will be returned by the function as possible events
@@ -163,14 +353,216 @@ class StaLta(object):
                 start of the signal, that correspond to the local maxima of the
                 characteristic function. If threshold is None, the list contains
                 only the global maximum of the function.
-            cf: Characteristic function, numpy array type.
+                If x is a 2-D array, a list with the events of each row.
+            cf: Characteristic function, numpy array type, with the same
+                shape as x.
         """
-        et, cf = sta_lta(x, fs, threshold=threshold,
+        x = np.asarray(x)
+        q = 1
+        if self.decimate:
+            q = resample.decimation_factor(fs, self.f_max)
+        if q > 1:
+            x_dec = np.array([resample.decimate(row, q)
+                              for row in np.atleast_2d(x)])
+        et, cf = sta_lta(x_dec.reshape(x.shape[:-1] + (-1,)) if q > 1 else x,
+                         fs / float(q), threshold=threshold,
                          sta_length=self.sta_length,
                          lta_length=self.lta_length,
-                         peak_window=peak_window)
+                         peak_window=peak_window, method=self.cf_method)
+        if q > 1:
+            n = x.shape[-1]
+            if x.ndim == 2:
+                return ([row_et * q for row_et in et],
+                        np.array([resample.interpolate(row, q, n)
+                                  for row in cf]).reshape(x.shape))
+            return et * q, resample.interpolate(cf, q, n)
         return et, cf
 
     @property
     def name(self):
         return self.__class__.__name__.upper()
+
+
+class StaLtaStream(StaLta):
+    """A streaming version of the STA-LTA algorithm.
+
+    Computes the characteristic function of STA-LTA algorithm over a signal
+    of unbounded length that is fed in chunks, e.g. read from a file by using
+    'BinFile.read_in_blocks' or received from a live feed, and switches a
+    trigger on and off as the function crosses a pair of thresholds:
+
+        stream = StaLtaStream(fs=100., threshold_on=3., threshold_off=1.5)
+        for block in fin_handler.read_in_blocks(block_size=10000):
+            cf, on, off = stream.push(block)
+            ...
+        cf, on, off = stream.flush()
+
+    With 'recursive' 'cf_method' the averages only depend on past samples,
+    so the characteristic function is given out as soon as data arrives.
+    Any other method computes the averages over windows ahead of each
+    sample, as 'sta_lta' function does, so each value is given out when the
+    LTA window following it has been received.
+    In both cases memory usage is bounded by the length of the LTA window
+    and the size of the chunks, regardless of the length of the signal.
+
+    The signal is centered by subtracting 'offset' from it. The output is
+    equal to that of 'sta_lta' function over the whole signal, up to
+    rounding errors, when 'offset' is the mean of the signal.
+
+    Attributes:
+        fs: Sample rate in Hz.
+        threshold_on: The trigger is switched on when the characteristic
+            function goes over this value. If None, no triggers are given
+            out. Default value is None.
+        threshold_off: The trigger is switched off when the characteristic
+            function goes below this value. Default value is None, that is,
+            the same value as 'threshold_on'.
+        offset: Value subtracted from the signal. If None, the mean of the
+            samples received so far is subtracted from each sample.
+            Default value is None.
+        triggered: Whether the trigger is currently on or not.
+        n_in: Number of samples received so far.
+        n_out: Number of characteristic function values given out so far.
+
+        The rest of attributes are the same as those of StaLta class.
+    """
+
+    def __init__(self, fs, threshold_on=None, threshold_off=None, offset=None,
+                 **kwargs):
+        super(StaLtaStream, self).__init__(**kwargs)
+        if fs <= 0:
+            raise ValueError("fs must be a positive value")
+        if self.sta_length <= 0:
+            raise ValueError("sta_length must be a positive value")
+        if self.lta_length <= 0:
+            raise ValueError("lta_length must be a positive value")
+        if self.sta_length >= self.lta_length:
+            raise ValueError("lta_length must be greater than sta_length")
+        if self.decimate:
+            raise ValueError("decimation is not supported on streams")
+        self.fs = float(fs)
+        self.threshold_on = threshold_on
+        self.threshold_off = threshold_on if threshold_off is None else threshold_off
+        self.offset = offset
+        self._sta = int(self.sta_length * self.fs + 1)
+        self._lta = int(self.lta_length * self.fs + 1)
+        self.reset()
+
+    def reset(self):
+        """Discards any data received so far and restarts the stream."""
+        self.n_in = 0
+        self.n_out = 0
+        self._trigger = findpeaks.Trigger(self.threshold_on, self.threshold_off,
+                                          order=None)
+        self._sum = 0.  # Sum of the samples received so far
+        # Prefix sums of the centered input from the next output value on,
+        # stored in self._prefix[self._start:self._end]
+        self._prefix = np.zeros(2 * self._lta + 1)
+        self._start, self._end = 0, 1
+        self._zi_sta = np.zeros(1)
+        self._zi_lta = np.zeros(1)
+
+    def push(self, x):
+        """Feeds a chunk of data to the stream.
+
+        Args:
+            x: Seismic data, numpy array type.
+
+        Returns:
+            cf: Characteristic function values completed by this chunk,
+                numpy array type. They follow those given out by previous
+                calls, the first of them is at position 'n_out - len(cf)'
+                from the start of the signal.
+            on: Positions where the trigger was switched on, given in samples
+                from the start of the signal.
+            off: Positions where the trigger was switched off, given in
+                samples from the start of the signal.
+        """
+        x_norm = self._center(np.asarray(x, dtype=np.float64))
+        if self.cf_method == 'recursive':
+            cf = self._recursive_cf(x_norm)
+        else:
+            self._append(x_norm)
+            cf = self._windowed_cf(self.n_in - self.n_out - self._lta + 1)
+        return (cf,) + self._trigger.push(cf)[1:]
+
+    def flush(self):
+        """Processes the remaining data as the end of the signal.
+
+        A trigger that is still on is switched off at the last sample of the
+        signal. The stream is reset afterwards, so it can be used for a new
+        signal.
+
+        Returns:
+            cf: Remaining values of the characteristic function.
+            on: Remaining positions where the trigger was switched on.
+            off: Remaining positions where the trigger was switched off.
+        """
+        cf = self._windowed_cf(self.n_in - self.n_out)
+        _, on, off = self._trigger.push(cf)
+        off = np.concatenate((off, self._trigger.flush()[2]))
+        self.reset()
+        return cf, on, off
+
+    def _center(self, x):
+        """Subtracts the offset from a chunk and takes its absolute value."""
+        if self.offset is not None:
+            offset = self.offset
+        else:
+            cumsum = self._sum + np.cumsum(x)
+            offset = cumsum / (self.n_in + np.arange(1, len(x) + 1))
+            if len(x) > 0:
+                self._sum = cumsum[-1]
+        self.n_in += len(x)
+        return np.abs(x - offset)
+
+    def _recursive_cf(self, x_norm):
+        """Continues the recursive averages over a chunk."""
+        sta, self._zi_sta = _recursive_mean(x_norm, self._sta, self._zi_sta)
+        lta, self._zi_lta = _recursive_mean(x_norm, self._lta, self._zi_lta)
+        cf = np.zeros(len(x_norm))
+        # The function is zero over the first LTA window
+        first = min(len(cf), max(0, self._lta - self.n_out))
+        cf[first:] = sta[first:] / lta[first:]
+        self.n_out += len(cf)
+        return cf
+
+    def _append(self, x_norm):
+        """Appends the prefix sums of a chunk to the buffer.
+
+        When the buffer is full, the prefix sums still needed are moved to
+        its start and restarted from zero, so each sample is moved once
+        every LTA window on average and rounding errors do not grow with
+        the length of the signal.
+        """
+        if self._end + len(x_norm) > len(self._prefix):
+            live = self._prefix[self._start:self._end] - self._prefix[self._start]
+            size = len(live) + len(x_norm)
+            if 2 * size > len(self._prefix):
+                self._prefix = np.zeros(2 * size)
+            self._prefix[:len(live)] = live
+            self._start, self._end = 0, len(live)
+        end = self._end + len(x_norm)
+        self._prefix[self._end:end] = (self._prefix[self._end - 1] +
+                                       np.cumsum(x_norm))
+        self._end = end
+
+    def _windowed_cf(self, count):
+        """Gives out the next 'count' values of the function computed over
+        windows, which are truncated at the last sample received."""
+        count = max(0, count)
+        if count == 0:
+            return np.zeros(0)
+        prefix = self._prefix[self._start:self._end]
+        start = np.arange(count)
+        means = []
+        for w in (self._sta, self._lta):
+            end = np.minimum(start + w, len(prefix) - 1)
+            means.append((prefix[end] - prefix[start]) / (end - start))
+        self._start += count
+        self.n_out += count
+        return means[0] / means[1]
+
+    @property
+    def triggered(self):
+        return self._trigger.triggered
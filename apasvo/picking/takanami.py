@@ -24,10 +24,22 @@
   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import math
 import numpy as np
 
+from apasvo.utils import resample
 
-def takanami(x, n0, n1, p=1, k=5):
+
+# Minimum number of AIC sweeps to compute them all at once by numpy array
+# operations. Fewer sweeps are computed one by one on scalars.
+BATCH_MIN_SWEEPS = 16
+
+# Radius of the neighbourhood of the coarse pick searched at full rate by
+# the coarse-to-fine mode, in samples of the decimated signal
+COARSE_RADIUS = 4
+
+
+def takanami(x, n0, n1, p=1, k=5, decimation=1, all_orders=False):
     """Event picking using Takanami AR algorithm.
 
     The Takanami algorithm estimates the arrival time of a seismic signal
@@ -54,12 +66,42 @@ def takanami(x, n0, n1, p=1, k=5):
             Default: 1.
         k: Order of the autoregressive model.
             Default: 5.
+        decimation: Decimation factor of the coarse-to-fine mode. If greater
+            than 1, the arrival time is first searched over a copy of 'x'
+            decimated by this factor, and then at full rate over a narrow
+            neighbourhood of the coarse result, which is much faster for
+            long intervals. AIC values in the neighbourhood are those of
+            the exhaustive search, so both picks are the same unless the
+            coarse search misses the minimum.
+            Default: 1, exhaustive search.
+        all_orders: If True, the arrival times and AIC values are given for
+            every order of the autoregressive model from 1 to 'k', all of
+            them computed from the same factorization as those of order 'k'.
+            Results of order 'k' are exact, but those of a lower order j are
+            approximate, as its models are fitted to the samples of the
+            models of order 'k', which leave out the first k - j samples of
+            each interval. Not supported in coarse-to-fine mode.
+            Default: False.
 
     Returns:
         n_pick: Arrival time.
             The value is given in samples from the beginning of 'x'.
-        total_aic: List of AIC values from 'n0' to 'n1'
+            If 'all_orders' is True, an array with the arrival time of each
+            order from 1 to 'k'.
+        total_aic: List of AIC values from 'n0' to 'n1'. In coarse-to-fine
+            mode, values out of the neighbourhood searched at full rate are
+            NaN. If 'all_orders' is True, a 2-D array with a row of AIC
+            values for each order from 1 to 'k'.
     """
+    if all_orders:
+        if decimation > 1:
+            raise ValueError("all_orders is not supported in coarse-to-fine mode")
+        return _takanami_all_orders(x, n0, n1, p, k)
+    if decimation > 1:
+        coarse_pick = _coarse_pick(np.asarray(x)[np.newaxis], n0, n1, k,
+                                   decimation)
+        if coarse_pick is not None:
+            return _fine_search(x, n0, n1, coarse_pick[0], p, k, decimation)
     l = (n1 - n0) / float(p)  # l + 1 models
     # Noise Model
     noise_aic = _takanami_aic(x, n0, l, k, p)
@@ -76,6 +118,136 @@ def takanami(x, n0, n1, p=1, k=5):
     return n_pick, total_aic
 
 
+def _takanami_all_orders(x, n0, n1, p, k):
+    """Applies Takanami AR algorithm with every order from 1 to k.
+
+    See 'takanami' function.
+    """
+    l = (n1 - n0) / float(p)  # l + 1 models
+    noise_aic = _takanami_order_aic(x, n0, l, k, p)
+    x = x[::-1]
+    new_n0 = len(x) - (n1 + 1) + 1
+    earthquake_aic = _takanami_order_aic(x, new_n0, l, k, p)[::-1]
+    total_aic = (noise_aic + earthquake_aic).T
+    n_pick = n0 + np.argmin(total_aic, axis=1) * p
+    return n_pick, total_aic
+
+
+def takanami_batch(X, n0, n1, p=1, k=5, decimation=1):
+    """Applies Takanami AR algorithm over several signals at once.
+
+    The AIC values of all the signals are computed together by using array
+    operations, so the cost of each signal is much lower than that of
+    calling 'takanami' function for each one of them.
+
+    Args:
+        X: Seismic signals of the same length, a 2-D numpy array with a
+            signal per row.
+        n0: Initial point of the interval [n0,n1] where the method assumes
+            the arrival time is in, for every signal.
+        n1: Final point of the interval [n0,n1] where the method assumes
+            the arrival time is in, for every signal.
+        p: Step of the autoregressive model.
+            Default: 1.
+        k: Order of the autoregressive model.
+            Default: 5.
+        decimation: Decimation factor of the coarse-to-fine mode, see
+            'takanami' function. The coarse search is done at once for all
+            the signals. Default: 1, exhaustive search.
+
+    Returns:
+        n_pick: Arrival time of each signal, numpy array type.
+            The values are given in samples from the beginning of 'X'.
+        total_aic: AIC values from 'n0' to 'n1' of each signal, a 2-D numpy
+            array with a row per signal.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if decimation > 1:
+        coarse_pick = _coarse_pick(X, n0, n1, k, decimation)
+        if coarse_pick is not None:
+            results = [_fine_search(x, n0, n1, c, p, k, decimation)
+                       for x, c in zip(X, coarse_pick)]
+            return (np.array([n_pick for n_pick, _ in results], dtype=int),
+                    np.array([aic for _, aic in results]).reshape(
+                        (len(X), int((n1 - n0) / float(p)) + 1)))
+    l = (n1 - n0) / float(p)  # l + 1 models
+    # Noise Model
+    noise_aic = _takanami_aic_batch(X, n0, l, k, p)
+    # Earthquake Model
+    new_n0 = X.shape[1] - n1
+    earthquake_aic = _takanami_aic_batch(X[:, ::-1], new_n0, l, k, p)[:, ::-1]
+    # Picking time estimation
+    total_aic = noise_aic + earthquake_aic
+    n_pick = n0 + np.argmin(total_aic, axis=1) * p
+    return n_pick, total_aic
+
+
+def _coarse_pick(X, n0, n1, k, q):
+    """Searches the arrival time over each row of X decimated by q.
+
+    Returns:
+        The arrival time of each row, in samples of X, or None if the
+        interval [n0,n1] is too short to be searched at the decimated rate.
+    """
+    n0, n1 = int(n0), int(n1)
+    Xd = np.array([resample.decimate(x, q) for x in X])
+    # Leave room for the first models to be fitted, as 'Takanami.run' does
+    n0d = max(2 * (k + 1), -(-n0 // q))
+    n1d = min(n1 // q, Xd.shape[1] - 2 * (k + 1))
+    if n1d <= n0d:
+        return None
+    n_pick, _ = takanami_batch(Xd, n0d, n1d, p=1, k=k)
+    return n_pick * q
+
+
+def _fine_search(x, n0, n1, coarse_pick, p, k, q):
+    """Searches the arrival time at full rate around a coarse pick.
+
+    The models of the search are initialized by a QR decomposition of all
+    the samples before the neighbourhood, so the AIC values are the same as
+    those of an exhaustive search over [n0,n1].
+    """
+    n0, n1 = int(n0), int(n1)
+    radius = COARSE_RADIUS * q
+    # Bounds of the neighbourhood on the grid of the exhaustive search
+    i_lo = max(0, (coarse_pick - radius - n0) // p)
+    i_hi = min(int((n1 - n0) / float(p)), -(-(coarse_pick + radius - n0) // p))
+    i_lo = min(i_lo, i_hi - 1)
+    n_pick, aic = takanami(x, n0 + i_lo * p, n0 + i_hi * p, p=p, k=k)
+    total_aic = np.empty(int((n1 - n0) / float(p)) + 1)
+    total_aic.fill(np.nan)
+    total_aic[i_lo:i_lo + len(aic)] = aic
+    return n_pick, total_aic
+
+
+def _takanami_aic_batch(X, n0, l, k=5, p=1):
+    """Computes AIC values of an autoregressive model over each row of X.
+
+    See '_takanami_aic'.
+
+    Returns:
+        aic_values: AIC values from n0 to n1, a 2-D numpy array with a row
+            per row of X.
+    """
+    if p <= 0:
+        raise ValueError("p should be a positive value")
+    if k <= 0:
+        raise ValueError("k should be a positive value")
+    if n0 <= k:
+        raise ValueError("n0 should be greater than k")
+    if l <= 0:
+        raise ValueError("l should be a positive value")
+    n_models = int(l) + 1
+    if X.shape[1] < n0 + (n_models - 1) * p:
+        raise ValueError("x is too short for the given interval")
+    if len(X) < BATCH_MIN_SWEEPS:
+        z = np.array([_factor_columns(x, n0, n_models, k, p) for x in X])
+    else:
+        z = _factor_columns_batch(X, n0, n_models, k, p)
+    z = z.reshape((len(X), n_models, k + 1))
+    return np.min(_order_aic(z, n0 + np.arange(n_models) * p - k), axis=-1)
+
+
 def _takanami_aic(x, n0, l, k=5, p=1):
     """Computes AIC values of an autoregressive model.
 
@@ -93,6 +265,20 @@ def _takanami_aic(x, n0, l, k=5, p=1):
     Returns:
         aic_values: List of AIC values from n0 to n1.
     """
+    return _takanami_order_aic(x, n0, l, k, p)[:, -1]
+
+
+def _takanami_order_aic(x, n0, l, k=5, p=1):
+    """Computes AIC values of autoregressive models of every order up to k.
+
+    See '_takanami_aic'. The AIC value of order j is the minimum AIC of
+    the models of order 0 to j, which are all given by the triangular
+    factor of the model of order k.
+
+    Returns:
+        aic_values: AIC values from n0 to n1, an array with a column per
+            order from 1 to k.
+    """
     if p <= 0:
         raise ValueError("p should be a positive value")
     if k <= 0:
@@ -101,45 +287,136 @@ def _takanami_aic(x, n0, l, k=5, p=1):
         raise ValueError("n0 should be greater than k")
     if l <= 0:
         raise ValueError("l should be a positive value")
-    aic_0_l = np.zeros(l + 1)
-    sigma2 = np.zeros(k + 1)
-    aic_i = np.zeros(k + 1)
-    # Calculate AIC value for n0
-    x_n0 = x[:n0]
+    n_models = int(l) + 1
+    if len(x) < n0 + (n_models - 1) * p:
+        raise ValueError("x is too short for the given interval")
+    z = _factor_columns(np.asarray(x, dtype=np.float64), n0, n_models, k, p)
+    aic = _order_aic(z, n0 + np.arange(n_models) * p - k)
+    return np.minimum.accumulate(aic, axis=-1)[:, 1:]
+
+
+def _factor_columns(x, n0, n_models, k, p):
+    """Fits autoregressive models of order k to growing intervals of x.
+
+    The first model is fitted to x[:n0] and each next model adds 'p' more
+    samples of x. The upper triangular factor of the first model is
+    computed by a QR decomposition. Then, the factor is updated to add
+    each new sample by k + 1 Givens rotations, which are cheap enough to
+    be computed one by one on scalars.
+
+    Returns:
+        The last column of the triangular factor of each model, an array
+        of shape (n_models, k + 1). It holds the residuals of the models of
+        every order up to k, see '_order_aic'.
+    """
     # Initialize X0 matrix
     X0 = np.zeros((n0 - k, k + 1))
     for i in xrange(k):
-        X0[:, i] = x_n0[k - i - 1:-1 - i]
-    X0[:, k] = x_n0[k:]
+        X0[:, i] = x[k - i - 1:n0 - 1 - i]
+    X0[:, k] = x[k:n0]
     # Householder transformation by QR decomposition
-    R0 = np.linalg.qr(X0, mode='r')
-    R0 = R0[:k + 1, :k + 1]
-    # Calculate variances and AIC...
-    c1 = 1. / (n0 - k)
-    c2 = n0 - k
-    for j in xrange(k + 1):
-        sigma2[j] = c1 * np.sum(R0[j:k + 1, k] ** 2)
-        aic_i[j] = c2 * np.log(sigma2[j]) + 2 * (j + 1)
-    aic_0_l[0] = np.min(aic_i)
-    # Calculate AIC from n_1 to n_l
-    R = np.zeros((k + 1 + p, k + 1))
-    S = R0
-    for i in xrange(1, int(l + 1)):
-        aug_data = x[(n0 + i * p - k - 1):(n0 + i * p)]  # Augmented Data
-        R[:k + 1, :k + 1] = S
-        R[k + 1:k + 1 + p, :k] = aug_data[-2::-1]
-        R[k + 1:k + 1 + p, k] = aug_data[-1]
-        # QR decomposition
-        S = np.linalg.qr(R, mode='r')
-        S = S[:k + 1, :k + 1]
-        # Calculate variances and AIC...
-        c1 = 1. / (n0 + i * p - k)
-        c2 = n0 + i * p - k
-        for j in xrange(k + 1):
-            sigma2[j] = c1 * np.sum(S[j:k + 1, k] ** 2)
-            aic_i[j] = c2 * np.log(sigma2[j]) + 2 * (j + 1)
-        aic_0_l[i] = np.min(aic_i)
-    return aic_0_l
+    S = np.zeros((k + 1, k + 1))
+    R0 = np.linalg.qr(X0, mode='r')[:k + 1]
+    S[:len(R0)] = R0
+    z = np.zeros((n_models, k + 1))
+    z[0] = S[:, k]
+    S = S.tolist()
+    x = x.tolist()
+    for i in xrange(1, n_models):
+        for t in xrange(n0 + (i - 1) * p, n0 + i * p):
+            # Augmented data: the k previous samples and the new one
+            _givens_update(S, x[t - 1:t - k - 1:-1] + [x[t]])
+        z[i] = [row[k] for row in S]
+    return z
+
+
+def _factor_columns_batch(X, n0, n_models, k, p):
+    """Fits autoregressive models of order k to growing intervals of each
+    row of X at once.
+
+    See '_factor_columns'. The factors of all the rows are built from
+    scratch by Givens rotations, so every step is made of array operations
+    over all the rows.
+
+    Returns:
+        The last column of the triangular factor of each model of each row,
+        an array of shape (len(X), n_models, k + 1).
+    """
+    S = np.zeros((len(X), k + 1, k + 1))
+    z = np.zeros((len(X), n_models, k + 1))
+    # Augmented data of sample t: the k previous samples and the sample t
+    lags = np.r_[np.arange(1, k + 1), 0]
+    for t in xrange(k, n0):
+        _givens_update_batch(S, X[:, t - lags])
+    z[:, 0] = S[:, :, k]
+    for i in xrange(1, n_models):
+        for t in xrange(n0 + (i - 1) * p, n0 + i * p):
+            _givens_update_batch(S, X[:, t - lags])
+        z[:, i] = S[:, :, k]
+    return z
+
+
+def _givens_update_batch(S, r):
+    """Updates a set of upper triangular factors to add a new row to each
+    of their matrices.
+
+    Args:
+        S: Upper triangular factors, an array of shape (m, n, n). It is
+            updated in place.
+        r: New rows, an array of shape (m, n). Its contents are overwritten.
+    """
+    for j in xrange(r.shape[1]):
+        a = S[:, j, j]
+        b = r[:, j]
+        h = np.hypot(a, b)
+        zero = h == 0.
+        h[zero] = 1.
+        c = np.where(zero, 1., a / h)[:, np.newaxis]
+        s = np.where(zero, 0., b / h)[:, np.newaxis]
+        Sj = S[:, j, j:].copy()
+        rj = r[:, j:]
+        S[:, j, j:] = c * Sj + s * rj
+        rj *= c
+        rj -= s * Sj
+
+
+def _givens_update(S, r):
+    """Updates an upper triangular factor to add a new row to its matrix.
+
+    Args:
+        S: Upper triangular factor, a list of rows. It is updated in place.
+        r: New row, a list. Its contents are overwritten.
+    """
+    n = len(r)
+    for j in xrange(n):
+        b = r[j]
+        if b == 0.:
+            continue
+        Sj = S[j]
+        a = Sj[j]
+        h = math.hypot(a, b)
+        c, s = a / h, b / h
+        for i in xrange(j, n):
+            u, v = Sj[i], r[i]
+            Sj[i] = c * u + s * v
+            r[i] = c * v - s * u
+
+
+def _order_aic(z, n):
+    """Computes AIC values of autoregressive models of every order.
+
+    Args:
+        z: Last column of the triangular factors of the models of order k,
+            an array of shape (..., k + 1).
+        n: Number of samples fitted by each model, an array of shape (...).
+
+    Returns:
+        AIC values of the models of order 0 to k, an array of shape
+        (..., k + 1).
+    """
+    n = np.asarray(n, dtype=np.float64)[..., np.newaxis]
+    sigma2 = np.cumsum(z[..., ::-1] ** 2, axis=-1)[..., ::-1] / n
+    return n * np.log(sigma2) + 2 * np.arange(1, z.shape[-1] + 1)
 
 
 class Takanami(object):
@@ -151,12 +428,15 @@ class Takanami(object):
             Default: 1.
         k: Order of the autoregressive model.
             Default: 5.
+        decimation: Decimation factor of the coarse-to-fine mode, see
+            'takanami' function. Default: 1, exhaustive search.
     """
 
-    def __init__(self, p=1, k=5):
+    def __init__(self, p=1, k=5, decimation=1):
         super(Takanami, self).__init__()
         self.p = p
         self.k = k
+        self.decimation = decimation
 
     def run(self, x, fs, t_start=0.0, t_end=np.inf):
         """Executes Takanami AR algorithm over a given array of data.
@@ -184,6 +464,47 @@ class Takanami(object):
         i_to = int(min(len(x), (t_end * fs) + 1))
         n0 = (self.k + 1) * 2
         n1 = (i_to - i_from) - n0
-        pt, aic = takanami(x[i_from:i_to], n0, n1, p=self.p, k=self.k)
+        pt, aic = takanami(x[i_from:i_to], n0, n1, p=self.p, k=self.k,
+                           decimation=self.decimation)
         return i_from + pt, aic, i_from + n0
 
+    def run_batch(self, x, fs, t_start, t_end):
+        """Executes Takanami AR algorithm over several intervals of a given
+        array of data at once.
+
+        Intervals of the same length are processed together by using
+        'takanami_batch' function, so refining a large number of events is
+        much faster than calling 'run' for each one of them.
+
+        Args:
+            x: Seismic data, numpy array type.
+            fs: Sample rate in Hz.
+            t_start: Start time points of the intervals where the arrival
+                times are supposed to be, a list or numpy array.
+            t_end: End time points of the intervals where the arrival
+                times are supposed to be, a list or numpy array.
+
+        Return:
+            et: Arrival times, given in samples from the beginning of 'x'.
+            aic: List of AIC values of each interval.
+            n0: Start time points of each element of 'aic'.
+                The values are given in samples from the beginning of 'x'.
+        """
+        t_start = np.asarray(t_start, dtype=np.float64)
+        t_end = np.asarray(t_end, dtype=np.float64)
+        i_from = np.maximum(0, t_start * fs).astype(int)
+        i_to = np.minimum(len(x), (t_end * fs) + 1).astype(int)
+        n0 = (self.k + 1) * 2
+        et = np.zeros(len(t_start), dtype=int)
+        aic = [None] * len(t_start)
+        for length in np.unique(i_to - i_from):
+            idx = np.flatnonzero(i_to - i_from == length)
+            X = np.array([x[i_from[i]:i_to[i]] for i in idx])
+            pt, group_aic = takanami_batch(X, n0, length - n0, p=self.p,
+                                           k=self.k,
+                                           decimation=self.decimation)
+            et[idx] = i_from[idx] + pt
+            for i, i_aic in zip(idx, group_aic):
+                aic[i] = i_aic
+        return et, aic, i_from + n0
+
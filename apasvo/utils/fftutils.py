@@ -0,0 +1,150 @@
+# encoding: utf-8
+'''
+@author:     Jose Emilio Romero Lopez
+
+@copyright:  Copyright 2013-2014, Jose Emilio Romero Lopez.
+
+@license:    GPL
+
+@contact:    jemromerol@gmail.com
+
+  This file is part of APASVO.
+
+  This program is free software: you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation, either version 3 of the License, or
+  (at your option) any later version.
+
+  This program is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import numpy as np
+from scipy import signal
+
+
+# FIR filters with at least this number of taps are applied by FFT
+FFT_MIN_TAPS = 128
+# Ratio between the FFT length and the number of taps of the filter
+# on overlap-add filtering
+OVERLAP_ADD_RATIO = 8
+
+
+def next_fast_len(n):
+    """Finds the smallest FFT length not lower than a given value.
+
+    FFT routines are fastest for lengths whose only prime factors are 2, 3
+    and 5, while lengths with large prime factors may be orders of magnitude
+    slower. Padding a signal to such a length before transforming it
+    avoids the slow cases.
+
+    Args:
+        n: Minimum length, a positive integer.
+
+    Returns:
+        out: Smallest 5-smooth integer that is greater than or equal to 'n'.
+    """
+    n = int(n)
+    if n <= 6:
+        return max(n, 1)
+    # Powers of two are already optimal
+    if not n & (n - 1):
+        return n
+    best = 1 << (n - 1).bit_length()
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            # Smallest power of two that makes p35 reach n
+            quotient = -(-n // p35)
+            p2 = 1 << (quotient - 1).bit_length()
+            candidate = p2 * p35
+            if candidate == n:
+                return n
+            best = min(best, candidate)
+            p35 *= 3
+            if p35 == n:
+                return n
+        p5 *= 5
+        if p5 == n:
+            return n
+    return best
+
+
+def fir_filter(b, x, zi=None, method='auto'):
+    """Filters data along its last axis with a FIR filter.
+
+    Gives the same output as 'scipy.signal.lfilter(b, 1, x, zi=zi)', up to
+    rounding errors, by using either 'lfilter', whose cost is proportional
+    to the number of taps, or overlap-add FFT convolution, whose cost
+    barely depends on it.
+
+    Args:
+        b: Coefficients of the filter.
+        x: Input data, numpy array type.
+        zi: Initial state of the filter, as given by 'lfilter', that is,
+            the output of the previous data that spans over the first
+            len(b) - 1 samples of 'x'. Default value is None, meaning the
+            filter starts from rest.
+        method: 'direct' to use 'lfilter', 'fft' to use overlap-add FFT
+            convolution or 'auto' to use FFT when the filter has
+            'FFT_MIN_TAPS' taps or more. Default: 'auto'.
+
+    Returns:
+        y: Output data.
+        zf: Final state of the filter. Only returned if 'zi' is given.
+    """
+    if method not in ('auto', 'direct', 'fft'):
+        raise ValueError("method must be 'auto', 'direct' or 'fft'")
+    b = np.asarray(b, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    M = len(b)
+    if method == 'auto':
+        method = 'fft' if M >= FFT_MIN_TAPS else 'direct'
+    if M == 1:
+        y, zf = b[0] * x, zi
+    elif method == 'direct':
+        if zi is None:
+            return signal.lfilter(b, 1, x, axis=-1)
+        y, zf = signal.lfilter(b, 1, x, axis=-1, zi=zi)
+    else:
+        y = _overlap_add(b, x)
+        if zi is not None:
+            y[..., :M - 1] += zi
+        y, zf = y[..., :x.shape[-1]], y[..., x.shape[-1]:]
+    return y if zi is None else (y, zf)
+
+
+def _overlap_add(b, x):
+    """Computes the full convolution of 'b' and each row of 'x' by FFT.
+
+    Rows are split into blocks that are convolved at once with FFTs of
+    'OVERLAP_ADD_RATIO' times the length of 'b', and the tail of each
+    block is added to the next one.
+
+    Returns:
+        out: An array of len(b) - 1 samples more than 'x' along its last
+            axis.
+    """
+    M, L = len(b), x.shape[-1]
+    shape = x.shape[:-1]
+    nfft = next_fast_len(max(OVERLAP_ADD_RATIO * M, 64))
+    block = nfft - M + 1
+    n_blocks = max(1, -(-L // block))
+    blocks = np.zeros(shape + (n_blocks, block))
+    blocks.reshape(shape + (n_blocks * block,))[..., :L] = x
+    y_blocks = np.fft.irfft(np.fft.rfft(blocks, nfft) * np.fft.rfft(b, nfft),
+                            nfft)
+    # The tail of each block is shorter than a block, so it only
+    # overlaps the next one
+    y = np.zeros(shape + ((n_blocks + 1) * block,))
+    y[..., :n_blocks * block] = y_blocks[..., :block].reshape(
+        shape + (n_blocks * block,))
+    y[..., block:].reshape(shape + (n_blocks, block))[..., :M - 1] += \
+        y_blocks[..., block:]
+    return y[..., :L + M - 1]
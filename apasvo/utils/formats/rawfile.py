@@ -66,6 +66,9 @@ class RawFile(object):
     def write(self, array):
         raise NotImplementedError
 
+    def write_in_blocks(self, blocks):
+        raise NotImplementedError
+
 
 class BinFile(RawFile):
     """A binary file.
@@ -117,6 +120,16 @@ class BinFile(RawFile):
             return array.astype(self.dtype).tofile(self.filename)
         return array.tofile(self.filename)
 
+    def write_in_blocks(self, blocks, **kwargs):
+        """Stores a sequence of arrays one after another into the binary file.
+
+        Blocks are written as they are taken from 'blocks', which can be a
+        generator, so the whole data is never held in memory.
+        """
+        with open(self.filename, 'wb') as f:
+            for block in blocks:
+                np.asarray(block).astype(self.dtype, copy=False).tofile(f)
+
 
 class TextFile(RawFile):
     """A plain text file containing numeric data.
@@ -190,6 +203,22 @@ class TextFile(RawFile):
         """
         return np.savetxt(self.filename, array, **kwargs)
 
+    def write_in_blocks(self, blocks, **kwargs):
+        """Stores a sequence of arrays one after another into the text file.
+
+        Blocks are written as they are taken from 'blocks', which can be a
+        generator, so the whole data is never held in memory.
+        Accepts the same arguments as 'write', but 'header' is written only
+        before the first block and 'footer' only after the last one.
+        """
+        header = kwargs.pop('header', '')
+        footer = kwargs.pop('footer', '')
+        with open(self.filename, 'w') as f:
+            for i, block in enumerate(blocks):
+                np.savetxt(f, block, header=header if i == 0 else '', **kwargs)
+            if footer:
+                np.savetxt(f, [], footer=footer, **kwargs)
+
 
 def get_file_handler(filename, fmt='', dtype='float64', byteorder='native', **kwargs):
     """Gets a handler for a binary or text file.
@@ -0,0 +1,106 @@
+# encoding: utf-8
+'''
+@author:     Jose Emilio Romero Lopez
+
+@copyright:  Copyright 2013-2014, Jose Emilio Romero Lopez.
+
+@license:    GPL
+
+@contact:    jemromerol@gmail.com
+
+  This file is part of APASVO.
+
+  This program is free software: you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation, either version 3 of the License, or
+  (at your option) any later version.
+
+  This program is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import numpy as np
+from scipy import signal
+
+
+# Portion of the Nyquist frequency of the decimated signal that is kept
+# free of aliasing by the anti-aliasing filter
+PASSBAND = 0.8
+# Length of the anti-aliasing filter, in samples of the decimated signal,
+# on each side of its center
+FILTER_HALF_LENGTH = 8
+
+
+def decimation_factor(fs, f_max):
+    """Finds the largest decimation factor that keeps a frequency band.
+
+    Args:
+        fs: Sampling rate in Hz.
+        f_max: Highest frequency of interest, in Hz.
+
+    Returns:
+        q: The largest integer so that 'f_max' is within the passband of
+            the anti-aliasing filter applied by 'decimate' at rate fs / q.
+            1 if the signal cannot be decimated.
+    """
+    if fs <= 0:
+        raise ValueError("fs must be a positive value")
+    if f_max <= 0:
+        raise ValueError("f_max must be a positive value")
+    return max(1, int(np.floor(PASSBAND * fs / (2. * f_max))))
+
+
+def decimate(x, q):
+    """Decimates a signal by an integer factor.
+
+    The signal is low-pass filtered by a linear phase FIR filter with
+    cut-off frequency at the Nyquist frequency of the decimated signal.
+    The filter is centered, so the decimated signal is not delayed, and
+    applied in polyphase form, so only the kept samples are computed.
+
+    Args:
+        x: A data vector.
+        q: Decimation factor, a positive integer.
+
+    Returns:
+        out: Decimated signal, numpy array of length ceil(len(x) / q),
+            where out[k] is aligned with x[k * q].
+    """
+    q = int(q)
+    if q < 1:
+        raise ValueError("q must be a positive integer")
+    x = np.asarray(x, dtype=float)
+    if q == 1:
+        return x.copy()
+    n_out = -(-len(x) // q)
+    h = signal.firwin(2 * FILTER_HALF_LENGTH * q + 1, 1. / q)
+    # out[k] = sum_j h[j] * x[(k + FILTER_HALF_LENGTH) * q - j], splitting
+    # j = m * q + r each phase r is a convolution at the decimated rate
+    x_padded = np.zeros(q * (n_out + 1))
+    x_padded[q:q + len(x)] = x
+    out = np.zeros(n_out)
+    for r in xrange(q):
+        # x_r[i] = x[i * q - r]
+        y = np.convolve(x_padded[q - r::q], h[r::q])
+        out += y[FILTER_HALF_LENGTH:FILTER_HALF_LENGTH + n_out]
+    return out
+
+
+def interpolate(y, q, n):
+    """Linear interpolation of a decimated signal at the original rate.
+
+    Args:
+        y: A signal decimated by 'decimate'.
+        q: Decimation factor.
+        n: Length of the output.
+
+    Returns:
+        out: Signal at the original rate, numpy array of length 'n'.
+            Samples beyond the end of 'y' take its last value.
+    """
+    return np.interp(np.arange(n) / float(q), np.arange(len(y)), y)
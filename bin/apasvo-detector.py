@@ -93,6 +93,9 @@ def print_settings(**kwargs):
     sys.stdout.write("%30s: %s\n" % ("Algorithm used", kwargs.get('method', '').upper()))
     sys.stdout.write("%30s: %s\n" % ("Takanami", kwargs.get('takanami')))
     sys.stdout.write("%30s: %s\n" % ("Takanami margin", kwargs.get('takanami_margin')))
+    if kwargs.get('takanami'):
+        sys.stdout.write("%30s: %s\n" % ("Refining method", kwargs.get('refine_method', '').upper()))
+    sys.stdout.write("%30s: %s\n" % ("Decimate", kwargs.get('decimate')))
     if kwargs.get('method') == 'ampa':
         sys.stdout.write("\n*** AMPA settings ***\n")
         sys.stdout.write("%30s: %s\n" % ("Window length(s)", kwargs.get('window')))
@@ -110,6 +113,8 @@ def print_settings(**kwargs):
         sys.stdout.write("\n*** STA-LTA settings ***\n")
         sys.stdout.write("%30s: %s\n" % ("STA window length(s)", kwargs.get('sta_length')))
         sys.stdout.write("%30s: %s\n" % ("LTA window length(s)", kwargs.get('lta_length')))
+        if kwargs.get('decimate'):
+            sys.stdout.write("%30s: %s\n" % ("Highest frequency(Hz)", kwargs.get('f_max')))
     sys.stdout.write("\n")
     sys.stdout.flush()
 
@@ -142,7 +147,7 @@ def analysis_single_file_task(filename, **kwargs):
     basename, _ = os.path.splitext(os.path.basename(filename))
     output_path = kwargs.get('destination_path', os.getcwd())
     stream_suffix = '_'.join([suffix for tr in stream.traces
-                             for suffix in tr.getId().split('.')
+                             for suffix in tr.get_id().split('.')
                              if suffix != ''])
     output_filename = "{}_{}{}".format(basename, stream_suffix, extension)
     stream.export_picks(os.path.join(output_path, output_filename), format=ouput_format, debug=debug)
@@ -391,6 +396,16 @@ def main(argv=None):
                             help='''
     If the input files are in binary format this will be the byte-order
     of the selected datatype. Default choice is hardware native.
+        ''')
+        parser.add_argument("--decimate",
+                            action='store_true',
+                            default=False,
+                            help='''
+    Decimate the signal before applying the detection/picking algorithm,
+    by the largest factor that keeps the analysed frequencies free of
+    aliasing. For AMPA these are up to the end frequency of the filter
+    bank plus its bandwidth, for STA-LTA up to --sta-lta-f-max.
+    Picks are given at the original sample rate.
         ''')
         # STA-LTA arguments
         sta_lta_options = parser.add_argument_group("STA-LTA settings")
@@ -411,6 +426,14 @@ def main(argv=None):
                                      help='''
     Length of LTA window (in seconds) when using STA-LTA method.
     Default value is 100 seconds.
+        ''')
+        sta_lta_options.add_argument("--sta-lta-f-max",
+                                     type=parse.positive_float,
+                                     dest='f_max',
+                                     metavar='<arg>',
+                                     help='''
+    Highest frequency of interest (in Hz) when using STA-LTA method.
+    Required by --decimate.
         ''')
         # AMPA arguments
         ampa_options = parser.add_argument_group("AMPA settings")
@@ -547,9 +570,21 @@ def main(argv=None):
     [t - w, t + w].
     Default: 5.0 seconds.
         ''')
+        takanami_options.add_argument("--refine-method",
+                                 choices=['takanami', 'maeda'],
+                                 dest='refine_method',
+                                 default='takanami',
+                                 help='''
+    Method used to refine results when --takanami is given. Possible values
+    are: 'takanami', Takanami AR method, and 'maeda', a variance-based AIC
+    picker, which is much faster but less accurate.
+    Default: 'takanami'.
+        ''')
 
         # Parse the args and call whatever function was selected
         args, _ = parser.parse_known_args()
+        if args.decimate and args.method == 'stalta' and args.f_max is None:
+            parser.error("--decimate requires --sta-lta-f-max with STA-LTA method")
 
     except Exception, e:
         indent = len(program_name) * " "
@@ -28,8 +28,10 @@ A tool that generates synthetic seismic signals.
 '''
 
 import argparse
+import csv
 import os
 import sys
+import numpy as np
 
 from apasvo._version import __version__
 from apasvo.utils import clt, parse, futils
@@ -37,6 +39,10 @@ from apasvo.utils.formats import rawfile
 from apasvo.picking import eqgenerator
 
 
+# Maximum number of signals synthesized at once
+BATCH_SIZE = 100
+
+
 def print_settings(args):
     """Prints settings to stdout.
 
@@ -52,9 +58,15 @@ def print_settings(args):
                                      args.t_event))
     sys.stdout.write("%30s: %s\n" % ("Noise power(dB)",
                                      args.P_noise_db))
+    if args.seed is not None:
+        sys.stdout.write("%30s: %s\n" % ("Random seed",
+                                         args.seed))
     if not args.FILEIN:
         sys.stdout.write("%30s: %s\n" % ("Event power(dB)",
                                          args.gen_event_power))
+        if args.event_interval is not None:
+            sys.stdout.write("%30s: %s\n" % ("Average event interval(s)",
+                                             args.event_interval))
         sys.stdout.write("\nFilter bank settings:\n")
         sys.stdout.write("%30s: %s\n" % ("Start frequency(Hz)",
                                        args.f_low))
@@ -77,17 +89,54 @@ def print_settings(args):
     sys.stdout.flush()
 
 
+def write_signal(filename, blocks, output_format, datatype, byteorder, fs):
+    """Saves the consecutive blocks of a signal to file.
+
+    Args:
+        filename: Output file name.
+        blocks: A list or generator of numpy arrays.
+        output_format: Output file format. Possible values are 'binary',
+            'text' or 'mseed'.
+        datatype: Data-type of the output data.
+        byteorder: Byte-order of the output data. It has no effect on
+            'mseed' format.
+        fs: Sample rate in Hz.
+    """
+    if output_format == 'mseed':
+        # Lazy obspy import
+        import obspy
+        with open(filename, 'wb') as f:
+            n = 0
+            for block in blocks:
+                trace = obspy.Trace(np.asarray(block, dtype=datatype),
+                                    header={'sampling_rate': fs,
+                                            'starttime': obspy.UTCDateTime(n / float(fs))})
+                trace.write(f, format='MSEED')
+                n += len(block)
+    elif output_format == 'text':
+        fout_handler = rawfile.TextFile(filename, dtype=datatype,
+                                        byteorder=byteorder)
+        fout_handler.write_in_blocks(blocks, header="Sample rate: %g Hz." % fs)
+    else:
+        fout_handler = rawfile.BinFile(filename, dtype=datatype,
+                                       byteorder=byteorder)
+        fout_handler.write_in_blocks(blocks)
+
+
 def generate(FILEIN, length, t_event, output, gen_event_power=5.0, n_events=1,
              gen_noise_coefficients=False, output_format='binary',
-             datatype='float64', byteorder='native', **kwargs):
+             datatype='float64', byteorder='native', seed=None,
+             event_interval=None, **kwargs):
     """Generates synthetic earthquake signals with background noise and saves
     them to file.
 
     The function accepts a list of command-line arguments and renders synthetic
-    seismic data in two ways: If a list of input files containing seismic data
+    seismic data in three ways: If a list of input files containing seismic data
     is provided, the function generates a new output signal for each one of
     the files by adding background noise. If no input file is provided,
-    the function generates a list of synthetic seismic signals.
+    the function generates a list of synthetic seismic signals, or a single
+    continuous signal containing several earthquakes if 'event_interval'
+    is given.
 
     Args:
         FILEIN: A list of binary or text file objects storing seismic data.
@@ -116,8 +165,8 @@ def generate(FILEIN, length, t_event, output, gen_event_power=5.0, n_events=1,
             noise.
             Default value is False, meaning unfiltered white noise is used
             to model the background noise.
-        output_format: Output file format. Possible values are 'binary' or
-            'text'. Default: 'binary'.
+        output_format: Output file format. Possible values are 'binary',
+            'text' or 'mseed'. Default: 'binary'.
         datatype: Data-type of generated data. Default value is 'float64'.
             If FILEIN is not None, this parameter is also the datatype of
             input data.
@@ -126,8 +175,21 @@ def generate(FILEIN, length, t_event, output, gen_event_power=5.0, n_events=1,
             If FILEIN is not None, this parameter is also the format of
             input data.
             Default value is 'native'.
+        seed: Seed of the random numbers, so that the same signals can be
+            generated again. Default value is None, meaning a different
+            output is generated on each run.
+        event_interval: Average time in seconds between earthquakes of a
+            continuous signal. If not None, a single signal of 'length'
+            seconds is generated chunk by chunk, with earthquakes at random
+            times and magnitudes. The power of an earthquake of magnitude 2
+            is 'gen_event_power', and it grows by 20 dB per unit of
+            magnitude. Arrival times are saved to a CSV file named as the
+            output file with '.picks.csv' extension.
+            If FILEIN is not None, this parameter has no effect.
+            Default: None.
     """
     fs = kwargs.get('fs', 50.0)
+    random_state = np.random.RandomState(seed)
     # Configure generator
     clt.print_msg("Configuring generator... ")
     generator = eqgenerator.EarthquakeGenerator(**kwargs)
@@ -166,37 +228,53 @@ def generate(FILEIN, length, t_event, output, gen_event_power=5.0, n_events=1,
             clt.print_msg("Generating artificial signal in %s... " %
                              filename_out)
             # Add background noise to signal
-            eq = generator.generate_noise(signal)
+            eq = generator.generate_noise(signal, random_state)
             # Save outputs to file
-            if output_format == 'text':
-                fout_handler = rawfile.TextFile(filename_out, dtype=datatype,
-                                            byteorder=byteorder)
-            else:
-                fout_handler = rawfile.BinFile(filename_out, dtype=datatype,
-                                              byteorder=byteorder)
-            fout_handler.write(eq, header="Sample rate: %g Hz." % fs)
+            write_signal(filename_out, [eq], output_format, datatype,
+                         byteorder, fs)
             clt.print_msg("Done\n")
+    # If an average interval between events is provided,
+    # generate a continuous signal containing several earthquakes.
+    elif event_interval is not None:
+        event_t, event_m = generator.generate_events(event_interval, length,
+                                                     random_state=random_state)
+        event_p = gen_event_power + 20. * (event_m - 2.)
+        clt.print_msg("Generating artificial signal in %s... " % filename_out)
+        chunks = generator.generate_stream(length, event_t, event_p,
+                                           random_state=random_state)
+        write_signal(filename_out, chunks, output_format, datatype,
+                     byteorder, fs)
+        clt.print_msg("Done\n")
+        # Save ground-truth picks to file
+        picks_filename = "%s.picks.csv" % basename
+        clt.print_msg("Saving %d arrival times to %s... " %
+                      (len(event_t), picks_filename))
+        with open(picks_filename, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time', 'sample', 'magnitude', 'power'])
+            for t, m, p in zip(event_t, event_m, event_p):
+                writer.writerow([t, int(t * fs), m, p])
+        clt.print_msg("Done\n")
     # If no input file is provided,
     # generate a list of synthetic seismic signals.
     else:
-        for i in xrange(n_events):
-            # Generate output filename
-            if n_events > 1:
-                filename_out = "%s%02.0i%s" % (basename, i, ext)
-            clt.print_msg("Generating artificial signal in %s... " %
-                             filename_out)
-            # Generate a synthetic signal
-            eq = generator.generate_earthquake(length, t_event,
-                                               gen_event_power)
-            # Save outputs to file
-            if output_format == 'text':
-                fout_handler = rawfile.TextFile(filename_out, dtype=datatype,
-                                                byteorder=byteorder)
-            else:
-                fout_handler = rawfile.BinFile(filename_out, dtype=datatype,
-                                byteorder=byteorder)
-            fout_handler.write(eq, header="Sample rate: %g Hz." % fs)
-            clt.print_msg("Done\n")
+        for start in xrange(0, n_events, BATCH_SIZE):
+            # Generate a batch of synthetic signals
+            eqs = generator.generate_earthquakes(min(BATCH_SIZE,
+                                                     n_events - start),
+                                                 length, t_event,
+                                                 gen_event_power,
+                                                 random_state)
+            for i, eq in enumerate(eqs, start):
+                # Generate output filename
+                if n_events > 1:
+                    filename_out = "%s%02.0i%s" % (basename, i, ext)
+                clt.print_msg("Generating artificial signal in %s... " %
+                                 filename_out)
+                # Save outputs to file
+                write_signal(filename_out, [eq], output_format, datatype,
+                             byteorder, fs)
+                clt.print_msg("Done\n")
 
 
 def main(argv=None):
@@ -478,9 +556,32 @@ def main(argv=None):
     different bands on multi-band earthquake synthesis.
     If input signal is provided, this parameter has no effect.
     Default: 0.1.
+        ''')
+        parser.add_argument("--event-interval",
+                            type=parse.positive_float,
+                            dest='event_interval',
+                            metavar='<arg>',
+                            help='''
+    Average time in seconds between earthquakes. If specified, generates a
+    single continuous signal of the given length, written chunk by chunk,
+    with earthquakes at Poisson distributed times and magnitudes given by
+    Gutenberg-Richter's law. An earthquake of magnitude 2 has the given
+    earthquake power, which grows by 20 dB per unit of magnitude.
+    Arrival times are saved to a CSV file named as the output file with
+    '.picks.csv' extension.
+    If input signal is provided, this parameter has no effect.
+        ''')
+        parser.add_argument("--seed",
+                            type=int,
+                            metavar='<arg>',
+                            help='''
+    Seed of the random number generator. Runs with the same seed and
+    settings generate the same signals on the same version of the
+    application. If not specified, a different output is generated on
+    each run.
         ''')
         parser.add_argument("--output-format",
-                            choices=["binary", "text"],
+                            choices=["binary", "text", "mseed"],
                             default="binary",
                             help='''
     Output file format. Default value is 'binary'.
@@ -0,0 +1,538 @@
+#!/usr/bin/python2.7
+#encoding utf-8
+
+'''
+@author:     Jose Emilio Romero Lopez
+
+@copyright:  Copyright 2013-2014, Jose Emilio Romero Lopez.
+
+@license:    GPL
+
+@contact:    jemromerol@gmail.com
+
+  This file is part of APASVO.
+
+  This program is free software: you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation, either version 3 of the License, or
+  (at your option) any later version.
+
+  This program is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+"""Benchmarks of the picking algorithms.
+
+Run them from the root folder of the project, e.g.:
+
+    python -m tests.benchmarks
+    python -m tests.benchmarks ampa_batched_bands
+"""
+
+import sys
+import subprocess
+import timeit
+import numpy as np
+import scipy.io as sio
+from scipy import signal
+
+from apasvo.picking import ampa
+from apasvo.picking import stalta
+from apasvo.picking import takanami
+from apasvo.picking import maeda
+from apasvo.picking import findpeaks
+from apasvo.picking import eqgenerator
+from apasvo.utils import clt
+from apasvo.utils import fftutils
+
+
+def best_time(func, repeat=5):
+    """Returns the best wall-clock time, in seconds, of several calls to 'func'."""
+    times = []
+    for _ in xrange(repeat):
+        t0 = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - t0)
+    return min(times)
+
+
+def bench_ampa_batched_bands():
+    """AMPA multi-band analysis: band loop vs. batched filtering."""
+    fs = 100.0
+    lengths, loop_times, batched_times, errors = [], [], [], []
+    for length in (100.0, 600.0, 3600.0):
+        x = np.random.randn(int(length * fs))
+        bank = ampa.default_filter_bank_cache.get(fs, 3., 1., 2., 12., len(x))
+        _, cf_loop = ampa.ampa(x, fs)
+        _, cf_batched = ampa.ampa(x, fs, batched=True)
+        lengths.append(length)
+        loop_times.append(best_time(lambda: ampa._multiband_analysis(x, bank, 90.)))
+        batched_times.append(best_time(lambda: ampa._multiband_analysis(x, bank, 90.,
+                                                                        batched=True)))
+        errors.append(np.max(np.abs(cf_loop - cf_batched)))
+    return clt.Table(clt.Column('Length(s)', lengths),
+                     clt.Column('Loop(s)', loop_times),
+                     clt.Column('Batched(s)', batched_times),
+                     clt.Column('Speedup', np.divide(loop_times, batched_times)),
+                     clt.Column('CF max. abs. error', errors))
+
+
+def _sorted_prctile(x, p):
+    """Percentile computed by a full sort, as 'ampa.prctile' used to do."""
+    sorted_x = np.sort(x)
+    q = np.hstack([0, 100 * np.linspace(0.5, len(x) - 0.5, len(x)) / len(x), 100])
+    return np.interp(p, q, np.hstack([sorted_x[0], sorted_x, sorted_x[-1]]))
+
+
+def bench_prctile():
+    """Noise threshold percentile: full sort vs. selection vs. sketch."""
+    x = sio.loadmat('tests/signal_fs_50_t0_100.mat')['X'][:, 0]
+    q = sio.loadmat('tests/test_prctile.mat')['q'][0, :]
+    big_x = np.abs(np.random.randn(360000))  # An hour long envelope at 100 Hz
+
+    def sketch(data, p, accuracy):
+        s = ampa.PercentileSketch(accuracy)
+        s.update(data)
+        return s.percentile(p)
+
+    methods = [('sort', 0., _sorted_prctile),
+               ('selection', 0., ampa.prctile)]
+    for accuracy in (0.001, 0.01, 0.05):
+        methods.append(('sketch', accuracy,
+                        lambda data, p, a=accuracy: sketch(data, p, a)))
+    times, errors = [], []
+    for _, _, func in methods:
+        errors.append(np.max(np.abs(func(x, range(101)) - q) / np.abs(q)))
+        times.append(best_time(lambda: func(big_x, 90.)))
+    return clt.Table(clt.Column('Method', [m[0] for m in methods],
+                                align=clt.ALIGN.LEFT, fmt='%s'),
+                     clt.Column('Rel. accuracy', [m[1] for m in methods]),
+                     clt.Column('Time 360000 samples(s)', times),
+                     clt.Column('Max. rel. error vs MATLAB', errors))
+
+
+def _convolved_enhancement_filters(lztot, fs, L, L_coef):
+    """Enhancement filter stage by FFT convolution, as 'ampa.ampa' used to do."""
+    Ztot = np.zeros((len(L), len(lztot)))
+    for i in xrange(len(L)):
+        l = int(L[i] * fs)
+        B = np.zeros(2 * l)
+        B[0:l] = range(1, l + 1)
+        B[l:2 * l] = L_coef * (np.arange(1, l + 1) - (l + 1))
+        B = B / np.sum(np.abs(B))
+        Zt = signal.fftconvolve(lztot, B)[:len(lztot)]
+        Zt = Zt * (Zt > 0)
+        Ztot[i, :-l] = np.roll(Zt, -l)[:-l]
+    return np.prod(Ztot, 0)[:-int(np.max(L) * fs)]
+
+
+def bench_ampa_enhancement_filters():
+    """AMPA enhancement filters: FFT convolution vs. running sums."""
+    fs = 100.0
+    L = [30., 20., 10., 5., 2.5]
+    lengths, fft_times, cumsum_times, errors = [], [], [], []
+    for length in (100.0, 3600.0, 86400.0):
+        lztot = np.random.rand(int(length * fs)) + 1e-2
+        cf_fft = 12. + np.log10(_convolved_enhancement_filters(lztot, fs, L, 3.) + 1e-12)
+        cf_cumsum = 12. + np.log10(ampa._enhancement_filters(lztot, fs, L, 3.) + 1e-12)
+        lengths.append(length)
+        fft_times.append(best_time(lambda: _convolved_enhancement_filters(lztot, fs, L, 3.),
+                                   repeat=3))
+        cumsum_times.append(best_time(lambda: ampa._enhancement_filters(lztot, fs, L, 3.),
+                                      repeat=3))
+        errors.append(np.max(np.abs(cf_fft - cf_cumsum)))
+    return clt.Table(clt.Column('Length(s)', lengths),
+                     clt.Column('FFT(s)', fft_times),
+                     clt.Column('Running sums(s)', cumsum_times),
+                     clt.Column('Speedup', np.divide(fft_times, cumsum_times)),
+                     clt.Column('CF max. abs. error', errors))
+
+
+_PEAK_MEMORY_SCRIPT = """
+import resource, timeit, numpy as np
+from apasvo.picking import ampa
+x = np.random.randn(%d)
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = timeit.default_timer()
+ampa.ampa(x, 100.0, low_memory=%s)
+t = timeit.default_timer() - t0
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print('%%d %%f' %% (peak - base, t))
+"""
+
+
+def bench_ampa_low_memory():
+    """AMPA peak memory (bytes per sample) and time: default vs. low memory mode."""
+    lengths, memories, times = [], [[], []], [[], []]
+    for length in (3600.0, 6 * 3600.0):
+        n = int(length * 100)
+        lengths.append(length)
+        for i, low_memory in enumerate((False, True)):
+            # Peak memory is measured in a new process for each run
+            output = subprocess.check_output([sys.executable, '-c',
+                                              _PEAK_MEMORY_SCRIPT % (n, low_memory)])
+            peak, t = output.split()
+            memories[i].append(int(peak) * 1024. / n)
+            times[i].append(float(t))
+    return clt.Table(clt.Column('Length(s)', lengths),
+                     clt.Column('Default(B/sample)', memories[0]),
+                     clt.Column('Low memory(B/sample)', memories[1]),
+                     clt.Column('Default(s)', times[0]),
+                     clt.Column('Low memory(s)', times[1]))
+
+
+def bench_ampa_sweep():
+    """AMPA parameter sweep: one ampa call per configuration vs. ampa_sweep."""
+    fs = 100.0
+    x = np.random.randn(int(600 * fs))
+    configurations = ampa.parameter_grid(noise_thr=[80., 90., 95.],
+                                         L=[[30., 20., 10., 5., 2.5], [20., 10., 5.]],
+                                         L_coef=[2., 3.],
+                                         U=[10., 12.])
+
+    def run_ampa():
+        return [ampa.ampa(x, fs, **c) for c in configurations]
+
+    ampa_time = best_time(run_ampa, repeat=3)
+    sweep_time = best_time(lambda: ampa.ampa_sweep(x, fs, configurations), repeat=3)
+    error = max(np.max(np.abs(cf - cf_sweep)) for (_, cf), (_, _, cf_sweep)
+                in zip(run_ampa(), ampa.ampa_sweep(x, fs, configurations)))
+    return clt.Table(clt.Column('Configurations', [len(configurations)]),
+                     clt.Column('ampa(s)', [ampa_time]),
+                     clt.Column('ampa_sweep(s)', [sweep_time]),
+                     clt.Column('Speedup', [ampa_time / sweep_time]),
+                     clt.Column('CF max. abs. error', [error]))
+
+
+def bench_ampa_overlap_save():
+    """Ampa.run: overlapped windows vs. overlap-save mode."""
+    fs = 100.0
+    lengths, window_times, overlap_save_times = [], [], []
+    for length in (3600.0, 6 * 3600.0):
+        x = np.random.randn(int(length * fs))
+        alg = ampa.Ampa()
+        alg_overlap_save = ampa.Ampa(overlap_save=True)
+        lengths.append(length)
+        window_times.append(best_time(lambda: alg.run(x, fs), repeat=3))
+        overlap_save_times.append(best_time(lambda: alg_overlap_save.run(x, fs),
+                                            repeat=3))
+    return clt.Table(clt.Column('Length(s)', lengths),
+                     clt.Column('Windows(s)', window_times),
+                     clt.Column('Overlap-save(s)', overlap_save_times),
+                     clt.Column('Speedup', np.divide(window_times, overlap_save_times)))
+
+
+def bench_sta_lta():
+    """STA-LTA methods and a bank of window lengths vs. one call per pair."""
+    fs = 100.0
+    x = np.random.randn(int(6 * 3600 * fs))
+    lengths = [(sta, lta) for sta in (1., 2., 5.) for lta in (30., 60., 120.)]
+    names, times = [], []
+    for method in ('convolution', 'cumsum'):
+        names.append(method)
+        times.append(best_time(lambda: stalta.sta_lta(x, fs, method=method), repeat=3))
+    for method in ('convolution', 'cumsum'):
+        names.append('%d pairs, %s' % (len(lengths), method))
+        times.append(best_time(lambda: [stalta.sta_lta(x, fs, sta_length=s, lta_length=l,
+                                                       method=method)
+                                        for s, l in lengths], repeat=1))
+    names.append('%d pairs, bank' % len(lengths))
+    times.append(best_time(lambda: stalta.sta_lta_bank(x, fs, lengths), repeat=1))
+    return clt.Table(clt.Column('Method (6 h at 100 Hz)', names,
+                                align=clt.ALIGN.LEFT, fmt='%s'),
+                     clt.Column('Time(s)', times))
+
+
+def bench_sta_lta_stream():
+    """Streaming STA-LTA over 1 h at 50 Hz fed in chunks of several sizes."""
+    fs = 50.0
+    x = np.random.randn(int(3600 * fs))
+
+    def run(chunk_size):
+        stream = stalta.StaLtaStream(fs, sta_length=5.0, lta_length=100.0)
+        for i in xrange(0, len(x), chunk_size):
+            stream.push(x[i:i + chunk_size])
+        stream.flush()
+
+    sizes, times = [], []
+    for chunk_size in (10, 100, 1000, 10000):
+        sizes.append(chunk_size)
+        times.append(best_time(lambda: run(chunk_size), repeat=3))
+    return clt.Table(clt.Column('Chunk size', sizes),
+                     clt.Column('Time(s)', times),
+                     clt.Column('Time per push(us)',
+                                np.multiply(times, 1e6 * np.array(sizes) / len(x))))
+
+
+def bench_sta_lta_stacked():
+    """STA-LTA over 300 channels: one call per channel vs. a 2-D array."""
+    fs = 100.0
+    names, loop_times, stacked_times = [], [], []
+    for length in (60.0, 600.0):
+        x = np.random.randn(300, int(length * fs))
+        for method in ('convolution', 'cumsum', 'recursive'):
+            names.append('%d s, %s' % (length, method))
+            loop_times.append(best_time(lambda: [stalta.sta_lta(row, fs, sta_length=1.,
+                                                                lta_length=10., method=method)
+                                                 for row in x], repeat=3))
+            stacked_times.append(best_time(lambda: stalta.sta_lta(x, fs, sta_length=1.,
+                                                                  lta_length=10., method=method),
+                                           repeat=3))
+    return clt.Table(clt.Column('Channel length, method', names,
+                                align=clt.ALIGN.LEFT, fmt='%s'),
+                     clt.Column('Loop(s)', loop_times),
+                     clt.Column('Stacked(s)', stacked_times),
+                     clt.Column('Speedup', np.divide(loop_times, stacked_times)))
+
+
+def _qr_takanami_aic(x, n0, l, k=5, p=1):
+    """Noise model AIC by a QR decomposition per sample, as 'takanami'
+    used to do (with p = 1)."""
+    aic_0_l = np.zeros(int(l) + 1)
+    X0 = np.zeros((n0 - k, k + 1))
+    for i in xrange(k):
+        X0[:, i] = x[k - i - 1:n0 - 1 - i]
+    X0[:, k] = x[k:n0]
+    S = np.linalg.qr(X0, mode='r')[:k + 1, :k + 1]
+    R = np.zeros((k + 1 + p, k + 1))
+    for i in xrange(int(l) + 1):
+        if i > 0:
+            aug_data = x[(n0 + i * p - k - 1):(n0 + i * p)]
+            R[:k + 1, :k + 1] = S
+            R[k + 1:k + 1 + p, :k] = aug_data[-2::-1]
+            R[k + 1:k + 1 + p, k] = aug_data[-1]
+            S = np.linalg.qr(R, mode='r')[:k + 1, :k + 1]
+        c2 = n0 + i * p - k
+        aic_0_l[i] = np.min([c2 * np.log(np.sum(S[j:, k] ** 2) / c2) + 2 * (j + 1)
+                             for j in xrange(k + 1)])
+    return aic_0_l
+
+
+def bench_takanami():
+    """Takanami noise model AIC: a QR decomposition per sample vs. Givens rotations."""
+    fs = 100.0
+    margins, qr_times, givens_times, errors = [], [], [], []
+    for margin in (2.5, 5.0, 20.0):
+        x = np.random.randn(int(2 * margin * fs))
+        l = len(x) - 24
+        margins.append(margin)
+        qr_times.append(best_time(lambda: _qr_takanami_aic(x, 12, l), repeat=3))
+        givens_times.append(best_time(lambda: takanami._takanami_aic(x, 12, l), repeat=3))
+        errors.append(np.max(np.abs(_qr_takanami_aic(x, 12, l) -
+                                    takanami._takanami_aic(x, 12, l))))
+    return clt.Table(clt.Column('Margin(s) at 100 Hz', margins),
+                     clt.Column('QR(s)', qr_times),
+                     clt.Column('Givens(s)', givens_times),
+                     clt.Column('Speedup', np.divide(qr_times, givens_times)),
+                     clt.Column('Max. abs. difference', errors))
+
+
+def bench_takanami_batch():
+    """Takanami refinement of many events: one call per event vs. a batch."""
+    fs = 100.0
+    x = np.random.randn(int(3600 * fs))
+    alg = takanami.Takanami()
+    n_events, loop_times, batch_times = [], [], []
+    for n in (10, 100, 1000):
+        t = np.random.uniform(10., 3590., n)
+        n_events.append(n)
+        loop_times.append(best_time(lambda: [alg.run(x, fs, t_i - 5.0, t_i + 5.0)
+                                             for t_i in t], repeat=1))
+        batch_times.append(best_time(lambda: alg.run_batch(x, fs, t - 5.0, t + 5.0),
+                                     repeat=1))
+    return clt.Table(clt.Column('Events (5 s margin)', n_events),
+                     clt.Column('Loop(s)', loop_times),
+                     clt.Column('Batch(s)', batch_times),
+                     clt.Column('Speedup', np.divide(loop_times, batch_times)))
+
+
+def bench_refinement():
+    """Event refinement: Takanami AR method vs. variance-based AIC (Maeda)."""
+    fs = 100.0
+    n_events = 200
+    x = np.random.randn(int((n_events + 1) * 20 * fs))
+    onsets = (np.arange(1, n_events + 1) * 20 * fs).astype(int)
+    t = np.arange(int(5 * fs)) / fs
+    coda = 8. * np.sin(2 * np.pi * 5. * t) * np.exp(-t)
+    for onset in onsets:
+        x[onset:onset + len(coda)] += coda
+    # Candidate events are up to 1 s away from the onsets
+    t_event = (onsets + np.random.randint(-100, 100, n_events)) / fs
+    names, times, picks = [], [], []
+    for name, alg in (('Takanami', takanami.Takanami()), ('Maeda', maeda.Maeda())):
+        names.append(name)
+        times.append(best_time(lambda: alg.run_batch(x, fs, t_event - 5.0, t_event + 5.0),
+                               repeat=1))
+        picks.append(alg.run_batch(x, fs, t_event - 5.0, t_event + 5.0)[0])
+    return clt.Table(clt.Column('Method (%d events)' % n_events, names,
+                                align=clt.ALIGN.LEFT, fmt='%s'),
+                     clt.Column('Time(s)', times),
+                     clt.Column('Mean error(samples)', [np.mean(np.abs(p - onsets))
+                                                        for p in picks]),
+                     clt.Column('Max. error(samples)', [np.max(np.abs(p - onsets))
+                                                        for p in picks]),
+                     clt.Column('Max. deviation from Takanami(samples)',
+                                [np.max(np.abs(p - picks[0])) for p in picks]))
+
+
+def bench_takanami_coarse_to_fine():
+    """Takanami refinement: exhaustive vs. coarse-to-fine search (decimation 4)."""
+    fs = 100.0
+    margins, exhaustive_times, coarse_times = [], [], []
+    agreement, exhaustive_hits, coarse_hits = [], [], []
+    for margin in (2.5, 5.0, 10.0, 20.0):
+        # 50 synthetic events within 1 s of the center of their intervals
+        length = int(2 * margin * fs) + 1
+        onsets = length // 2 + np.random.randint(-100, 100, 50)
+        X = np.random.randn(50, length)
+        for x, onset in zip(X, onsets):
+            t = np.arange(length - onset) / fs
+            x[onset:] += 4. * np.sin(2 * np.pi * 5. * t) * np.exp(-t)
+        margins.append(margin)
+        exhaustive_times.append(best_time(lambda: takanami.takanami_batch(X, 12, length - 12),
+                                          repeat=1))
+        coarse_times.append(best_time(lambda: takanami.takanami_batch(X, 12, length - 12,
+                                                                      decimation=4),
+                                      repeat=1))
+        et, _ = takanami.takanami_batch(X, 12, length - 12)
+        c_et, _ = takanami.takanami_batch(X, 12, length - 12, decimation=4)
+        agreement.append(100. * np.mean(et == c_et))
+        exhaustive_hits.append(100. * np.mean(np.abs(et - onsets) < 10))
+        coarse_hits.append(100. * np.mean(np.abs(c_et - onsets) < 10))
+    return clt.Table(clt.Column('Margin(s)', margins),
+                     clt.Column('Exhaustive(s)', exhaustive_times),
+                     clt.Column('Coarse-to-fine(s)', coarse_times),
+                     clt.Column('Speedup', np.divide(exhaustive_times, coarse_times)),
+                     clt.Column('Same pick(%)', agreement),
+                     clt.Column('Exhaustive hits(%)', exhaustive_hits),
+                     clt.Column('Coarse-to-fine hits(%)', coarse_hits))
+
+
+def bench_takanami_all_orders():
+    """Takanami AIC curves of orders 1 to 10: one run per order vs. one run."""
+    fs = 100.0
+    x = np.random.randn(int(10 * fs))
+    x[len(x) // 2:] *= 10.
+    n0, n1 = 22, len(x) - 22
+    loop_time = best_time(lambda: [takanami.takanami(x, n0, n1, k=k)
+                                   for k in xrange(1, 11)], repeat=3)
+    all_orders_time = best_time(lambda: takanami.takanami(x, n0, n1, k=10,
+                                                          all_orders=True), repeat=3)
+    et, _ = takanami.takanami(x, n0, n1, k=10, all_orders=True)
+    deviation = np.max(np.abs(et - [takanami.takanami(x, n0, n1, k=k)[0]
+                                    for k in xrange(1, 11)]))
+    return clt.Table(clt.Column('One run per order(s)', [loop_time]),
+                     clt.Column('All orders(s)', [all_orders_time]),
+                     clt.Column('Speedup', [loop_time / all_orders_time]),
+                     clt.Column('Max. pick deviation(samples)', [deviation]))
+
+
+def bench_find_peaks():
+    """Peak search over an hour at 100 Hz: argrelmax vs. sliding maximum."""
+    fs = 100.0
+    x = np.random.randn(int(3600 * fs))
+    windows, argrelmax_times, sliding_times, equal = [], [], [], []
+    for peak_window in (0.1, 1., 10.):
+        order = int(peak_window * fs)
+        windows.append(peak_window)
+        argrelmax_times.append(best_time(lambda: signal.argrelmax(x, order=order),
+                                         repeat=1))
+        sliding_times.append(best_time(lambda: findpeaks.find_peaks(x, 0., order),
+                                       repeat=3))
+        et = signal.argrelmax(x, order=order)[0]
+        equal.append(np.array_equal(et[x[et] > 0.],
+                                    findpeaks.find_peaks(x, 0., order)))
+    return clt.Table(clt.Column('Peak window(s)', windows),
+                     clt.Column('argrelmax(s)', argrelmax_times),
+                     clt.Column('Sliding maximum(s)', sliding_times),
+                     clt.Column('Speedup', np.divide(argrelmax_times, sliding_times)),
+                     clt.Column('Same peaks', equal))
+
+
+def bench_eqgenerator_batch():
+    """Synthesis of one minute long earthquakes: one call per trace vs. batch."""
+    generator = eqgenerator.EarthquakeGenerator(fs=50.0)
+    sizes, loop_rates, batch_rates = [], [], []
+    for size in (100, 1000, 5000):
+        sizes.append(size)
+        loop_time = best_time(lambda: [generator.generate_earthquake(60., 20., 5.)
+                                       for _ in xrange(min(size, 500))], repeat=1)
+        loop_rates.append(60. * min(size, 500) / loop_time)
+        batch_time = best_time(lambda: generator.generate_earthquakes(
+            size, 60., 20., 5., random_state=0), repeat=1)
+        batch_rates.append(60. * size / batch_time)
+    return clt.Table(clt.Column('Traces', sizes),
+                     clt.Column('One call per trace(traces/min)', loop_rates),
+                     clt.Column('Batch(traces/min)', batch_rates),
+                     clt.Column('Speedup', np.divide(batch_rates, loop_rates)))
+
+
+def bench_eqgenerator_event_local():
+    """Synthesis of 100 earthquakes on signals of increasing length."""
+    lengths, times = [], []
+    for length in (60., 600., 3600.):
+        lengths.append(length)
+        times.append(best_time(lambda: eqgenerator.generate_seismic_earthquakes(
+            length, [30.] * 100, 50., [5.] * 100, 50., 10., 4., 1., 2., 18.,
+            .2, .1, random_state=0), repeat=3))
+    return clt.Table(clt.Column('Length(s)', lengths),
+                     clt.Column('Time(s)', times))
+
+
+def bench_noise_fir():
+    """FIR filtering of 1 hour of noise at 50 Hz by lfilter and by FFT."""
+    x = np.random.RandomState(0).randn(int(3600 * 50.) + 1)
+    taps, direct, fft, auto = [], [], [], []
+    for n in (16, 64, 128, 503, 2000):
+        b = signal.firwin(n, .4)
+        taps.append(n)
+        direct.append(best_time(lambda: fftutils.fir_filter(b, x, method='direct')))
+        fft.append(best_time(lambda: fftutils.fir_filter(b, x, method='fft')))
+        auto.append(best_time(lambda: fftutils.fir_filter(b, x)))
+    return clt.Table(clt.Column('Taps', taps),
+                     clt.Column('Direct(s)', direct),
+                     clt.Column('FFT(s)', fft),
+                     clt.Column('Auto(s)', auto),
+                     clt.Column('Speedup', np.divide(direct, auto)))
+
+
+BENCHMARKS = [
+    ('ampa_batched_bands', bench_ampa_batched_bands),
+    ('prctile', bench_prctile),
+    ('ampa_enhancement_filters', bench_ampa_enhancement_filters),
+    ('ampa_low_memory', bench_ampa_low_memory),
+    ('ampa_sweep', bench_ampa_sweep),
+    ('ampa_overlap_save', bench_ampa_overlap_save),
+    ('sta_lta', bench_sta_lta),
+    ('sta_lta_stacked', bench_sta_lta_stacked),
+    ('sta_lta_stream', bench_sta_lta_stream),
+    ('takanami', bench_takanami),
+    ('takanami_batch', bench_takanami_batch),
+    ('takanami_coarse_to_fine', bench_takanami_coarse_to_fine),
+    ('takanami_all_orders', bench_takanami_all_orders),
+    ('refinement', bench_refinement),
+    ('find_peaks', bench_find_peaks),
+    ('eqgenerator_batch', bench_eqgenerator_batch),
+    ('eqgenerator_event_local', bench_eqgenerator_event_local),
+    ('noise_fir', bench_noise_fir),
+]
+
+
+def main(argv=None):
+    names = sys.argv[1:] if argv is None else argv
+    for name, bench in BENCHMARKS:
+        if names and name not in names:
+            continue
+        clt.print_msg("%s: %s\n" % (name, bench.__doc__))
+        print bench()
+        print
+
+
+if __name__ == "__main__":
+    main()
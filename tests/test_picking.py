@@ -26,11 +26,27 @@
   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import threading
 import unittest
 import numpy as np
 import scipy.io as sio
+from scipy import signal
+from scipy import fftpack
+from multiprocessing.pool import ThreadPool
+import imp
+try:
+    import obspy
+except ImportError:
+    obspy = None
 
-from apasvo.picking import stalta, ampa, takanami, findpeaks
+from apasvo.picking import stalta, ampa, takanami, maeda, findpeaks, envelope
+from apasvo.picking import apasvotrace
+from apasvo.picking import eqgenerator
 
 
 class Check_prctile(unittest.TestCase):
@@ -55,6 +71,52 @@ class Check_prctile(unittest.TestCase):
         self.assertTrue(np.isnan(ampa.prctile(np.array([]),50)))
         self.assertTrue(np.all(np.isnan(ampa.prctile(np.array([]),[10, 20]))))
 
+    def test_results_equal_to_full_sort(self):
+        x = np.random.randn(1001)
+        p = np.linspace(0, 100, 401)
+        sorted_x = np.sort(x)
+        q = np.hstack([0, 100 * np.linspace(0.5, 1000.5, 1001) / 1001, 100])
+        xx = np.hstack([sorted_x[0], sorted_x, sorted_x[-1]])
+        self.assertTrue(np.all(ampa.prctile(x, p) == np.interp(p, q, xx)))
+
+
+class Check_percentile_sketch(unittest.TestCase):
+
+    data = sio.loadmat('tests/signal_fs_50_t0_100.mat')
+    x = data['X'][:, 0]
+    results = sio.loadmat('tests/test_prctile.mat')
+    q = results['q'][0, :]
+
+    def test_error_bounded_by_relative_accuracy(self):
+        sorted_x = np.sort(self.x)
+        for accuracy in (0.001, 0.01, 0.05):
+            sketch = ampa.PercentileSketch(accuracy)
+            for chunk in np.array_split(self.x, 7):
+                sketch.update(chunk)
+            self.assertEqual(sketch.count, len(self.x))
+            rank = np.round(np.arange(101) * len(self.x) / 100. - 0.5)
+            expected = sorted_x[np.clip(rank, 0, len(self.x) - 1).astype(int)]
+            error = np.abs(sketch.percentile(range(101)) - expected)
+            self.assertTrue(np.all(error <= accuracy * np.abs(expected) + 1e-12))
+
+    def test_results_close_to_matlab(self):
+        sketch = ampa.PercentileSketch(0.001)
+        sketch.update(self.x)
+        self.assertTrue(np.allclose(sketch.percentile(range(101)), self.q,
+                                    rtol=0.005, atol=0.005))
+
+    def test_empty_sketch_returns_nan(self):
+        sketch = ampa.PercentileSketch()
+        self.assertTrue(np.isnan(sketch.percentile(90)))
+        sketch.update(self.x)
+        sketch.clear()
+        self.assertTrue(np.all(np.isnan(sketch.percentile([10, 20]))))
+
+    def test_wrong_arguments_should_return_error(self):
+        self.assertRaises(ValueError, ampa.PercentileSketch, 0.)
+        self.assertRaises(ValueError, ampa.PercentileSketch, 1.)
+        self.assertRaises(ValueError, ampa.PercentileSketch().percentile, 101)
+
 
 class Check_find_peaks(unittest.TestCase):
 
@@ -84,12 +146,124 @@ class Check_find_peaks(unittest.TestCase):
         self.assertTrue(np.all(findpeaks.find_peaks(x) == np.array([])))
         self.assertTrue(np.all(findpeaks.find_peaks(x, threshold=0) == np.array([])))
 
+    def test_results_equal_to_argrelmax(self):
+        np.random.seed(0)
+        for n in (2, 3, 10, 100, 1000):
+            for x in (np.random.randn(n), np.random.randint(0, 4, n)):
+                for order in (1, 2, 5, 30, 2000):
+                    et = findpeaks.find_peaks(x, threshold=-np.inf, order=order)
+                    self.assertTrue(np.all(et == signal.argrelmax(x, order=order)[0]))
+
     def test_order_not_positive_returns_error(self):
         x = np.array([1,2,3,4,5,6,5,4,3,2,1])
         self.assertRaises(ValueError, findpeaks.find_peaks, x, 0, 0)
         self.assertRaises(ValueError, findpeaks.find_peaks, x, 0, -1)
 
 
+class Check_trigger(unittest.TestCase):
+
+    def setUp(self):
+        self.cf = np.abs(np.random.RandomState(0).randn(5000)).cumsum() % 7.
+
+    def run_trigger(self, trigger, chunk_size):
+        et, on, off = [], [], []
+        for i in xrange(0, len(self.cf), chunk_size):
+            et_i, on_i, off_i = trigger.push(self.cf[i:i + chunk_size])
+            et.append(et_i)
+            on.append(on_i)
+            off.append(off_i)
+        et_i, on_i, off_i = trigger.flush()
+        return (np.concatenate(et + [et_i]), np.concatenate(on + [on_i]),
+                np.concatenate(off + [off_i]))
+
+    def test_chunks_return_same_results_as_find_peaks(self):
+        for order in (1, 10, 200):
+            et = findpeaks.find_peaks(self.cf, 5., order)
+            for chunk_size in (1, 7, 150, 5000):
+                trigger = findpeaks.Trigger(5., order=order)
+                t_et, _, _ = self.run_trigger(trigger, chunk_size)
+                self.assertTrue(len(et) > 0)
+                self.assertTrue(np.all(t_et == et))
+
+    def test_peaks_are_given_out_while_triggered(self):
+        self.cf = 4. + 2. * np.sin(np.arange(5000) / 100.) + np.random.randn(5000)
+        on, off, triggered = [], [], False
+        for i, value in enumerate(self.cf):
+            if not triggered and value > 5.:
+                on.append(i)
+                triggered = True
+            elif triggered and value < 3.:
+                off.append(i)
+                triggered = False
+        if triggered:
+            off.append(len(self.cf) - 1)
+        et = findpeaks.find_peaks(self.cf, -np.inf, 2)
+        active = np.zeros(len(self.cf), dtype=bool)
+        for start, end in zip(on, off):
+            active[start:end] = True
+        for chunk_size in (1, 150, 5000):
+            trigger = findpeaks.Trigger(5., 3., order=2)
+            t_et, t_on, t_off = self.run_trigger(trigger, chunk_size)
+            self.assertTrue(len(t_et) > len(findpeaks.find_peaks(self.cf, 5., 2)))
+            self.assertTrue(np.all(t_on == on))
+            self.assertTrue(np.all(t_off == off))
+            self.assertTrue(np.all(t_et == et[active[et]]))
+            self.assertFalse(trigger.triggered)
+
+    def test_picks_are_given_out_as_soon_as_they_are_final(self):
+        trigger = findpeaks.Trigger(0.5, order=3)
+        self.assertEqual(len(trigger.push([0., 1., 0., 0.])[0]), 0)
+        self.assertTrue(np.all(trigger.push([0.])[0] == [1]))
+        self.assertEqual(len(trigger.flush()[0]), 0)
+
+    def test_picking_mode_returns_global_maximum(self):
+        trigger = findpeaks.Trigger()
+        et, _, _ = self.run_trigger(trigger, 150)
+        self.assertTrue(np.all(et == findpeaks.find_peaks(self.cf)))
+
+    def test_order_not_positive_returns_error(self):
+        self.assertRaises(ValueError, findpeaks.Trigger, 0., order=0)
+
+
+class Check_envelope(unittest.TestCase):
+
+    data = sio.loadmat('tests/signal_fs_50_t0_100.mat')
+    x = data['X'][:, 0]
+
+    def hilbert_envelope(self, x):
+        x_norm = x - np.mean(x)
+        return np.sqrt(x_norm ** 2 + fftpack.hilbert(x_norm) ** 2) + np.mean(x)
+
+    def test_signal_returns_correct_results(self):
+        x = self.x[:10000]  # 10000 = 2 ** 4 * 5 ** 4, no padding is needed
+        self.assertTrue(np.allclose(envelope.envelope(x),
+                                    self.hilbert_envelope(x)))
+
+    def test_padded_signal_returns_close_results(self):
+        x = self.x[:10007]
+        e = envelope.envelope(x)
+        self.assertEqual(len(e), len(x))
+        error = np.abs(e - self.hilbert_envelope(x))[100:-100]
+        self.assertTrue(np.max(error) < 0.01 * np.max(e))
+
+    def test_blocks_return_close_results(self):
+        e = envelope.envelope(self.x, block_size=None)
+        self.assertTrue(np.allclose(envelope.envelope(self.x, block_size=20000),
+                                    e, atol=0.01 * np.max(e)))
+
+    def test_trace_envelope_is_cached_until_signal_changes(self):
+        trace = apasvotrace.ApasvoTrace(self.x[:10000],
+                                        header={'sampling_rate': 50.})
+        e = trace.envelope
+        self.assertTrue(trace.envelope is e)
+        self.assertTrue(np.allclose(e, envelope.envelope(trace.data)))
+        trace.data = trace.data * 2
+        self.assertTrue(np.allclose(trace.envelope, 2 * e))
+        trace.use_filtered = True
+        trace.filtered_signal = trace.data[::-1]
+        self.assertTrue(np.allclose(trace.envelope, 2 * e[::-1]))
+
+
 class Check_sta_lta(unittest.TestCase):
 
     data = sio.loadmat('tests/signal_fs_50_t0_100.mat')
@@ -109,6 +283,44 @@ class Check_sta_lta(unittest.TestCase):
         self.assertTrue(np.allclose(cf, self.cf))
         self.assertTrue(np.all((et / 50.0) == self.et))
 
+    def test_cumsum_method_returns_correct_results(self):
+        et, cf = stalta.sta_lta(self.x, 50.0, sta_length=5.0, lta_length=100.,
+                                method='cumsum')
+        self.assertTrue(np.allclose(cf, self.cf))
+        self.assertTrue(np.all((et / 50.0) == self.et))
+
+    def test_cumsum_method_is_accurate_on_long_signals(self):
+        x = np.random.randn(2 * 10 ** 6) * 1000 + 1e5
+        _, cf = stalta.sta_lta(x, 100.0, method='cumsum')
+        x_norm = np.abs(x - np.mean(x))
+        for i in (0, 12345, 1500000, len(x) - 7000, len(x) - 1):
+            expected = np.mean(x_norm[i:i + 501]) / np.mean(x_norm[i:i + 10001])
+            self.assertAlmostEqual(cf[i], expected, places=12)
+
+    def test_bank_returns_same_results_as_sta_lta(self):
+        lengths = [(5.0, 100.0), (2.0, 50.0), (5.0, 50.0)]
+        results = stalta.sta_lta_bank(self.x, 50.0, lengths, threshold=1.5)
+        self.assertEqual(len(results), len(lengths))
+        for (sta_length, lta_length), (et, cf) in zip(lengths, results):
+            et_sta_lta, cf_sta_lta = stalta.sta_lta(self.x, 50.0, threshold=1.5,
+                                                    sta_length=sta_length,
+                                                    lta_length=lta_length,
+                                                    method='cumsum')
+            self.assertTrue(np.allclose(cf, cf_sta_lta))
+            self.assertTrue(np.all(et == et_sta_lta))
+        self.assertRaises(ValueError, stalta.sta_lta_bank, self.x, 50.0,
+                          [(5.0, 100.0), (10.0, 5.0)])
+
+    def test_decimated_signal_returns_close_results(self):
+        x = signal.resample(self.x, 4 * len(self.x))
+        et, cf = stalta.StaLta(sta_length=5.0, lta_length=100.0).run(x, 200.0)
+        alg = stalta.StaLta(sta_length=5.0, lta_length=100.0, decimate=True,
+                            f_max=20.0)
+        et_dec, cf_dec = alg.run(x, 200.0)
+        self.assertEqual(len(cf_dec), len(cf))
+        self.assertTrue(np.all(np.abs(et_dec - et) / 200.0 < 0.1))
+        self.assertRaises(ValueError, stalta.StaLta, decimate=True)
+
     def test_empty_signal_returns_empty(self):
         x = np.array([])
         et, cf = stalta.sta_lta(x, 10)
@@ -138,6 +350,39 @@ class Check_sta_lta(unittest.TestCase):
         self.assertTrue(np.all(et == fet))
         self.assertTrue(np.all(cf == fcf))
 
+    def test_stacked_signals_return_same_results_as_each_signal(self):
+        x = np.vstack([self.x, self.x[::-1], np.random.randn(len(self.x))])
+        for method in ('convolution', 'cumsum', 'recursive', 'strides'):
+            et, cf = stalta.sta_lta(x, 50.0, threshold=1.5, method=method)
+            self.assertEqual(cf.shape, x.shape)
+            self.assertEqual(len(et), len(x))
+            for row, row_et, row_cf in zip(x, et, cf):
+                s_et, s_cf = stalta.sta_lta(row, 50.0, threshold=1.5,
+                                            method=method)
+                self.assertTrue(np.allclose(row_cf, s_cf))
+                self.assertTrue(np.all(row_et == s_et))
+        alg = stalta.StaLta(decimate=True, f_max=10.0)
+        et, cf = alg.run(x, 50.0, threshold=1.5)
+        for row, row_et, row_cf in zip(x, et, cf):
+            s_et, s_cf = alg.run(row, 50.0, threshold=1.5)
+            self.assertTrue(np.allclose(row_cf, s_cf))
+            self.assertTrue(np.all(row_et == s_et))
+        self.assertRaises(ValueError, stalta.sta_lta, x[None], 50.0)
+
+    def test_stacked_stream_returns_same_results_as_each_trace(self):
+        rows = [self.x, self.x[::-1], self.x[:5000]]
+        stacked = apasvotrace.ApasvoStream(
+            [apasvotrace.ApasvoTrace(row, header={'sampling_rate': 50.})
+             for row in rows])
+        stacked.detect(stalta.StaLta(), allow_multiprocessing=False,
+                       stack=True, threshold=1.5)
+        for row, trace in zip(rows, stacked.traces):
+            single = apasvotrace.ApasvoTrace(row, header={'sampling_rate': 50.})
+            single.detect(stalta.StaLta(), threshold=1.5)
+            self.assertTrue(np.allclose(trace.cf, single.cf))
+            self.assertEqual([event.stime for event in trace.events],
+                             [event.stime for event in single.events])
+
     def test_different_methods_return_same_results(self):
         x = np.random.randn(10000)
         et1, cf1 = stalta.sta_lta(x, 50.0, method='convolution')
@@ -148,6 +393,141 @@ class Check_sta_lta(unittest.TestCase):
         self.assertTrue(np.allclose(cf1, cf3))
         self.assertTrue(np.allclose(cf2, cf3))
 
+    def test_detector_runs_sta_lta_from_its_arguments(self):
+        # The detector passes every parsed argument, including its own
+        # '--method' option, to the picker
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'signal.txt')
+            np.savetxt(filename, self.x)
+            subprocess.check_call([sys.executable, 'bin/apasvo-detector.py',
+                                   filename, '-m', 'stalta', '-i', 'text',
+                                   '-f', '50', '-d', tmpdir,
+                                   '--no-multiprocessing'],
+                                  stdout=open(os.devnull, 'w'),
+                                  env=dict(os.environ, PYTHONPATH=os.getcwd()))
+            self.assertTrue(any(name.endswith('.hyp')
+                                for name in os.listdir(tmpdir)))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_detector_rejects_decimation_without_f_max(self):
+        process = subprocess.Popen([sys.executable, 'bin/apasvo-detector.py',
+                                    'signal.txt', '-m', 'stalta',
+                                    '--decimate'],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   env=dict(os.environ, PYTHONPATH=os.getcwd()))
+        _, err = process.communicate()
+        self.assertEqual(process.returncode, 2)
+        self.assertIn('--sta-lta-f-max', err)
+        self.assertNotIn('Traceback', err)
+
+
+class Check_sta_lta_stream(unittest.TestCase):
+
+    x = Check_sta_lta.x
+
+    def run_stream(self, stream, chunk_size):
+        cf, on, off = [], [], []
+        for block in [self.x[i:i + chunk_size]
+                      for i in xrange(0, len(self.x), chunk_size)] + [None]:
+            if block is None:
+                cf_i, on_i, off_i = stream.flush()
+            else:
+                cf_i, on_i, off_i = stream.push(block)
+            cf.append(cf_i)
+            on.append(on_i)
+            off.append(off_i)
+        return np.concatenate(cf), np.concatenate(on), np.concatenate(off)
+
+    def test_stream_returns_same_results_as_sta_lta(self):
+        for method in ('convolution', 'recursive'):
+            _, cf = stalta.sta_lta(self.x, 50.0, sta_length=5.0,
+                                   lta_length=100.0, method=method)
+            for chunk_size in (50, 999, 5001, 20000):
+                stream = stalta.StaLtaStream(50.0, sta_length=5.0,
+                                             lta_length=100.0, cf_method=method,
+                                             offset=np.mean(self.x))
+                s_cf, _, _ = self.run_stream(stream, chunk_size)
+                self.assertEqual(len(s_cf), len(cf))
+                self.assertTrue(np.allclose(s_cf, cf))
+
+    def test_recursive_method_returns_correct_results(self):
+        x_norm = np.abs(self.x - np.mean(self.x))
+        _, cf = stalta.sta_lta(self.x, 50.0, sta_length=1.0, lta_length=10.0,
+                               method='recursive')
+        sta = lta = 0.
+        for i in xrange(2000):
+            sta += (x_norm[i] - sta) / 51.
+            lta += (x_norm[i] - lta) / 501.
+            self.assertAlmostEqual(cf[i], sta / lta if i >= 501 else 0.)
+
+    def test_stream_gives_out_values_as_soon_as_they_are_final(self):
+        stream = stalta.StaLtaStream(50.0, sta_length=5.0, lta_length=100.0)
+        cf, _, _ = stream.push(self.x[:5000])
+        self.assertEqual(len(cf), 0)
+        cf, _, _ = stream.push(self.x[5000:5010])
+        self.assertEqual(len(cf), 10)
+        self.assertEqual(stream.n_in - stream.n_out, 5000)
+        stream = stalta.StaLtaStream(50.0, cf_method='recursive')
+        cf, _, _ = stream.push(self.x[:10])
+        self.assertEqual(len(cf), 10)
+
+    def test_stream_memory_is_bounded_by_lta_window(self):
+        stream = stalta.StaLtaStream(50.0, sta_length=1.0, lta_length=10.0)
+        for i in xrange(0, len(self.x), 50):
+            stream.push(self.x[i:i + 50])
+            self.assertLessEqual(len(stream._prefix), 2 * (501 + 50))
+
+    def test_running_mean_offset_returns_close_results(self):
+        x = np.random.randn(50000) + 100.0
+        _, cf = stalta.sta_lta(x, 50.0, sta_length=2.0, lta_length=20.0)
+        stream = stalta.StaLtaStream(50.0, sta_length=2.0, lta_length=20.0)
+        s_cf = np.concatenate([stream.push(x[i:i + 1000])[0]
+                               for i in xrange(0, len(x), 1000)] +
+                              [stream.flush()[0]])
+        self.assertTrue(np.allclose(s_cf[5000:], cf[5000:], rtol=0.05))
+
+    def test_triggers_switch_with_hysteresis(self):
+        for method in ('convolution', 'recursive'):
+            _, cf = stalta.sta_lta(self.x, 50.0, sta_length=5.0,
+                                   lta_length=100.0, method=method)
+            on, off, triggered = [], [], False
+            for i, value in enumerate(cf):
+                if not triggered and value > 1.5:
+                    on.append(i)
+                    triggered = True
+                elif triggered and value < 1.2:
+                    off.append(i)
+                    triggered = False
+            if triggered:
+                off.append(len(cf) - 1)
+            stream = stalta.StaLtaStream(50.0, threshold_on=1.5,
+                                         threshold_off=1.2, cf_method=method,
+                                         offset=np.mean(self.x))
+            _, s_on, s_off = self.run_stream(stream, 3000)
+            self.assertTrue(len(on) > 0)
+            self.assertTrue(np.all(s_on == on))
+            self.assertTrue(np.all(s_off == off))
+
+    def test_flush_resets_stream(self):
+        stream = stalta.StaLtaStream(50.0, threshold_on=1.5)
+        cf, on, off = self.run_stream(stream, 5000)
+        self.assertEqual(stream.n_in, 0)
+        self.assertFalse(stream.triggered)
+        s_cf, s_on, s_off = self.run_stream(stream, 5000)
+        self.assertTrue(np.all(s_cf == cf))
+        self.assertTrue(np.all(s_on == on))
+        self.assertTrue(np.all(s_off == off))
+
+    def test_wrong_arguments_should_return_error(self):
+        self.assertRaises(ValueError, stalta.StaLtaStream, 0)
+        self.assertRaises(ValueError, stalta.StaLtaStream, 50.0,
+                          sta_length=10.0, lta_length=5.0)
+        self.assertRaises(ValueError, stalta.StaLtaStream, 50.0,
+                          decimate=True, f_max=10.0)
+
 
 class Check_ampa(unittest.TestCase):
 
@@ -168,6 +548,150 @@ class Check_ampa(unittest.TestCase):
         self.assertTrue(np.allclose(cf, self.cf))
         self.assertTrue(np.all((et / 50.0) == self.et))
 
+    def test_batched_bands_return_correct_results(self):
+        et, cf = ampa.ampa(self.x, 50.0, batched=True)
+        self.assertTrue(np.allclose(cf, self.cf))
+        self.assertTrue(np.all((et / 50.0) == self.et))
+        alg = ampa.Ampa(window=1000.0, step=1000.0, batched=True)
+        et, cf = alg.run(self.x, 50.0)
+        self.assertTrue(np.allclose(cf, self.cf))
+
+    def test_enhancement_filters_equal_to_convolution(self):
+        fs, L, L_coef = 50.0, [10.0, 5.0, 2.5], 3.0
+        lztot = np.random.rand(2000) + 1e-2
+        expected = np.ones(len(lztot) - int(max(L) * fs))
+        for v in L:
+            l = int(v * fs)
+            B = np.hstack([np.arange(1, l + 1),
+                           L_coef * (np.arange(1, l + 1) - (l + 1))])
+            B = B / np.sum(np.abs(B))
+            zt = signal.lfilter(B, 1, lztot)[l:l + len(expected)]
+            expected *= zt * (zt > 0)
+        result = ampa._enhancement_filters(lztot, fs, L, L_coef)
+        self.assertEqual(len(result), len(expected))
+        self.assertTrue(np.allclose(result, expected, rtol=1e-9, atol=0))
+
+    def test_low_memory_returns_close_results(self):
+        et, cf = ampa.ampa(self.x, 50.0, low_memory=True)
+        self.assertEqual(cf.dtype, np.float32)
+        self.assertTrue(np.allclose(cf, self.cf, atol=1e-4))
+        self.assertTrue(np.all((et / 50.0) == self.et))
+        # Several blocks of data
+        x = np.random.randn(3 * ampa.LOW_MEMORY_BLOCK_LENGTH)
+        _, cf = ampa.ampa(x, 100.0, L=[10.0, 5.0])
+        _, cf_low_memory = ampa.ampa(x, 100.0, L=[10.0, 5.0], low_memory=True)
+        self.assertTrue(np.allclose(cf_low_memory, cf, atol=1e-4))
+
+    @unittest.skipUnless(os.name == 'posix', "needs the resource module")
+    def test_low_memory_reduces_peak_memory(self):
+        script = ("import resource, numpy as np\n"
+                  "from apasvo.picking import ampa\n"
+                  "x = np.random.randn(1000000)\n"
+                  "base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+                  "ampa.ampa(x, 100.0, low_memory=%s)\n"
+                  "peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+                  "print(peak - base)\n")
+        peak = [int(subprocess.check_output([sys.executable, '-c',
+                                             script % low_memory]))
+                for low_memory in (False, True)]
+        self.assertLess(peak[1], peak[0] / 3)
+
+    def test_decimated_signal_returns_close_results(self):
+        x = signal.resample(self.x, 4 * len(self.x))
+        for step in (1000.0, 40.0):
+            alg = ampa.Ampa(window=1000.0, step=step, decimate=True)
+            et, cf = alg.run(x, 200.0)
+            self.assertEqual(len(cf), len(x) - 30 * 200)
+            self.assertTrue(np.all(np.abs(et / 200.0 - self.et) < 0.1))
+            # Band responses are the same at both rates
+            native_et, native_cf = ampa.Ampa(window=1000.0,
+                                             step=step).run(x, 200.0)
+            self.assertEqual(len(et), len(native_et))
+            self.assertTrue(np.all(np.abs(et - native_et) / 200.0 < 0.025))
+            self.assertGreater(np.corrcoef(cf, native_cf)[0, 1], 0.99)
+            self.assertLess(np.median(np.abs(cf - native_cf)),
+                            0.01 * np.max(native_cf))
+
+    def test_decimated_filter_bank_matches_native_responses(self):
+        native = ampa.FilterBank(200.0, n=4096)
+        bank = ampa.FilterBank(50.0, n=1024, decimation=4)
+        f = np.fft.rfftfreq(native.nfft, 1 / 200.0)
+        low = f <= 15.0
+        H = np.abs(native.H0)[:, low]
+        Hd = np.abs(np.fft.rfft(bank.h0, native.nfft // 4, axis=1))
+        self.assertEqual(bank.n_bands, native.n_bands)
+        self.assertTrue(np.all(np.abs(Hd[:, :H.shape[1]] - H) <
+                               0.01 * np.max(H)))
+
+    def test_overlap_save_returns_correct_results(self):
+        # A single window is the same as applying the algorithm once
+        alg = ampa.Ampa(window=1000.0, step=1000.0, overlap_save=True)
+        et, cf = alg.run(self.x, 50.0)
+        self.assertTrue(np.all(cf == ampa.ampa(self.x, 50.0)[1]))
+        for window, step in ((100.0, 50.0), (60.0, 25.0), (40.0, 40.0)):
+            alg = ampa.Ampa(window=window, step=step, overlap_save=True)
+            et, cf = alg.run(self.x, 50.0)
+            self.assertEqual(len(cf), len(self.cf))
+            self.assertTrue(np.all(np.abs(et / 50.0 - self.et) < 0.1))
+
+    def test_overlap_save_steps_share_filter_history(self):
+        alg = ampa.Ampa(window=60.0, step=25.0, L=[10.0, 5.0],
+                        overlap_save=True)
+        _, cf = alg.run(self.x, 50.0)
+        # Output of the step from 100 s to 125 s, computed from the segment
+        # of data it depends on, from 75 s to 135 s, plus the history of
+        # the band filters
+        history = ampa.BAND_FILTER_LENGTH - 1
+        x = (self.x - np.mean(self.x))[3750 - history:6750]
+        bank = ampa.default_filter_bank_cache.get(50.0, 3., 1., 2., 12., len(x))
+        y = ampa._band_envelopes(x, bank)[:, history:]
+        lztot = ampa._log_envelope(np.sum(ampa._noise_reduction(y, 90.), 0))
+        expected = ampa._enhancement_filters(lztot, 50.0, [10.0, 5.0], 3.0)
+        expected = ampa._characteristic_function(expected, 12.0)
+        self.assertTrue(np.max(cf[5000:6250]) > 1.0)
+        self.assertTrue(np.allclose(cf[5000:6250], expected[1250:]))
+
+    def test_sweep_returns_same_results_as_ampa(self):
+        configurations = ampa.parameter_grid(noise_thr=[80., 90.],
+                                             L=[[30., 10.], [20., 5.]],
+                                             U=[10., 12.])
+        configurations.append({'bandwidth': 2., 'overlap': 0.5})
+        results = ampa.ampa_sweep(self.x, 50.0, configurations, threshold=1.0)
+        self.assertEqual(len(results), len(configurations))
+        for configuration, (parameters, et, cf) in zip(configurations, results):
+            for k, v in configuration.items():
+                self.assertTrue(np.all(np.asarray(parameters[k]) == v))
+            et_ampa, cf_ampa = ampa.ampa(self.x, 50.0, threshold=1.0,
+                                         **parameters)
+            self.assertTrue(np.all(cf == cf_ampa))
+            self.assertTrue(np.all(et == et_ampa))
+
+    def test_sweep_wrong_parameters_should_return_error(self):
+        self.assertRaises(ValueError, ampa.ampa_sweep, self.x, 50.0,
+                          [{'window': 10.}])
+        self.assertRaises(ValueError, ampa.ampa_sweep, self.x, 50.0,
+                          [{'U': 12.}, {'U': -1.}])
+
+    def test_parallel_windows_return_same_results(self):
+        alg = ampa.Ampa(window=60.0, step=25.0)
+        et, cf = alg.run(self.x, 50.0, threshold=1.0)
+        et_threads, cf_threads = alg.run(self.x, 50.0, threshold=1.0,
+                                         workers=4)
+        self.assertTrue(np.all(cf_threads == cf))
+        self.assertTrue(np.all(et_threads == et))
+        pool = ThreadPool(processes=2)
+        et_pool, cf_pool = alg.run(self.x, 50.0, threshold=1.0, pool=pool)
+        pool.close()
+        pool.join()
+        self.assertTrue(np.all(cf_pool == cf))
+        self.assertTrue(np.all(et_pool == et))
+
+    def test_parallel_windows_do_not_leave_threads_running(self):
+        alg = ampa.Ampa(window=60.0, step=25.0)
+        n_threads = threading.active_count()
+        alg.run(self.x, 50.0, threshold=1.0, workers=4)
+        self.assertEqual(threading.active_count(), n_threads)
+
     def test_fs_not_positive_returns_error(self):
         self.assertRaises(ValueError, ampa.ampa, self.x, 0)
         self.assertRaises(ValueError, ampa.ampa, self.x, -10)
@@ -230,6 +754,88 @@ class Check_ampa(unittest.TestCase):
         self.assertTrue(np.all(cf == fcf))
 
 
+class Check_ampa_stream(unittest.TestCase):
+
+    x = Check_ampa.x
+
+    def run_stream(self, stream, chunk_size):
+        cf, et = [], []
+        for i in xrange(0, len(self.x), chunk_size):
+            cf_i, et_i = stream.push(self.x[i:i + chunk_size])
+            cf.append(cf_i)
+            et.append(et_i)
+        cf_i, et_i = stream.flush()
+        return np.concatenate(et + [et_i]), np.concatenate(cf + [cf_i])
+
+    def test_stream_returns_same_results_as_class(self):
+        for threshold in (None, 0.5):
+            for window, step in ((100.0, 50.0), (150.0, 20.0), (1000.0, 1000.0)):
+                alg = ampa.Ampa(window=window, step=step)
+                et, cf = alg.run(self.x, 50.0, threshold=threshold)
+                for chunk_size in (999, 2500, 12000):
+                    stream = ampa.AmpaStream(50.0, threshold=threshold,
+                                             window=window, step=step)
+                    s_et, s_cf = self.run_stream(stream, chunk_size)
+                    self.assertTrue(np.all(s_cf == cf))
+                    self.assertTrue(np.all(s_et == et))
+
+    def test_stream_gives_out_values_as_soon_as_they_are_final(self):
+        stream = ampa.AmpaStream(50.0, window=100.0, step=50.0)
+        cf, _ = stream.push(self.x[:4999])
+        self.assertEqual(len(cf), 0)
+        cf, _ = stream.push(self.x[4999:5000])
+        self.assertEqual(len(cf), 2500)
+        self.assertEqual(stream.n_out, 2500)
+
+    def test_flush_resets_stream(self):
+        stream = ampa.AmpaStream(50.0, threshold=0.5)
+        et, cf = self.run_stream(stream, 5000)
+        self.assertEqual(stream.n_in, 0)
+        s_et, s_cf = self.run_stream(stream, 5000)
+        self.assertTrue(np.all(s_cf == cf))
+        self.assertTrue(np.all(s_et == et))
+
+
+class Check_ampa_filter_bank(unittest.TestCase):
+
+    def test_filtering_with_bank_spectra_equals_convolution(self):
+        x = np.random.randn(1000)
+        bank = ampa.FilterBank(50.0, n=len(x))
+        X = np.fft.rfft(x, bank.nfft)
+        for i in xrange(bank.n_bands):
+            xa = np.fft.irfft(X * bank.H0[i], bank.nfft)[:len(x)]
+            xao = np.fft.irfft(X * bank.H0o[i], bank.nfft)[:len(x)]
+            self.assertTrue(np.allclose(xa, signal.lfilter(bank.h0[i], 1, x)))
+            self.assertTrue(np.allclose(xao, signal.lfilter(bank.h0o[i], 1, x)))
+
+    def test_cache_returns_same_bank_for_same_settings(self):
+        cache = ampa.FilterBankCache()
+        bank = cache.get(50, 3, 1, 2, 12, 5000)
+        self.assertTrue(cache.get(50.0, 3.0, 1.0, 2.0, 12.0, 5000) is bank)
+        self.assertFalse(cache.get(50.0, 3.0, 1.0, 2.0, 12.0, 2500) is bank)
+        self.assertEqual(len(cache), 2)
+
+    def test_cache_discards_least_recently_used_bank(self):
+        cache = ampa.FilterBankCache(maxsize=2)
+        bank_a = cache.get(50.0, 3.0, 1.0, 2.0, 12.0, 1000)
+        bank_b = cache.get(50.0, 3.0, 1.0, 2.0, 12.0, 2000)
+        cache.get(50.0, 3.0, 1.0, 2.0, 12.0, 1000)
+        cache.get(50.0, 3.0, 1.0, 2.0, 12.0, 3000)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.get(50.0, 3.0, 1.0, 2.0, 12.0, 1000) is bank_a)
+        self.assertFalse(cache.get(50.0, 3.0, 1.0, 2.0, 12.0, 2000) is bank_b)
+
+    def test_maxsize_not_positive_returns_error(self):
+        self.assertRaises(ValueError, ampa.FilterBankCache, 0)
+
+    def test_class_with_shared_cache_returns_correct_results(self):
+        cache = ampa.FilterBankCache()
+        alg = ampa.Ampa(window=1000.0, step=1000.0, cache=cache)
+        et, cf = alg.run(Check_ampa.x, 50.0)
+        self.assertTrue(np.allclose(cf, Check_ampa.cf))
+        self.assertEqual(len(cache), 1)
+
+
 class Check_takanami(unittest.TestCase):
 
     results = sio.loadmat('tests/test_takanami.mat')
@@ -242,6 +848,85 @@ class Check_takanami(unittest.TestCase):
         et, aic = takanami.takanami(self.x, self.n0, self.n1)
         self.assertTrue(np.allclose(aic, self.aic))
 
+    def test_aic_equal_to_least_squares_fit(self):
+        k, n0 = 5, 51
+        for p in (1, 3):
+            aic = takanami._takanami_aic(self.x, n0, 20, k=k, p=p)
+            for i in (0, 7, 20):
+                n = n0 + i * p
+                X = np.array([self.x[t - k:t + 1][::-1] for t in xrange(k, n)])
+                expected = []
+                for j in xrange(k + 1):
+                    if j > 0:
+                        coefs = np.linalg.lstsq(X[:, 1:j + 1], X[:, 0])[0]
+                        res = X[:, 0] - np.dot(X[:, 1:j + 1], coefs)
+                    else:
+                        res = X[:, 0]
+                    expected.append((n - k) * np.log(np.mean(res ** 2)) + 2 * (j + 1))
+                self.assertAlmostEqual(aic[i], min(expected))
+
+    def test_batch_returns_same_results_as_each_signal(self):
+        X = np.array([self.x[i:i + 300] for i in xrange(0, 301, 10)])
+        X[1] = X[1][::-1]
+        for signals in (X[:2], X):
+            et, aic = takanami.takanami_batch(signals, 12, 288)
+            self.assertEqual(aic.shape, (len(signals), 277))
+            for x, x_et, x_aic in zip(signals, et, aic):
+                s_et, s_aic = takanami.takanami(x, 12, 288)
+                self.assertEqual(x_et, s_et)
+                self.assertTrue(np.allclose(x_aic, s_aic))
+
+    def test_run_batch_returns_same_results_as_run(self):
+        alg = takanami.Takanami()
+        t = np.array([5., 1., 2., 2.5, 6., 11.5] + range(3, 9)) + 0.013
+        et, aic, n0 = alg.run_batch(self.x, 50.0, t - 1.0, t + 1.0)
+        self.assertEqual(len(aic), len(t))
+        for i in xrange(len(t)):
+            s_et, s_aic, s_n0 = alg.run(self.x, 50.0, t[i] - 1.0, t[i] + 1.0)
+            self.assertEqual(et[i], s_et)
+            self.assertEqual(n0[i], s_n0)
+            self.assertTrue(np.allclose(aic[i], s_aic))
+        et, aic, n0 = alg.run_batch(self.x, 50.0, [], [])
+        self.assertEqual(len(et), 0)
+
+    def test_coarse_to_fine_returns_same_results_as_exhaustive(self):
+        et, aic = takanami.takanami(self.x, self.n0, self.n1)
+        for q in (2, 4, 8):
+            c_et, c_aic = takanami.takanami(self.x, self.n0, self.n1,
+                                            decimation=q)
+            searched = ~np.isnan(c_aic)
+            self.assertEqual(c_et, et)
+            self.assertEqual(len(c_aic), len(aic))
+            self.assertTrue(0 < np.sum(searched) < len(aic))
+            self.assertTrue(np.allclose(c_aic[searched], aic[searched]))
+
+    def test_coarse_to_fine_batch_returns_same_results_as_each_signal(self):
+        X = np.array([self.x[i:i + 300] for i in xrange(0, 301, 10)])
+        et, aic = takanami.takanami_batch(X, 12, 288, decimation=4)
+        for x, x_et, x_aic in zip(X, et, aic):
+            s_et, s_aic = takanami.takanami(x, 12, 288, decimation=4)
+            self.assertEqual(x_et, s_et)
+            self.assertTrue(np.all(np.isnan(x_aic) == np.isnan(s_aic)))
+        alg = takanami.Takanami(decimation=4)
+        et, aic, n0 = alg.run_batch(self.x, 50.0, [1.0, 4.0], [9.0, 11.0])
+        for i, (t_start, t_end) in enumerate(((1.0, 9.0), (4.0, 11.0))):
+            s_et, s_aic, s_n0 = alg.run(self.x, 50.0, t_start, t_end)
+            self.assertEqual(et[i], s_et)
+            self.assertEqual(n0[i], s_n0)
+
+    def test_all_orders_return_close_results_to_each_order(self):
+        et, aic = takanami.takanami(self.x, self.n0, self.n1, all_orders=True)
+        self.assertEqual(aic.shape, (5, len(self.aic)))
+        self.assertTrue(np.all(aic[-1] == takanami.takanami(self.x, self.n0,
+                                                            self.n1)[1]))
+        for k in xrange(1, 6):
+            k_et, k_aic = takanami.takanami(self.x, self.n0, self.n1, k=k)
+            self.assertEqual(et[k - 1], k_et)
+            self.assertTrue(np.max(np.abs(aic[k - 1] - k_aic)) <
+                            0.02 * np.ptp(k_aic))
+        self.assertRaises(ValueError, takanami.takanami, self.x, self.n0,
+                          self.n1, decimation=2, all_orders=True)
+
     def test_n0_not_greater_than_k_returns_error(self):
         self.assertRaises(ValueError, takanami.takanami, self.x, 6, self.n1, k=6)
         self.assertRaises(ValueError, takanami.takanami, self.x, 5, self.n1, k=6)
@@ -268,6 +953,137 @@ class Check_takanami(unittest.TestCase):
         self.assertRaises(ValueError, takanami.takanami, self.x, self.n0, self.n1, k=-1)
 
 
+class Check_maeda(unittest.TestCase):
+
+    x = Check_takanami.x
+    n0 = Check_takanami.n0
+    n1 = Check_takanami.n1
+
+    def test_aic_equal_to_direct_computation(self):
+        et, aic = maeda.maeda(self.x, self.n0, self.n1)
+        self.assertEqual(len(aic), self.n1 - self.n0 + 1)
+        for t in (self.n0, 300, self.n1):
+            expected = (t * np.log(np.var(self.x[:t])) +
+                        (len(self.x) - t) * np.log(np.var(self.x[t:])))
+            self.assertAlmostEqual(aic[t - self.n0], expected, places=6)
+        self.assertEqual(et, self.n0 + np.argmin(aic))
+
+    def test_pick_close_to_takanami(self):
+        et, _ = maeda.maeda(self.x, self.n0, self.n1)
+        t_et, _ = takanami.takanami(self.x, self.n0, self.n1)
+        self.assertTrue(abs(et - t_et) <= 5)
+
+    def test_run_batch_returns_same_results_as_run(self):
+        alg = maeda.Maeda()
+        t = np.array([5., 1., 2., 2.5, 6., 11.5]) + 0.013
+        et, aic, n0 = alg.run_batch(self.x, 50.0, t - 1.0, t + 1.0)
+        for i in xrange(len(t)):
+            s_et, s_aic, s_n0 = alg.run(self.x, 50.0, t[i] - 1.0, t[i] + 1.0)
+            self.assertEqual(et[i], s_et)
+            self.assertEqual(n0[i], s_n0)
+            self.assertTrue(np.allclose(aic[i], s_aic))
+
+    def test_wrong_interval_returns_error(self):
+        self.assertRaises(ValueError, maeda.maeda, self.x, 1, self.n1)
+        self.assertRaises(ValueError, maeda.maeda, self.x, self.n0, self.n0)
+        self.assertRaises(ValueError, maeda.maeda, self.x, self.n0, len(self.x) - 1)
+
+
+class Check_eqgenerator(unittest.TestCase):
+
+    def test_batch_returns_same_results_as_each_signal(self):
+        generator = eqgenerator.EarthquakeGenerator(fs=50.0)
+        np.random.seed(0)
+        eq = generator.generate_earthquake(60., 20., 5.)
+        np.random.seed(0)
+        eqs = generator.generate_earthquakes(1, 60., 20., 5.)
+        self.assertEqual(eqs.shape, (1, len(eq)))
+        self.assertTrue(np.allclose(eqs[0], eq))
+        eq = generator.generate_earthquake(60., 20., 5., random_state=3)
+        eqs = generator.generate_earthquakes(1, 60., 20., 5., random_state=3)
+        self.assertTrue(np.allclose(eqs[0], eq))
+
+    def test_batch_with_seed_is_reproducible(self):
+        generator = eqgenerator.EarthquakeGenerator(fs=50.0, P_noise_db=-200.)
+        t0, p_eq = [5., 20., 59.], [0., 5., 10.]
+        eqs = generator.generate_earthquakes(3, 60., t0, p_eq, random_state=1)
+        self.assertTrue(np.all(eqs == generator.generate_earthquakes(
+            3, 60., t0, p_eq, random_state=np.random.RandomState(1))))
+        self.assertFalse(np.all(eqs == generator.generate_earthquakes(
+            3, 60., t0, p_eq, random_state=2)))
+        for eq, t, p in zip(eqs, t0, p_eq):
+            n0 = int(t * 50.0)
+            self.assertTrue(np.all(np.abs(eq[:n0]) < 1e-6))
+            self.assertAlmostEqual(10 * np.log10(np.var(eq[n0:n0 + 250])), p, 3)
+
+    def test_events_with_seed_are_reproducible(self):
+        generator = eqgenerator.EarthquakeGenerator(fs=50.0)
+        event_t, event_m = generator.generate_nevents(600., 20, random_state=1)
+        self.assertEqual(len(event_t), 20)
+        self.assertTrue(np.all(np.diff(event_t) >= 0))
+        same_t, same_m = generator.generate_nevents(
+            600., 20, random_state=np.random.RandomState(1))
+        self.assertTrue(np.all(event_t == same_t))
+        self.assertTrue(np.all(event_m == same_m))
+        other_t, _ = generator.generate_nevents(600., 20, random_state=2)
+        self.assertFalse(np.all(event_t == other_t))
+
+    def test_earthquakes_do_not_depend_on_signal_length(self):
+        args = (50.0, [0.5, 30.], 50.0, [5., 10.], 50., 10., 4., 1., 2., 18.,
+                .2, .1)
+        eqs = eqgenerator.generate_seismic_earthquakes(*args, random_state=0)
+        long_eqs = eqgenerator.generate_seismic_earthquakes(*((3600.,) + args[1:]),
+                                                            random_state=0)
+        self.assertTrue(np.allclose(long_eqs[:, :eqs.shape[1]], eqs))
+        self.assertTrue(np.all(long_eqs[:, 50 * 81:] == 0.))
+
+    def test_stream_does_not_depend_on_chunk_size(self):
+        generator = eqgenerator.EarthquakeGenerator(fs=50.0, P_noise_db=0.,
+                                                    bfirls=np.hanning(21))
+        event_t, event_p = [100., 30., 31.5, 290.], [10., 20., 15., 5.]
+        x = np.concatenate(list(generator.generate_stream(
+            300., event_t, event_p, chunk_size=15001, random_state=3)))
+        self.assertEqual(len(x), 15001)
+        for chunk_size in (1000, 777):
+            chunks = list(generator.generate_stream(
+                300., event_t, event_p, chunk_size=chunk_size, random_state=3))
+            self.assertTrue(max(len(chunk) for chunk in chunks) <= chunk_size)
+            self.assertTrue(np.allclose(np.concatenate(chunks), x))
+
+    def test_stream_contains_events_with_given_power(self):
+        generator = eqgenerator.EarthquakeGenerator(fs=50.0, P_noise_db=-200.)
+        event_t, event_p = [100., 30., 200.], [10., 20., 15.]
+        x = np.concatenate(list(generator.generate_stream(
+            300., event_t, event_p, chunk_size=1000, random_state=3)))
+        self.assertTrue(np.all(np.abs(x[:1500]) < 1e-6))
+        for t, p in zip(event_t, event_p):
+            n0 = int(t * 50.0)
+            self.assertAlmostEqual(10 * np.log10(np.var(x[n0:n0 + 250])), p, 1)
+        self.assertRaises(ValueError, generator.generate_stream, 300., [301.], [5.])
+
+
+class Check_generator_output(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.generator = imp.load_source('apasvo_generator',
+                                         'bin/apasvo-generator.py')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @unittest.skipIf(obspy is None, "obspy is not available")
+    def test_mseed_output_returns_same_data(self):
+        filename = os.path.join(self.tmpdir, 'signal.mseed')
+        blocks = [np.random.randn(1000), np.random.randn(500)]
+        self.generator.write_signal(filename, iter(blocks), 'mseed',
+                                    'float64', 'native', 50.0)
+        stream = obspy.read(filename).merge()
+        self.assertEqual(len(stream), 1)
+        self.assertEqual(stream[0].stats.sampling_rate, 50.0)
+        self.assertEqual(stream[0].stats.starttime, obspy.UTCDateTime(0))
+        self.assertTrue(np.all(stream[0].data == np.concatenate(blocks)))
+
+
 if __name__ == "__main__":
     unittest.main()
-
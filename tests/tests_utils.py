@@ -26,10 +26,17 @@
   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
+from scipy import signal
 
+from apasvo.utils import fftutils
 from apasvo.utils import plotting
+from apasvo.utils import resample
+from apasvo.utils.formats import rawfile
 
 
 class Check_utils_plotting_reduce_data(unittest.TestCase):
@@ -60,6 +67,86 @@ class Check_utils_plotting_reduce_data(unittest.TestCase):
         self.assertRaises(ValueError, plotting.reduce_data, self.xdata,
                           self.ydata, self.width, 6, -5)
 
+
+class Check_utils_resample(unittest.TestCase):
+
+    def test_decimation_factor_returns_correct_results(self):
+        self.assertEqual(resample.decimation_factor(200., 15.), 5)
+        self.assertEqual(resample.decimation_factor(50., 15.), 1)
+        self.assertEqual(resample.decimation_factor(100., 60.), 1)
+        self.assertRaises(ValueError, resample.decimation_factor, 100., 0.)
+
+    def test_decimate_equals_filtering_and_downsampling(self):
+        for n in (1, 5, 100, 1001):
+            x = np.random.randn(n)
+            self.assertTrue(np.all(resample.decimate(x, 1) == x))
+            for q in (2, 3, 7):
+                half = resample.FILTER_HALF_LENGTH * q
+                h = signal.firwin(2 * half + 1, 1. / q)
+                expected = np.convolve(x, h)[half:half + n][::q]
+                out = resample.decimate(x, q)
+                self.assertEqual(len(out), len(x[::q]))
+                self.assertTrue(np.allclose(out, expected))
+
+    def test_decimate_removes_aliased_frequencies(self):
+        t = np.arange(20000) / 200.
+        x = np.sin(2 * np.pi * 10 * t) + np.sin(2 * np.pi * 45 * t)
+        out = resample.decimate(x, 5)
+        expected = np.sin(2 * np.pi * 10 * t[::5])
+        self.assertTrue(np.allclose(out[50:-50], expected[50:-50], atol=1e-2))
+
+    def test_interpolate_returns_original_length(self):
+        y = np.arange(10.)
+        out = resample.interpolate(y, 4, 40)
+        self.assertEqual(len(out), 40)
+        self.assertTrue(np.allclose(out[:37], np.arange(37) / 4.))
+        self.assertTrue(np.all(out[37:] == 9.))
+
+
+class Check_utils_fftutils(unittest.TestCase):
+
+    def test_fir_filter_equals_lfilter(self):
+        for taps in (1, 5, 200):
+            b = np.random.randn(taps)
+            x = np.random.randn(3, 1001)
+            expected = signal.lfilter(b, 1, x, axis=-1)
+            for method in ('auto', 'direct', 'fft'):
+                out = fftutils.fir_filter(b, x, method=method)
+                self.assertEqual(out.shape, x.shape)
+                self.assertTrue(np.allclose(out, expected))
+        self.assertRaises(ValueError, fftutils.fir_filter, b, x, None, 'iir')
+
+    def test_fir_filter_keeps_state_between_chunks(self):
+        for taps in (5, 200):
+            b = np.random.randn(taps)
+            x = np.random.randn(1001)
+            expected = signal.lfilter(b, 1, x)
+            for method in ('direct', 'fft'):
+                zi = np.zeros(taps - 1)
+                out = []
+                for i in xrange(0, len(x), 150):
+                    y, zi = fftutils.fir_filter(b, x[i:i + 150], zi, method)
+                    out.append(y)
+                self.assertTrue(np.allclose(np.concatenate(out), expected))
+
+
+class Check_utils_rawfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_in_blocks_returns_same_data_as_write(self):
+        x = np.random.randn(1000)
+        for file_class in (rawfile.BinFile, rawfile.TextFile):
+            fhandler = file_class(os.path.join(self.tmpdir, 'data'),
+                                  dtype='float32')
+            blocks = (x[i:i + 300] for i in xrange(0, len(x), 300))
+            fhandler.write_in_blocks(blocks, header='header')
+            self.assertTrue(np.allclose(fhandler.read(), x.astype('float32')))
+
+
 if __name__ == "__main__":
     unittest.main()
-